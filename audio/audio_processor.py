@@ -1,14 +1,13 @@
 import os
+import json
 import base64
-from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, TIT2, TPE1, APIC, TALB, TPE2, TDRC, TCON, TRCK, TPOS, TIT3, COMM, TENC
-from mutagen.flac import FLAC, Picture
-from mutagen.mp4 import MP4, MP4Cover
-from mutagen.oggvorbis import OggVorbis
-from mutagen.oggopus import OggOpus
+import hashlib
 
 from utils.metadata import extract_metadata
 
+# Модули mutagen импортируются внутри методов: при запуске грузится только
+# тот формат, который действительно встретился
+
 
 class UnsupportedAudioFormatError(Exception):
     pass
@@ -17,21 +16,53 @@ class UnsupportedAudioFormatError(Exception):
 class AudioProcessor:
     """Класс для обработки аудио файлов"""
 
+    # Версия правил записи тегов: при её изменении обновление библиотеки (--refresh)
+    # перезаписывает теги всех файлов, даже если метаданные в каталоге не менялись
+    TAGS_VERSION = 1
+
+    # Собственные теги: по ним обновление библиотеки находит трек и понимает, актуальны ли теги
+    TRACK_ID_TAG = 'yandex_track_id'
+    ALBUM_ID_TAG = 'yandex_album_id'
+    DIGEST_TAG = 'yandex_tags_digest'
+
+    # Поля метаданных, общие для всех треков альбома (utils.metadata.AlbumContext)
+    ALBUM_FIELDS = ('album', 'album_artist', 'year', 'genre', 'total_discs')
+
+    # Теги, которые считаются по звуку, а не по метаданным: при перезаписи тегов сохраняются
+    REPLAYGAIN_TAGS = tuple(
+        f'replaygain_{scope}_{field}' for scope in ('track', 'album') for field in ('gain', 'peak')
+    )
+
+    @staticmethod
+    def common_tags_mp3(metadata):
+        """Кадры MP3, одинаковые для всех треков альбома"""
+        from mutagen.id3 import TALB, TPE2, TDRC, TCON, COMM, TENC
+
+        tags = {}
+        if metadata.get('album'):
+            tags['TALB'] = TALB(encoding=3, text=metadata['album'])
+        if metadata.get('album_artist'):
+            tags['TPE2'] = TPE2(encoding=3, text=metadata['album_artist'])
+        if metadata.get('year'):
+            tags['TDRC'] = TDRC(encoding=3, text=metadata['year'])
+        if metadata.get('genre'):
+            tags['TCON'] = TCON(encoding=3, text=metadata['genre'])
+        tags['COMM'] = COMM(encoding=3, lang='eng', desc='', text='Downloaded from Yandex Music')
+        tags['TENC'] = TENC(encoding=3, text='Yandex Music Downloader')
+        return tags
+
     @staticmethod
-    def process_mp3(audio, metadata):
+    def process_mp3(audio, metadata, common_tags=None):
         """Применяет теги для MP3"""
+        from mutagen.id3 import TIT2, TPE1, TRCK, TPOS, TIT3
+
+        if common_tags is None:
+            common_tags = AudioProcessor.common_tags_mp3(metadata)
+
         if metadata.get('title'):
             audio['TIT2'] = TIT2(encoding=3, text=metadata['title'])
         if metadata.get('artist'):
             audio['TPE1'] = TPE1(encoding=3, text=metadata['artist'])
-        if metadata.get('album'):
-            audio['TALB'] = TALB(encoding=3, text=metadata['album'])
-        if metadata.get('album_artist'):
-            audio['TPE2'] = TPE2(encoding=3, text=metadata['album_artist'])
-        if metadata.get('year'):
-            audio['TDRC'] = TDRC(encoding=3, text=metadata['year'])
-        if metadata.get('genre'):
-            audio['TCON'] = TCON(encoding=3, text=metadata['genre'])
         if metadata.get('track_number'):
             track_text = metadata['track_number']
             if metadata.get('total_tracks'):
@@ -44,51 +75,71 @@ class AudioProcessor:
             audio['TPOS'] = TPOS(encoding=3, text=disc_text)
         if metadata.get('version'):
             audio['TIT3'] = TIT3(encoding=3, text=metadata['version'])
-        audio['COMM'] = COMM(encoding=3, lang='eng', desc='', text='Downloaded from Yandex Music')
-        audio['TENC'] = TENC(encoding=3, text='Yandex Music Downloader')
+        for key, frame in common_tags.items():
+            audio[key] = frame
 
     @staticmethod
-    def process_flac_ogg(audio, metadata):
+    def common_tags_flac_ogg(metadata):
+        """Теги FLAC/OGG/OPUS, одинаковые для всех треков альбома"""
+        tags = {}
+        if metadata.get('album'):
+            tags['album'] = metadata['album']
+        if metadata.get('album_artist'):
+            tags['albumartist'] = metadata['album_artist']
+        if metadata.get('year'):
+            tags['date'] = metadata['year']
+        if metadata.get('genre'):
+            tags['genre'] = metadata['genre']
+        if metadata.get('total_discs'):
+            tags['disctotal'] = metadata['total_discs']
+        tags['comment'] = 'Downloaded from Yandex Music'
+        return tags
+
+    @staticmethod
+    def process_flac_ogg(audio, metadata, common_tags=None):
         """Применяет теги для FLAC/OGG/OPUS"""
+        if common_tags is None:
+            common_tags = AudioProcessor.common_tags_flac_ogg(metadata)
+
         if metadata.get('title'):
             audio['title'] = metadata['title']
         if metadata.get('artist'):
             audio['artist'] = metadata['artist']
-        if metadata.get('album'):
-            audio['album'] = metadata['album']
-        if metadata.get('album_artist'):
-            audio['albumartist'] = metadata['album_artist']
-        if metadata.get('year'):
-            audio['date'] = metadata['year']
-        if metadata.get('genre'):
-            audio['genre'] = metadata['genre']
         if metadata.get('track_number'):
             audio['tracknumber'] = metadata['track_number']
         if metadata.get('total_tracks'):
             audio['tracktotal'] = metadata['total_tracks']
         if metadata.get('disc_number'):
             audio['discnumber'] = metadata['disc_number']
-        if metadata.get('total_discs'):
-            audio['disctotal'] = metadata['total_discs']
         if metadata.get('version'):
             audio['version'] = metadata['version']
-        audio['comment'] = 'Downloaded from Yandex Music'
+        for key, value in common_tags.items():
+            audio[key] = value
 
     @staticmethod
-    def process_mp4(audio, metadata):
+    def common_tags_mp4(metadata):
+        """Атомы MP4/M4A, одинаковые для всех треков альбома"""
+        tags = {}
+        if metadata.get('album'):
+            tags['\xa9alb'] = metadata['album']
+        if metadata.get('album_artist'):
+            tags['aART'] = metadata['album_artist']
+        if metadata.get('year'):
+            tags['\xa9day'] = metadata['year']
+        if metadata.get('genre'):
+            tags['\xa9gen'] = metadata['genre']
+        return tags
+
+    @staticmethod
+    def process_mp4(audio, metadata, common_tags=None):
         """Применяет теги для MP4/M4A"""
+        if common_tags is None:
+            common_tags = AudioProcessor.common_tags_mp4(metadata)
+
         if metadata.get('title'):
             audio['\xa9nam'] = metadata['title']
         if metadata.get('artist'):
             audio['\xa9ART'] = metadata['artist']
-        if metadata.get('album'):
-            audio['\xa9alb'] = metadata['album']
-        if metadata.get('album_artist'):
-            audio['aART'] = metadata['album_artist']
-        if metadata.get('year'):
-            audio['\xa9day'] = metadata['year']
-        if metadata.get('genre'):
-            audio['\xa9gen'] = metadata['genre']
         if metadata.get('track_number'):
             track_num = int(metadata['track_number'])
             total_tracks_num = int(metadata['total_tracks']) if metadata.get('total_tracks') else 0
@@ -97,6 +148,8 @@ class AudioProcessor:
             disc_num = int(metadata['disc_number'])
             total_discs_num = int(metadata['total_discs']) if metadata.get('total_discs') else 0
             audio['disk'] = [(disc_num, total_discs_num)]
+        for key, value in common_tags.items():
+            audio[key] = value
 
         comment_parts = []
         if metadata.get('version'):
@@ -105,35 +158,144 @@ class AudioProcessor:
         audio['\xa9cmt'] = ' | '.join(comment_parts)
 
     @staticmethod
-    def add_cover_mp3(audio, cover_data):
-        """Добавляет обложку для MP3"""
-        audio['APIC'] = APIC(
-            encoding=3,
-            mime='image/jpeg',
-            type=3,
-            desc='Cover',
-            data=cover_data
-        )
+    def cover_frame(kind, cover_data):
+        """Готовый кадр обложки для формата kind ('mp3', 'flac', 'ogg', 'mp4')"""
+        if kind == 'mp3':
+            from mutagen.id3 import APIC
+
+            return APIC(encoding=3, mime='image/jpeg', type=3, desc='Cover', data=cover_data)
+        if kind == 'flac':
+            from mutagen.flac import Picture
+
+            image = Picture()
+            image.type = 3
+            image.mime = 'image/jpeg'
+            image.desc = 'Cover'
+            image.data = cover_data
+            return image
+        if kind == 'ogg':
+            return base64.b64encode(cover_data).decode('ascii')
+        if kind == 'mp4':
+            from mutagen.mp4 import MP4Cover
+
+            return MP4Cover(cover_data, imageformat=MP4Cover.FORMAT_JPEG)
+        return None
 
     @staticmethod
-    def add_cover_flac(audio, cover_data):
+    def attach_cover(audio, kind, frame):
+        """Добавляет готовый кадр обложки (см. cover_frame)"""
+        if kind == 'mp3':
+            audio['APIC'] = frame
+        elif kind == 'flac':
+            audio.add_picture(frame)
+        elif kind == 'ogg':
+            audio['metadata_block_picture'] = [frame]
+        elif kind == 'mp4':
+            audio['covr'] = [frame]
+
+    @classmethod
+    def add_cover_mp3(cls, audio, cover_data):
+        """Добавляет обложку для MP3"""
+        cls.attach_cover(audio, 'mp3', cls.cover_frame('mp3', cover_data))
+
+    @classmethod
+    def add_cover_flac(cls, audio, cover_data):
         """Добавляет обложку для FLAC"""
-        image = Picture()
-        image.type = 3
-        image.mime = 'image/jpeg'
-        image.desc = 'Cover'
-        image.data = cover_data
-        audio.add_picture(image)
+        cls.attach_cover(audio, 'flac', cls.cover_frame('flac', cover_data))
 
-    @staticmethod
-    def add_cover_ogg(audio, cover_data):
+    @classmethod
+    def add_cover_ogg(cls, audio, cover_data):
         """Добавляет обложку для OGG/OPUS"""
-        audio['metadata_block_picture'] = [base64.b64encode(cover_data).decode('ascii')]
+        cls.attach_cover(audio, 'ogg', cls.cover_frame('ogg', cover_data))
 
-    @staticmethod
-    def add_cover_mp4(audio, cover_data):
+    @classmethod
+    def add_cover_mp4(cls, audio, cover_data):
         """Добавляет обложку для MP4/M4A"""
-        audio['covr'] = [MP4Cover(cover_data, imageformat=MP4Cover.FORMAT_JPEG)]
+        cls.attach_cover(audio, 'mp4', cls.cover_frame('mp4', cover_data))
+
+    @staticmethod
+    def set_custom_tag(audio, kind, key, value):
+        """Записывает произвольный текстовый тег: TXXX в MP3, freeform-атом в MP4, поле комментария в FLAC/OGG"""
+        if kind == 'mp3':
+            from mutagen.id3 import TXXX
+
+            if audio.tags is None:
+                audio.add_tags()
+            audio.tags.add(TXXX(encoding=3, desc=key.upper(), text=value))
+        elif kind == 'mp4':
+            from mutagen.mp4 import MP4FreeForm
+
+            audio[f'----:com.apple.iTunes:{key}'] = [MP4FreeForm(value.encode('utf-8'))]
+        else:
+            audio[key] = value
+
+    @staticmethod
+    def get_custom_tag(audio, kind, key):
+        """Значение тега, записанного set_custom_tag (None, если его нет)"""
+        if audio.tags is None:
+            return None
+        if kind == 'mp3':
+            frame = audio.tags.get(f'TXXX:{key.upper()}')
+            return str(frame.text[0]) if frame is not None and frame.text else None
+        if kind == 'mp4':
+            values = audio.tags.get(f'----:com.apple.iTunes:{key}')
+            return bytes(values[0]).decode('utf-8', 'replace') if values else None
+        values = audio.tags.get(key)
+        return values[0] if values else None
+
+    @classmethod
+    def write_replaygain(cls, file_path, scope, gain, peak):
+        """Записывает теги ReplayGain трека или альбома (scope — 'track' или 'album'): усиление в дБ и пик"""
+        audio, kind = cls.open_audio(file_path)
+        cls.set_custom_tag(audio, kind, f'replaygain_{scope}_gain', f'{gain:.2f} dB')
+        cls.set_custom_tag(audio, kind, f'replaygain_{scope}_peak', f'{peak:.6f}')
+        audio.save()
+
+    @classmethod
+    def read_identity(cls, file_path):
+        """Трек, альбом и отпечаток тегов, записанные process_audio: (track_id, album_id, digest), None — нет тега"""
+        audio, kind = cls.open_audio(file_path)
+        return tuple(cls.get_custom_tag(audio, kind, key) for key in (cls.TRACK_ID_TAG, cls.ALBUM_ID_TAG, cls.DIGEST_TAG))
+
+    @staticmethod
+    def cover_uri(track, album_context=None):
+        """Адрес обложки, которая попадёт в файл: обложка альбома или самого трека"""
+        if album_context is not None and album_context.cover_uri:
+            return album_context.cover_uri
+        return getattr(track, 'cover_uri', None)
+
+    @classmethod
+    def tags_digest(cls, metadata, cover_uri=None):
+        """Отпечаток набора тегов: метаданные, обложка и версия правил записи"""
+        payload = json.dumps([cls.TAGS_VERSION, metadata, cover_uri], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def open_audio(file_path):
+        """Открывает файл через mutagen по расширению.
+
+        Возвращает кортеж (audio, kind), где kind — одно из 'mp3', 'flac', 'mp4', 'ogg'.
+        """
+        file_extension = os.path.splitext(file_path)[1].lower()
+
+        if file_extension == '.mp3':
+            from mutagen.mp3 import MP3
+            from mutagen.id3 import ID3
+            return MP3(file_path, ID3=ID3), 'mp3'
+        if file_extension == '.flac':
+            from mutagen.flac import FLAC
+            return FLAC(file_path), 'flac'
+        if file_extension in ['.m4a', '.mp4']:
+            from mutagen.mp4 import MP4
+            return MP4(file_path), 'mp4'
+        if file_extension in ['.ogg', '.oga']:
+            from mutagen.oggvorbis import OggVorbis
+            return OggVorbis(file_path), 'ogg'
+        if file_extension == '.opus':
+            from mutagen.oggopus import OggOpus
+            return OggOpus(file_path), 'ogg'
+
+        raise UnsupportedAudioFormatError(f"Неподдерживаемый формат аудио: {file_extension}")
 
     @classmethod
     def process_audio(
@@ -145,29 +307,29 @@ class AudioProcessor:
         total_tracks=None,
         total_discs=None,
         metadata_cache=None,
+        album_context=None,
     ):
-        """Применяет все доступные теги и обложку к аудио файлу"""
-        file_extension = os.path.splitext(temp_file_path)[1].lower()
+        """Применяет все доступные теги и обложку к аудио файлу.
+
+        С album_context (utils.metadata.AlbumContext) общие кадры тегов и кадр
+        обложки собираются один раз на альбом для каждого формата.
 
+        Кроме обычных тегов в файл пишутся идентификаторы трека и альбома и
+        отпечаток тегов (tags_digest) — по ним работает обновление библиотеки
+        (downloader.refresher). Теги ReplayGain при перезаписи сохраняются.
+        """
         # Открываем файл
-        if file_extension == '.mp3':
-            audio = MP3(temp_file_path, ID3=ID3)
-        elif file_extension == '.flac':
-            audio = FLAC(temp_file_path)
-        elif file_extension in ['.m4a', '.mp4']:
-            audio = MP4(temp_file_path)
-        elif file_extension in ['.ogg', '.oga']:
-            audio = OggVorbis(temp_file_path)
-        elif file_extension == '.opus':
-            audio = OggOpus(temp_file_path)
-        else:
-            raise UnsupportedAudioFormatError(f"Неподдерживаемый формат аудио: {file_extension}")
+        audio, kind = cls.open_audio(temp_file_path)
+        replaygain = {key: cls.get_custom_tag(audio, kind, key) for key in cls.REPLAYGAIN_TAGS}
 
         # Очистка старых тегов
         if hasattr(audio, 'clear'):
             audio.clear()
         elif hasattr(audio, 'delete'):
             audio.delete()
+        if kind == 'flac':
+            # Картинки FLAC хранятся отдельно от комментариев: иначе обложки копятся при каждой перезаписи
+            audio.clear_pictures()
 
         # Извлекаем метаданные
         metadata = extract_metadata(
@@ -176,25 +338,54 @@ class AudioProcessor:
             total_tracks=total_tracks,
             total_discs=total_discs,
             metadata_cache=metadata_cache,
+            album_context=album_context,
         )
 
         # Применяем теги в зависимости от формата
-        if isinstance(audio, MP3):
-            cls.process_mp3(audio, metadata)
-        elif isinstance(audio, (FLAC, OggVorbis, OggOpus)):
-            cls.process_flac_ogg(audio, metadata)
-        elif isinstance(audio, MP4):
-            cls.process_mp4(audio, metadata)
+        if kind == 'mp3':
+            build_common = cls.common_tags_mp3
+            apply_tags = cls.process_mp3
+        elif kind in ('flac', 'ogg'):
+            build_common = cls.common_tags_flac_ogg
+            apply_tags = cls.process_flac_ogg
+        else:
+            build_common = cls.common_tags_mp4
+            apply_tags = cls.process_mp4
+
+        album_metadata = album_context.common_metadata() if album_context is not None else None
+        if album_metadata is not None and all(
+            metadata.get(field) == album_metadata.get(field) for field in cls.ALBUM_FIELDS
+        ):
+            # Общие кадры строятся только из полей альбома: год или жанр, взятые у трека, в них не попадают
+            common_tags = album_context.shared(
+                ('tags', build_common.__name__), lambda: build_common(album_metadata),
+            )
+        else:
+            common_tags = build_common(metadata)
+        apply_tags(audio, metadata, common_tags)
 
         # Применяем обложку
         if downloaded_cover:
-            if isinstance(audio, MP3):
-                cls.add_cover_mp3(audio, downloaded_cover)
-            elif isinstance(audio, FLAC):
-                cls.add_cover_flac(audio, downloaded_cover)
-            elif isinstance(audio, (OggVorbis, OggOpus)):
-                cls.add_cover_ogg(audio, downloaded_cover)
-            elif isinstance(audio, MP4):
-                cls.add_cover_mp4(audio, downloaded_cover)
-
-        audio.save()
\ No newline at end of file
+            if album_context is not None:
+                frame = album_context.shared(('cover', kind), lambda: cls.cover_frame(kind, downloaded_cover))
+            else:
+                frame = cls.cover_frame(kind, downloaded_cover)
+            cls.attach_cover(audio, kind, frame)
+
+        # Идентификаторы и отпечаток тегов для обновления библиотеки
+        album = album_context.album_id if album_context is not None else None
+        if album is None and getattr(track, 'albums', None):
+            album = getattr(track.albums[0], 'id', None)
+        # В отпечаток входит адрес обложки, даже если скачать её не удалось: иначе обновление
+        # библиотеки перезаписывало бы теги файла и запрашивало обложку при каждом запуске
+        cover_uri = cls.cover_uri(track, album_context)
+        if getattr(track, 'id', None) is not None:
+            cls.set_custom_tag(audio, kind, cls.TRACK_ID_TAG, str(track.id))
+        if album is not None:
+            cls.set_custom_tag(audio, kind, cls.ALBUM_ID_TAG, str(album))
+        cls.set_custom_tag(audio, kind, cls.DIGEST_TAG, cls.tags_digest(metadata, cover_uri))
+        for key, value in replaygain.items():
+            if value is not None:
+                cls.set_custom_tag(audio, kind, key, value)
+
+        audio.save()
@@ -0,0 +1,458 @@
+import logging
+import math
+import multiprocessing
+import os
+import re
+import shutil
+import struct
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+from .audio_processor import AudioProcessor
+
+
+logger = logging.getLogger(__name__)
+
+# Громкость, к которой приводит ReplayGain 2.0 (LUFS)
+REFERENCE_LOUDNESS = -18.0
+
+# Пороги стробирования по ITU-R BS.1770: абсолютный и относительный
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+# Блок копирования кадров FLAC из контейнера MP4
+COPY_CHUNK = 1024 * 1024
+
+# Атомы MP4, внутри которых ищутся описание дорожки и таблицы сэмплов
+_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"mvex", b"moof", b"traf", b"edts"}
+
+# Строка кадра фильтра ebur128: t — время, M — громкость окна 400 мс с шагом 100 мс
+_FRAME_RE = re.compile(r"\bt:\s*(\d+(?:\.\d+)?)\s.*?\bM:\s*(-?(?:\d+(?:\.\d+)?|inf))")
+_PEAK_RE = re.compile(r"\bPeak:\s*(-?(?:\d+(?:\.\d+)?|inf))\s*dBFS")
+
+
+class PostProcessError(Exception):
+    pass
+
+
+def _boxes(data: bytes, start: int = 0, end: Optional[int] = None):
+    """Атомы MP4 в data[start:end]: (тип, начало атома, начало содержимого, конец атома)"""
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", data, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            raise PostProcessError(f"повреждён атом {kind!r}")
+        yield kind, offset, offset + header, min(offset + size, end)
+        offset += size
+
+
+def _file_boxes(f):
+    """Атомы верхнего уровня файла: (тип, смещение, длина заголовка, размер); mdat не читается"""
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    offset = 0
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        header = f.read(16)
+        size, kind = struct.unpack_from(">I4s", header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", header, 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - offset
+        if size < header_size:
+            raise PostProcessError(f"повреждён атом {kind!r}")
+        yield kind, offset, header_size, size
+        offset += size
+
+
+def _find(data: bytes, path: Tuple[bytes, ...], start: int = 0, end: Optional[int] = None):
+    """Все атомы по пути path (например, (b"trak", b"mdia")) — как (начало содержимого, конец)"""
+    for kind, _, body, box_end in _boxes(data, start, end):
+        if kind != path[0]:
+            continue
+        if len(path) == 1:
+            yield body, box_end
+        elif kind in _CONTAINERS:
+            yield from _find(data, path[1:], body, box_end)
+
+
+def _first(data: bytes, path: Tuple[bytes, ...], start: int = 0, end: Optional[int] = None):
+    return next(_find(data, path, start, end), None)
+
+
+def _flac_metadata(moov: bytes) -> Optional[bytes]:
+    """Блоки метаданных FLAC из описания дорожки (stsd → fLaC → dfLa) или None, если в MP4 не FLAC"""
+    stsd = _first(moov, (b"trak", b"mdia", b"minf", b"stbl", b"stsd"))
+    if stsd is None:
+        return None
+    body, end = stsd
+    # Полный атом (версия и флаги) и число записей, затем записи описания сэмплов
+    for kind, _, entry_body, entry_end in _boxes(moov, body + 8, end):
+        if kind != b"fLaC":
+            continue
+        # Звуковая запись: 28 байт полей до вложенных атомов
+        dfla = _first(moov, (b"dfLa",), entry_body + 28, entry_end)
+        if dfla is not None:
+            return moov[dfla[0] + 4:dfla[1]]
+    return None
+
+
+def _sample_table(moov: bytes) -> List[Tuple[int, int]]:
+    """Сэмплы нефрагментированного MP4 по таблицам stsz, stsc и stco/co64: [(смещение, размер)]"""
+    stbl = _first(moov, (b"trak", b"mdia", b"minf", b"stbl"))
+    if stbl is None:
+        return []
+    stsz = _first(moov, (b"stsz",), *stbl)
+    stsc = _first(moov, (b"stsc",), *stbl)
+    chunks = _first(moov, (b"stco",), *stbl)
+    wide = chunks is None
+    if wide:
+        chunks = _first(moov, (b"co64",), *stbl)
+    if stsz is None or stsc is None or chunks is None:
+        return []
+
+    uniform, count = struct.unpack_from(">II", moov, stsz[0] + 4)
+    sizes = [uniform] * count if uniform else list(struct.unpack_from(f">{count}I", moov, stsz[0] + 12))
+    chunk_count = struct.unpack_from(">I", moov, chunks[0] + 4)[0]
+    offsets = struct.unpack_from(f">{chunk_count}{'Q' if wide else 'I'}", moov, chunks[0] + 8)
+    entry_count = struct.unpack_from(">I", moov, stsc[0] + 4)[0]
+    runs = [struct.unpack_from(">III", moov, stsc[0] + 8 + 12 * i)[:2] for i in range(entry_count)]
+
+    samples = []
+    sample = 0
+    for index, (first_chunk, per_chunk) in enumerate(runs):
+        last_chunk = runs[index + 1][0] - 1 if index + 1 < len(runs) else chunk_count
+        for chunk in range(first_chunk, last_chunk + 1):
+            offset = offsets[chunk - 1]
+            for size in sizes[sample:sample + per_chunk]:
+                samples.append((offset, size))
+                offset += size
+            sample += per_chunk
+    return samples
+
+
+def _fragment_samples(moof: bytes, moof_offset: int, default_size: int) -> List[Tuple[int, int]]:
+    """Сэмплы одного фрагмента (moof → traf → tfhd, trun): [(смещение в файле, размер)].
+    moof — атом целиком, moof_offset — его начало в файле (базовое смещение по умолчанию)"""
+    samples = []
+    for traf in _find(moof, (b"moof", b"traf")):
+        tfhd = _first(moof, (b"tfhd",), *traf)
+        if tfhd is None:
+            continue
+        flags = struct.unpack_from(">I", moof, tfhd[0])[0] & 0xFFFFFF
+        position = tfhd[0] + 8
+        base = moof_offset
+        if flags & 0x1:
+            base = struct.unpack_from(">Q", moof, position)[0]
+            position += 8
+        if flags & 0x2:
+            position += 4
+        if flags & 0x8:
+            position += 4
+        size = default_size
+        if flags & 0x10:
+            size = struct.unpack_from(">I", moof, position)[0]
+
+        offset = base
+        for trun, _ in _find(moof, (b"trun",), *traf):
+            run_flags, count = struct.unpack_from(">II", moof, trun)
+            run_flags &= 0xFFFFFF
+            position = trun + 8
+            if run_flags & 0x1:
+                offset = base + struct.unpack_from(">i", moof, position)[0]
+                position += 4
+            if run_flags & 0x4:
+                position += 4
+            fields = [bit for bit in (0x100, 0x200, 0x400, 0x800) if run_flags & bit]
+            for _ in range(count):
+                sample_size = size
+                for bit in fields:
+                    if bit == 0x200:
+                        sample_size = struct.unpack_from(">I", moof, position)[0]
+                    position += 4
+                samples.append((offset, sample_size))
+                offset += sample_size
+    return samples
+
+
+def _merge(samples: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Склеивает соседние сэмплы в непрерывные участки: копирование большими блоками"""
+    ranges = []
+    for offset, size in samples:
+        if ranges and ranges[-1][0] + ranges[-1][1] == offset:
+            ranges[-1] = (ranges[-1][0], ranges[-1][1] + size)
+        else:
+            ranges.append((offset, size))
+    return ranges
+
+
+def remux_flac_mp4(source: str, destination: str) -> bool:
+    """Перепаковывает FLAC из контейнера MP4 в обычный FLAC без перекодирования.
+
+    Кадры FLAC копируются как есть в порядке таблицы сэмплов (обычный или
+    фрагментированный MP4), блоки метаданных берутся из атома dfLa.
+    Возвращает False, если в файле не FLAC (тогда destination не создаётся).
+    """
+    with open(source, "rb") as f:
+        moov = None
+        fragments = []
+        for kind, offset, header, size in _file_boxes(f):
+            if kind == b"moov":
+                f.seek(offset + header)
+                moov = f.read(size - header)
+            elif kind == b"moof":
+                f.seek(offset)
+                fragments.append((offset, f.read(size)))
+        if moov is None:
+            raise PostProcessError("нет атома moov")
+
+        metadata = _flac_metadata(moov)
+        if metadata is None:
+            return False
+
+        samples = _sample_table(moov)
+        if fragments:
+            trex = _first(moov, (b"mvex", b"trex"))
+            default_size = struct.unpack_from(">I", moov, trex[0] + 16)[0] if trex else 0
+            for offset, moof in fragments:
+                samples.extend(_fragment_samples(moof, offset, default_size))
+        if not samples:
+            raise PostProcessError("в контейнере нет кадров FLAC")
+
+        try:
+            with open(destination, "wb") as out:
+                out.write(b"fLaC")
+                out.write(metadata)
+                for offset, size in _merge(samples):
+                    f.seek(offset)
+                    while size > 0:
+                        block = f.read(min(size, COPY_CHUNK))
+                        if not block:
+                            raise PostProcessError("файл обрывается внутри кадра FLAC")
+                        out.write(block)
+                        size -= len(block)
+        except BaseException:
+            if os.path.exists(destination):
+                os.unlink(destination)
+            raise
+    return True
+
+
+def measure_loudness(file_path: str, ffmpeg: str, timeout: float = 600.0) -> Optional[Tuple[List[float], float]]:
+    """Громкость блоков 400 мс (LUFS) и пиковый уровень сэмпла (dBFS) по фильтру ebur128 утилиты ffmpeg.
+    None — если в файле нет звука, по которому можно посчитать громкость"""
+    try:
+        result = subprocess.run(
+            [
+                ffmpeg, "-nostdin", "-hide_banner", "-nostats", "-loglevel", "verbose", "-i", file_path,
+                "-map", "0:a:0", "-filter:a", "ebur128=peak=sample", "-f", "null", "-",
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        raise PostProcessError("анализ громкости не уложился в отведённое время")
+    output = result.stderr.decode("utf-8", "replace")
+    if result.returncode != 0:
+        lines = output.strip().splitlines()
+        raise PostProcessError(f"ffmpeg завершился с ошибкой: {lines[-1] if lines else result.returncode}")
+
+    blocks = []
+    for match in _FRAME_RE.finditer(output):
+        # До 0,4 с окно заполнено не целиком
+        if float(match.group(1)) >= 0.4 - 1e-6:
+            blocks.append(float(match.group(2)))
+    peaks = _PEAK_RE.findall(output)
+    if not blocks or not peaks:
+        return None
+    return blocks, float(peaks[-1])
+
+
+def integrated_loudness(blocks: List[float]) -> Optional[float]:
+    """Интегральная громкость (LUFS) по блокам 400 мс с двумя порогами стробирования BS.1770"""
+    energies = [10 ** ((block + 0.691) / 10) for block in blocks if block > ABSOLUTE_GATE]
+    if not energies:
+        return None
+    threshold = -0.691 + 10 * math.log10(sum(energies) / len(energies)) + RELATIVE_GATE
+    gated = [energy for energy in energies if -0.691 + 10 * math.log10(energy) > threshold]
+    return -0.691 + 10 * math.log10(sum(gated) / len(gated))
+
+
+def replaygain(blocks: List[float], peak_dbfs: float) -> Optional[Tuple[float, float]]:
+    """Усиление ReplayGain (дБ) и пик (доля полной шкалы); None для тишины"""
+    loudness = integrated_loudness(blocks)
+    if loudness is None:
+        return None
+    return REFERENCE_LOUDNESS - loudness, 10 ** (peak_dbfs / 20)
+
+
+def postprocess_file(file_path: str, remux: bool, ffmpeg: Optional[str], timeout: float = 600.0):
+    """Работа процесса пула: перепаковка FLAC из MP4 и анализ громкости.
+    Возвращает (путь к файлу, громкость блоков или None, ошибка анализа громкости или None).
+    Ошибка анализа не отменяет перепаковку: вызывающий получает путь к готовому FLAC"""
+    if remux:
+        destination = os.path.splitext(file_path)[0] + ".flac"
+        try:
+            remuxed = remux_flac_mp4(file_path, destination)
+        except BaseException:
+            # Недописанный FLAC не оставляем: трек сохранится как скачан
+            if os.path.exists(destination):
+                os.unlink(destination)
+            raise
+        if remuxed:
+            os.unlink(file_path)
+            file_path = destination
+    loudness, error = None, None
+    if ffmpeg:
+        try:
+            loudness = measure_loudness(file_path, ffmpeg, timeout)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+    return file_path, loudness, error
+
+
+def available_cores() -> int:
+    """Ядра, доступные процессу (с учётом привязки к процессорам)"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+
+class PostProcessor:
+    """Обработка треков после записи тегов: FLAC из MP4 в обычный FLAC и теги ReplayGain.
+
+    Тяжёлая работа (перепаковка, декодирование для анализа громкости)
+    выполняется в пуле процессов по числу ядер, чтобы не конкурировать
+    с потоками скачивания за GIL. Громкость считает утилита ffmpeg; если
+    её нет, ReplayGain отключается с предупреждением в логе, а перепаковка
+    работает без неё.
+
+    Усиление альбома записывается, когда обработаны все треки альбома:
+    громкость считается по блокам всех треков вместе, как одна запись.
+    Если часть треков не скачалась или уже была скачана раньше, усиление
+    альбома не записывается. Теги альбома дописываются в готовые файлы,
+    поэтому для архивов и S3 записывается только усиление трека.
+    """
+
+    def __init__(self, remux: bool = True, replaygain: bool = True, processes: int = 0, timeout: float = 600.0):
+        self.remux = remux
+        self.ffmpeg = shutil.which("ffmpeg") if replaygain else None
+        if replaygain and self.ffmpeg is None:
+            logger.warning("Утилита ffmpeg не найдена, теги ReplayGain не записываются")
+        self.processes = processes or available_cores()
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._albums: Dict[object, list] = {}
+
+    @classmethod
+    def from_config(cls, config) -> Optional["PostProcessor"]:
+        if not getattr(config, "POSTPROCESS_ENABLED", False):
+            return None
+        return cls(
+            remux=getattr(config, "POSTPROCESS_REMUX_FLAC", True),
+            replaygain=getattr(config, "POSTPROCESS_REPLAYGAIN", True),
+            processes=max(0, getattr(config, "POSTPROCESS_PROCESSES", 0)),
+        )
+
+    @property
+    def replaygain(self) -> bool:
+        return self.ffmpeg is not None
+
+    def applies(self, codec: Optional[str]) -> bool:
+        """Нужна ли обработка файлу с этим кодеком"""
+        return self.replaygain or (self.remux and codec == "flac-mp4")
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: в процессе работают потоки скачивания, fork мог бы унаследовать занятые блокировки
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def process(self, file_path: str, codec: Optional[str]):
+        """Обрабатывает временный файл трека в пуле процессов (ждёт результата).
+        Возвращает (путь к файлу — новый, если FLAC перепакован, громкость блоков или None)"""
+        pool = self._pool()
+        try:
+            file_path, loudness, error = pool.submit(
+                postprocess_file, file_path, self.remux and codec == "flac-mp4", self.ffmpeg, self.timeout,
+            ).result()
+        except BrokenProcessPool:
+            # Процесс пула аварийно завершился: следующий трек получит новый пул
+            with self._lock:
+                if self._executor is pool:
+                    self._executor = None
+            raise
+        if error is not None:
+            logger.warning("Не удалось измерить громкость %s: %s", file_path, error)
+        return file_path, loudness
+
+    @staticmethod
+    def write_track_gain(file_path: str, loudness) -> None:
+        gain = replaygain(*loudness) if loudness else None
+        if gain is not None:
+            AudioProcessor.write_replaygain(file_path, "track", *gain)
+
+    def track_saved(self, album_context, output_path: str, loudness) -> None:
+        """Учитывает сохранённый трек альбома; после последнего трека записывает усиление альбома"""
+        total = getattr(album_context, "total_tracks", None)
+        if not self.replaygain or album_context is None or not total:
+            return
+        # Дописать теги можно только в файл на диске
+        local_path = output_path if output_path and os.path.isfile(output_path) else None
+        with self._lock:
+            entries = self._albums.setdefault(album_context, [])
+            entries.append((local_path, loudness))
+            if len(entries) < total:
+                return
+            del self._albums[album_context]
+        self._write_album_gain(album_context, entries)
+
+    def _write_album_gain(self, album_context, entries) -> None:
+        album = getattr(album_context, "album", None)
+        if any(path is None or loudness is None for path, loudness in entries):
+            logger.info("ReplayGain альбома '%s' не записан: не все треки доступны на диске или проанализированы", album)
+            return
+        blocks = [block for _, (track_blocks, _) in entries for block in track_blocks]
+        gain = replaygain(blocks, max(peak for _, (_, peak) in entries))
+        if gain is None:
+            return
+        for path, _ in entries:
+            try:
+                AudioProcessor.write_replaygain(path, "album", *gain)
+            except Exception as e:
+                logger.warning("Не удалось записать ReplayGain альбома в %s: %s", path, e)
+        logger.info("ReplayGain альбома '%s': %.2f дБ, пик %.6f", album, *gain)
+
+    def discard(self, album_contexts) -> None:
+        """Забывает незавершённые альбомы (пачка закончилась, оставшиеся треки не придут)"""
+        with self._lock:
+            for album_context in album_contexts:
+                entries = self._albums.pop(album_context, None)
+                if entries:
+                    logger.info(
+                        "ReplayGain альбома '%s' не записан: обработано треков %s из %s",
+                        getattr(album_context, "album", None), len(entries), album_context.total_tracks,
+                    )
+
+    def close(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
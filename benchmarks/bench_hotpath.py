@@ -0,0 +1,330 @@
+"""Микробенчмарки процессорной части обработки трека: операций в секунду и память на операцию.
+
+Функции, через которые проходит каждый трек, — метаданные, кэш метаданных,
+запись тегов, расшифровка блока, определение формата и имя файла — меряются
+на синтетических данных: поддельные объекты треков, маленькие
+сгенерированные MP3/FLAC/M4A, кэш на 10 000 записей. Результат сравнивается
+с сохранённой базой (benchmarks/baseline_hotpath.json): если функция стала
+заметно медленнее или требует заметно больше памяти, скрипт печатает
+РЕГРЕССИЯ и завершается с кодом 1.
+
+Скорость сравнивается после нормировки на калибровочный цикл на чистом
+Python, который меряется непосредственно перед каждой функцией: так
+учитывается и скорость машины, и меняющаяся нагрузка на неё. Базу,
+записанную на одной машине, можно проверять на другой (с погрешностью;
+допуск задаётся --tolerance).
+
+    python benchmarks/bench_hotpath.py                  # сравнить с базой
+    python benchmarks/bench_hotpath.py --save-baseline  # записать новую базу
+    python benchmarks/bench_hotpath.py --filter metadata --min-time 0.5
+"""
+import argparse
+import gc
+import itertools
+import json
+import os
+import platform
+import shutil
+import struct
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio.audio_processor import AudioProcessor  # noqa: E402
+from downloader.transfer import _OutputFile  # noqa: E402
+from utils.file_utils import detect_audio_format, sanitize_filename  # noqa: E402
+from utils.metadata import AlbumContext, extract_metadata  # noqa: E402
+from utils.metadata_cache import MetadataCache  # noqa: E402
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_hotpath.json")
+
+KEY = "00112233445566778899aabbccddeeff"
+CACHE_ENTRIES = 10000
+COVER_SIZE = 64 * 1024
+CHUNK_SIZE = 64 * 1024
+
+# Запас по памяти, в пределах которого разница считается шумом
+MEMORY_SLACK_KB = 16
+
+
+# Синтетические данные
+
+def fake_track(index):
+    """Объект трека с теми полями, которые читают extract_metadata и запись тегов"""
+    album = SimpleNamespace(
+        id=1000 + index // 12,
+        title=f"Album {index // 12}",
+        artists=[SimpleNamespace(name="Album Artist")],
+        year=2020,
+        genre="rock",
+        track_position=SimpleNamespace(index=index % 12 + 1, volume=1),
+        cover_uri=None,
+        volumes=None,
+    )
+    return SimpleNamespace(
+        id=str(index),
+        title=f"Track {index}",
+        artists=[SimpleNamespace(name="Artist A"), SimpleNamespace(name="Artist B")],
+        albums=[album],
+        version="Remastered" if index % 5 == 0 else None,
+        duration_ms=215000,
+        cover_uri=None,
+        year=None,
+        genre=None,
+    )
+
+
+def _box(kind, body):
+    return struct.pack(">I", 8 + len(body)) + kind + body
+
+
+def _full_box(kind, body):
+    return _box(kind, bytes(4) + body)
+
+
+def make_mp3(frames=40):
+    """MPEG-1 Layer III, 128 кбит/с, 44,1 кГц: кадры по 417 байт"""
+    return (b"\xff\xfb\x90\x64" + bytes(413)) * frames
+
+
+def make_flac(audio_bytes=20000):
+    """fLaC с блоком STREAMINFO (44,1 кГц, стерео, 16 бит, 5 с) и нулями вместо кадров"""
+    streaminfo = struct.pack(">HH", 4096, 4096) + bytes(6)
+    streaminfo += struct.pack(">Q", (44100 << 44) | (1 << 41) | (15 << 36) | 44100 * 5) + bytes(16)
+    return b"fLaC" + bytes([0x80, 0, 0, 34]) + streaminfo + bytes(audio_bytes)
+
+
+def make_m4a(samples=20, sample_size=300):
+    """M4A с одной AAC-дорожкой: минимальный набор атомов, который читает и переписывает mutagen"""
+    ftyp = _box(b"ftyp", b"M4A \x00\x00\x02\x00M4A mp42isom")
+    matrix = struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+    mvhd = _full_box(
+        b"mvhd",
+        struct.pack(">IIIIIH", 0, 0, 44100, samples * 1024, 0x10000, 0x100) + bytes(10) + matrix + bytes(24)
+        + struct.pack(">I", 2),
+    )
+    mdhd = _full_box(b"mdhd", struct.pack(">IIIIHH", 0, 0, 44100, samples * 1024, 0x55C4, 0))
+    hdlr = _full_box(b"hdlr", bytes(4) + b"soun" + bytes(12) + b"SoundHandler\x00")
+    esds = _full_box(
+        b"esds", bytes.fromhex("0380808022000000048080801440150000000001f4000001f40005808080021210068080800102"),
+    )
+    # Звуковая запись: резерв, индекс ссылки на данные, резерв, каналы, разрядность, частота
+    mp4a = _box(b"mp4a", bytes(6) + struct.pack(">H", 1) + bytes(8) + struct.pack(">HHHHI", 2, 16, 0, 0, 44100 << 16)
+                + esds)
+    stsd = _full_box(b"stsd", struct.pack(">I", 1) + mp4a)
+    stts = _full_box(b"stts", struct.pack(">III", 1, samples, 1024))
+    stsz = _full_box(b"stsz", struct.pack(">II", sample_size, samples))
+    stsc = _full_box(b"stsc", struct.pack(">IIII", 1, 1, samples, 1))
+
+    def moov(mdat_offset):
+        stco = _full_box(b"stco", struct.pack(">II", 1, mdat_offset))
+        minf = _box(b"minf", _full_box(b"smhd", bytes(4)) + _box(b"stbl", stsd + stts + stsc + stsz + stco))
+        return _box(b"moov", mvhd + _box(b"trak", _box(b"mdia", mdhd + hdlr + minf)))
+
+    header = ftyp + moov(0)
+    return ftyp + moov(len(header) + 8) + _box(b"mdat", bytes(samples * sample_size))
+
+
+def make_metadata_cache(workdir, tracks):
+    """Кэш метаданных на CACHE_ENTRIES записей (файл создаётся заранее, как после долгой работы)"""
+    cache_file = os.path.join(workdir, "metadata.json")
+    probe = MetadataCache.__new__(MetadataCache)
+    entries = {}
+    for track in tracks:
+        album = track.albums[0]
+        key = probe.make_key(track.id, album.title, 12, 1, track.version)
+        entries[key] = {"metadata": extract_metadata(track, album.title, 12, 1), "ts": 4102444800.0}
+    with open(cache_file, "w", encoding="utf-8") as f:
+        json.dump(entries, f, ensure_ascii=False, indent=2)
+    return MetadataCache(cache_file, ttl_hours=0), list(entries)
+
+
+def build_cases(workdir):
+    """Список (имя, функция без аргументов)"""
+    tracks = [fake_track(index) for index in range(CACHE_ENTRIES)]
+    track = tracks[42]
+    album = track.albums[0]
+    cache, keys = make_metadata_cache(workdir, tracks)
+    album_context = AlbumContext.from_album(album, album.title, 1)
+    cover = os.urandom(COVER_SIZE)
+
+    files = {}
+    for ext, data in ((".mp3", make_mp3()), (".flac", make_flac()), (".m4a", make_m4a())):
+        files[ext] = os.path.join(workdir, "track" + ext)
+        with open(files[ext], "wb") as f:
+            f.write(data)
+
+    def tag_fresh(template):
+        # Как при скачивании: теги пишутся в только что полученный файл без тегов
+        root, ext = os.path.splitext(template)
+        path = f"{root}-work{ext}"
+        shutil.copyfile(template, path)
+        AudioProcessor.process_audio(path, track, cover, album.title, 12, 1)
+
+    key_cycle = itertools.cycle(keys)
+    entry = cache.get(keys[0])
+    output = _OutputFile(os.devnull)
+    encrypted_output = _OutputFile(os.devnull, key=KEY)
+    chunk = memoryview(bytearray(os.urandom(CHUNK_SIZE)))
+
+    cases = [
+        ("sanitize_filename", lambda: sanitize_filename('AC/DC: Back in Black? <Live> "1980"')),
+        ("extract_metadata", lambda: extract_metadata(track, album.title, 12, 1)),
+        ("extract_metadata[album_context]", lambda: extract_metadata(track, album.title, 12, 1,
+                                                                      album_context=album_context)),
+        ("extract_metadata[cache_hit]", lambda: extract_metadata(track, album.title, 12, 1, metadata_cache=cache)),
+        ("MetadataCache.get[hit]", lambda: cache.get(next(key_cycle))),
+        ("MetadataCache.get[miss]", lambda: cache.get("missing|key")),
+        ("MetadataCache.set", lambda: cache.set(next(key_cycle), entry)),
+        ("_OutputFile.write[64K]", lambda: output.write(chunk)),
+        ("_OutputFile.write[64K+AES]", lambda: encrypted_output.write(chunk)),
+    ]
+    for ext, path in files.items():
+        name = ext.lstrip(".")
+        cases.append((f"detect_audio_format[{name}]", lambda path=path: detect_audio_format(path)))
+        cases.append((f"process_audio[{name}]", lambda path=path: tag_fresh(path)))
+    return cases
+
+
+# Измерение
+
+def _calibration():
+    """Эталонная работа на чистом Python: по ней нормируется скорость машины"""
+    values = {}
+    for index in range(1000):
+        values[str(index)] = index
+    return sum(values.values())
+
+
+def measure_speed(func, min_time, repeats):
+    """Операций в секунду: лучший из repeats прогонов длительностью не меньше min_time"""
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    return number / min(timer.repeat(repeat=repeats, number=number))
+
+
+def measure_memory(func, number=50):
+    """Пик памяти за операцию (КБ) и сколько байт на операцию остаётся занятыми после неё"""
+    func()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for _ in range(number):
+            func()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (peak - before) / 1024, (current - before) / number
+
+
+def measure(func, min_time, repeats):
+    """Замер одной функции: скорость вместе с калибровкой, снятой прямо перед ней, и память"""
+    calibration = measure_speed(_calibration, min_time, repeats)
+    ops = measure_speed(func, min_time, repeats)
+    # Под tracemalloc всё много медленнее: медленным функциям хватает нескольких операций
+    peak_kb, retained = measure_memory(func, max(3, min(50, int(ops * min_time))))
+    return {
+        "ops": round(ops, 1),
+        "calibration": round(calibration, 1),
+        "peak_kb": round(peak_kb, 1),
+        "retained_bytes": round(retained),
+    }
+
+
+def compare(name, result, baseline, tolerance):
+    """Сообщение о регрессии или None"""
+    base = baseline["cases"].get(name)
+    if base is None:
+        return None
+    speed = result["ops"] / result["calibration"]
+    base_speed = base["ops"] / base["calibration"]
+    if speed < base_speed * (1 - tolerance):
+        return f"{name}: скорость {speed / base_speed:.0%} от базы"
+    if result["peak_kb"] > base["peak_kb"] * (1 + tolerance) + MEMORY_SLACK_KB:
+        return f"{name}: пик памяти {result['peak_kb']:.1f} КБ, в базе {base['peak_kb']:.1f} КБ"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--min-time", type=float, default=0.2, help="длительность одного прогона, с")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--filter", default="", help="только функции, в имени которых есть эта строка")
+    parser.add_argument("--tolerance", type=float, default=0.4, help="допустимое ухудшение (0.4 — 40%%)")
+    parser.add_argument("--retries", type=int, default=2, help="сколько раз перемерить функцию перед тем, как "
+                                                               "сообщить о регрессии")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="записать результат как новую базу")
+    args = parser.parse_args()
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    workdir = tempfile.mkdtemp(prefix="bench-hotpath-")
+    try:
+        print(f"Подготовка данных (кэш на {CACHE_ENTRIES} записей)...")
+        cases = [(name, func) for name, func in build_cases(workdir) if args.filter in name]
+        print(f"Python {platform.python_version()}")
+        print(f"{'функция':<34}{'оп/с':>12}{'мкс/оп':>10}{'пик КБ':>9}{'Б/оп':>8}{'к базе':>8}")
+
+        results, regressions = {}, []
+        for name, func in cases:
+            result = measure(func, args.min_time, args.repeats)
+            relative = ""
+            if baseline is not None and name in baseline["cases"]:
+                message = compare(name, result, baseline, args.tolerance)
+                # Разовый провал часто вызван соседней нагрузкой: регрессия должна повториться
+                for _ in range(args.retries):
+                    if message is None:
+                        break
+                    retry = measure(func, args.min_time, args.repeats)
+                    if retry["ops"] / retry["calibration"] > result["ops"] / result["calibration"]:
+                        result.update(ops=retry["ops"], calibration=retry["calibration"])
+                    result["peak_kb"] = min(result["peak_kb"], retry["peak_kb"])
+                    message = compare(name, result, baseline, args.tolerance)
+                if message:
+                    regressions.append(message)
+                base = baseline["cases"][name]
+                relative = f"{result['ops'] / result['calibration'] / (base['ops'] / base['calibration']):.0%}"
+            results[name] = result
+            ops = result["ops"]
+            print(f"{name:<34}{ops:>12.0f}{1e6 / ops:>10.1f}{result['peak_kb']:>9.1f}"
+                  f"{result['retained_bytes']:>8.0f}{relative:>8}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save_baseline:
+        saved = {"python": platform.python_version(), "cases": {}}
+        if args.filter and os.path.exists(args.baseline):
+            # Частичный прогон обновляет только свои функции
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        saved["cases"].update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(saved, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"База записана: {args.baseline}")
+        return 0
+
+    if baseline is None:
+        print(f"Базы нет ({args.baseline}): запустите с --save-baseline")
+        return 0
+    if regressions:
+        print("\nРЕГРЕССИЯ:", file=sys.stderr)
+        for message in regressions:
+            print(f"  {message}", file=sys.stderr)
+        return 1
+    print(f"\nРегрессий нет (допуск {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
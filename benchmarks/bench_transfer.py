@@ -0,0 +1,132 @@
+"""Нагрузка на процессор цикла скачивания: старый цикл iter_content(8192) против MirrorTransfer.
+
+Локальный HTTP-сервер в отдельном процессе отдаёт файл из памяти; для
+каждого варианта измеряется процессорное время потока скачивания на
+мегабайт (с расшифровкой AES-CTR и без неё) и скорость.
+
+    python benchmarks/bench_transfer.py --size-mb 128 --runs 3
+"""
+import argparse
+import hashlib
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+from downloader.transfer import MirrorTransfer  # noqa: E402
+
+KEY = "00112233445566778899aabbccddeeff"
+
+
+def _serve(size, port_queue):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    data = os.urandom(size)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            view = memoryview(data)
+            for offset in range(0, len(data), 1024 * 1024):
+                self.wfile.write(view[offset:offset + 1024 * 1024])
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+class _Progress:
+    """Как ProgressAggregator: счётчик байт на каждый блок"""
+
+    def __init__(self):
+        self.bytes = 0
+
+    def add_bytes(self, count):
+        self.bytes += count
+
+
+def legacy_fetch(session, url, file_path, key=None):
+    """Цикл скачивания до перехода на readinto: новый bytes на каждые 8 КБ"""
+    cipher = None
+    if key:
+        from Crypto.Cipher import AES
+
+        cipher = AES.new(key=bytes.fromhex(key), nonce=bytes(12), mode=AES.MODE_CTR)
+    progress = _Progress()
+    digest = hashlib.sha256()
+    response = session.get(url, stream=True)
+    with open(file_path, "wb") as f:
+        for chunk in response.iter_content(chunk_size=8192):
+            if not chunk:
+                continue
+            if cipher is not None:
+                chunk = cipher.decrypt(chunk)
+            f.write(chunk)
+            digest.update(chunk)
+            progress.add_bytes(len(chunk))
+    response.close()
+
+
+def current_fetch(session, url, file_path, key=None):
+    MirrorTransfer(session, _Progress()).fetch([url], file_path, key=key)
+
+
+def measure(fetch, session, url, size, key, runs):
+    best = None
+    for _ in range(runs):
+        fd, file_path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            cpu_started, wall_started = time.thread_time(), time.perf_counter()
+            fetch(session, url, file_path, key)
+            cpu, wall = time.thread_time() - cpu_started, time.perf_counter() - wall_started
+        finally:
+            os.unlink(file_path)
+        if best is None or cpu < best[0]:
+            best = (cpu, wall)
+    megabytes = size / (1024 * 1024)
+    return best[0] / megabytes * 1000, megabytes / best[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_serve, args=(size, port_queue), daemon=True)
+    server.start()
+    url = f"http://127.0.0.1:{port_queue.get()}/track"
+    session = requests.Session()
+    try:
+        print(f"Файл {args.size_mb} МБ, лучший из {args.runs} прогонов")
+        print(f"{'вариант':<40}{'мс CPU/МБ':>12}{'МБ/с':>10}")
+        for key in (None, KEY):
+            suffix = " + AES-CTR" if key else ""
+            results = {}
+            for name, fetch in (("iter_content(8192)", legacy_fetch), ("readinto + адаптивный блок", current_fetch)):
+                results[name] = measure(fetch, session, url, size, key, args.runs)
+                cpu_per_mb, rate = results[name]
+                print(f"{name + suffix:<40}{cpu_per_mb:>12.2f}{rate:>10.0f}")
+            legacy, current = results.values()
+            print(f"{'  экономия CPU' + suffix:<40}{(1 - current[0] / legacy[0]) * 100:>11.0f}%")
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -24,13 +24,56 @@ def _get_int(env_var: str, default: int) -> int:
         return default
 
 
+def _get_float(env_var: str, default: float) -> float:
+    """Получить дробное значение из переменной окружения."""
+    value = os.getenv(env_var)
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return default
+
+
 # Токен для доступа к Yandex Music API
 # Получите токен Яндекс Музыки здесь: https://github.com/MarshalX/yandex-music-api/discussions/513
 YANDEX_MUSIC_TOKEN = os.getenv("YANDEX_MUSIC_TOKEN", "your_token_here")
 
+# Пул аккаунтов
+# Дополнительные токены через запятую: запросы к API распределяются между всеми
+# аккаунтами. ACCOUNT_MAX_RPS ограничивает темп запросов одного аккаунта
+# (0 — без ограничения). Аккаунт, упёршийся в ограничение API (429/503),
+# выводится из ротации на ACCOUNT_COOLDOWN_SECONDS (при повторах — вдвое дольше,
+# до ACCOUNT_MAX_COOLDOWN_SECONDS); после ACCOUNT_AUTH_FAILURES отказов в токене
+# подряд (проверяется запросом account/status) он считается отозванным.
+# Данные владельца YANDEX_MUSIC_TOKEN запрашиваются только его токеном
+YANDEX_MUSIC_TOKENS = os.getenv("YANDEX_MUSIC_TOKENS", "")
+ACCOUNT_MAX_RPS = _get_float("ACCOUNT_MAX_RPS", 0.0)
+ACCOUNT_COOLDOWN_SECONDS = _get_float("ACCOUNT_COOLDOWN_SECONDS", 30.0)
+ACCOUNT_MAX_COOLDOWN_SECONDS = _get_float("ACCOUNT_MAX_COOLDOWN_SECONDS", 600.0)
+ACCOUNT_AUTH_FAILURES = _get_int("ACCOUNT_AUTH_FAILURES", 3)
+
 # Директория для сохранения музыки
 DOWNLOAD_DIR = os.getenv("DOWNLOAD_DIR", "music")
 
+# Куда сохранять готовые треки
+#   "local" - в DOWNLOAD_DIR (по умолчанию)
+#   "tar"   - в архив задания <ссылка>.tar в OUTPUT_ARCHIVE_DIR (по умолчанию DOWNLOAD_DIR)
+#   "zip"   - то же в zip-архив (без сжатия)
+#   "s3"    - в S3-совместимое хранилище (нужен пакет boto3); путь внутри бакета — как в DOWNLOAD_DIR
+# Файлы больше S3_PART_SIZE_MB загружаются частями в S3_UPLOAD_THREADS потоков.
+# S3_ENDPOINT_URL — адрес MinIO и т.п. (пусто — AWS); без ключей используются стандартные настройки boto3
+OUTPUT_SINK = os.getenv("OUTPUT_SINK", "local")
+OUTPUT_ARCHIVE_DIR = os.getenv("OUTPUT_ARCHIVE_DIR", "")
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_PREFIX = os.getenv("S3_PREFIX", "")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL", "")
+S3_REGION = os.getenv("S3_REGION", "")
+S3_ACCESS_KEY_ID = os.getenv("S3_ACCESS_KEY_ID", "")
+S3_SECRET_ACCESS_KEY = os.getenv("S3_SECRET_ACCESS_KEY", "")
+S3_PART_SIZE_MB = _get_int("S3_PART_SIZE_MB", 8)
+S3_UPLOAD_THREADS = _get_int("S3_UPLOAD_THREADS", 4)
+
 # Качество аудио при скачивании
 # Доступные значения:
 #   "lossless" - без потерь (FLAC, ~1000 kbps) - максимальное качество
@@ -44,12 +87,172 @@ AUDIO_QUALITY = os.getenv("AUDIO_QUALITY", "hq")
 LOGGING_ENABLED = _get_bool("LOGGING_ENABLED", True)
 LOG_FILE = os.getenv("LOG_FILE", "logs/app.log")
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Формат записей: "text" — обычный текст, "json" — JSON Lines со структурированными полями
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# Ротация: максимальный размер файла в байтах (0 — без ротации) и число архивных файлов
+LOG_MAX_BYTES = _get_int("LOG_MAX_BYTES", 10 * 1024 * 1024)
+LOG_BACKUP_COUNT = _get_int("LOG_BACKUP_COUNT", 5)
 
 # Кэширование метаданных
 METADATA_CACHE_ENABLED = _get_bool("METADATA_CACHE_ENABLED", True)
 METADATA_CACHE_FILE = os.getenv("METADATA_CACHE_FILE", "cache/metadata.json")
 METADATA_CACHE_TTL_HOURS = _get_int("METADATA_CACHE_TTL_HOURS", 24)
 
+# Кэш ответов API каталога
+# Ответы на запросы альбомов, артистов, плейлистов и треков хранятся в SQLite.
+# Свежесть берётся из заголовков Cache-Control/Expires сервера, иначе — из
+# API_CACHE_TTL_*_MINUTES; устаревший ответ перепроверяется условным запросом
+# (ETag/Last-Modified). При превышении API_CACHE_MAX_MB вытесняются давно не
+# использованные ответы
+API_CACHE_ENABLED = _get_bool("API_CACHE_ENABLED", True)
+API_CACHE_FILE = os.getenv("API_CACHE_FILE", "cache/api.sqlite3")
+API_CACHE_MAX_MB = _get_int("API_CACHE_MAX_MB", 64)
+API_CACHE_TTL_ALBUMS_MINUTES = _get_int("API_CACHE_TTL_ALBUMS_MINUTES", 1440)
+API_CACHE_TTL_ARTISTS_MINUTES = _get_int("API_CACHE_TTL_ARTISTS_MINUTES", 360)
+API_CACHE_TTL_PLAYLISTS_MINUTES = _get_int("API_CACHE_TTL_PLAYLISTS_MINUTES", 10)
+API_CACHE_TTL_TRACKS_MINUTES = _get_int("API_CACHE_TTL_TRACKS_MINUTES", 1440)
+
+# Кэш доступности кодеков
+# Для каждого трека запоминается, есть ли у него lossless, чтобы не повторять
+# заведомо безуспешный запрос get-file-info. Сбрасывается при смене подписки
+CODEC_CACHE_ENABLED = _get_bool("CODEC_CACHE_ENABLED", True)
+CODEC_CACHE_FILE = os.getenv("CODEC_CACHE_FILE", "cache/codecs.json")
+CODEC_CACHE_TTL_HOURS = _get_int("CODEC_CACHE_TTL_HOURS", 168)
+
+# Общий кэш нескольких узлов
+# Второй уровень за локальными кэшами метаданных, кодеков и ответов API на
+# сервере с протоколом Redis: промах локального кэша проверяется там, новые
+# записи отправляются туда в фоне. Пусто — только локальные кэши. Если сервер
+# недоступен, уровень отключается на SHARED_CACHE_RETRY_SECONDS секунд
+SHARED_CACHE_URL = os.getenv("SHARED_CACHE_URL", "")  # redis://[:пароль@]хост:6379/0
+SHARED_CACHE_PREFIX = os.getenv("SHARED_CACHE_PREFIX", "ymd:")
+SHARED_CACHE_TIMEOUT = _get_float("SHARED_CACHE_TIMEOUT", 0.5)
+SHARED_CACHE_RETRY_SECONDS = _get_float("SHARED_CACHE_RETRY_SECONDS", 30.0)
+
+# Кэш сессии клиента
+# Состояние аккаунта (результат Client.init()) сохраняется на диск, чтобы
+# повторные короткие запуски не делали сетевой запрос при старте
+CLIENT_SESSION_CACHE_ENABLED = _get_bool("CLIENT_SESSION_CACHE_ENABLED", True)
+CLIENT_SESSION_CACHE_FILE = os.getenv("CLIENT_SESSION_CACHE_FILE", "cache/session.json")
+CLIENT_SESSION_TTL_HOURS = _get_int("CLIENT_SESSION_TTL_HOURS", 12)
+
+# Журнал заданий
+# Все запланированные треки и их состояние сохраняются в SQLite, чтобы
+# прерванное задание можно было продолжить, а неудачные треки — повторить
+JOB_JOURNAL_ENABLED = _get_bool("JOB_JOURNAL_ENABLED", True)
+JOB_JOURNAL_FILE = os.getenv("JOB_JOURNAL_FILE", "cache/jobs.sqlite3")
+
+# Режим воркеров (python main.py --worker)
+# Срок аренды трека в секундах: если воркер упал, трек вернётся в очередь по истечении аренды
+WORKER_LEASE_SECONDS = _get_int("WORKER_LEASE_SECONDS", 300)
+# Как часто воркер с --follow проверяет очередь на новые задания (в секундах)
+WORKER_POLL_SECONDS = _get_int("WORKER_POLL_SECONDS", 5)
+
 # Многопоточность
 # Количество одновременных загрузок (1 — без многопоточности)
-MAX_CONCURRENT_DOWNLOADS = _get_int("MAX_CONCURRENT_DOWNLOADS", 4)
\ No newline at end of file
+MAX_CONCURRENT_DOWNLOADS = _get_int("MAX_CONCURRENT_DOWNLOADS", 4)
+
+# Порядок скачивания треков пачки (альбома, плейлиста)
+#   "longest"    - сначала самые длинные треки: потоки заканчивают почти одновременно (по умолчанию)
+#   "interleave" - по очереди из каждого альбома пачки
+#   "source"     - как в альбоме/плейлисте
+TASK_ORDER = os.getenv("TASK_ORDER", "longest")
+
+# Потоковая выдача задач
+# Треки задания читаются окнами по TASK_WINDOW штук (подгрузка треков, учёт в журнале,
+# порядок TASK_ORDER — внутри окна), а в пуле потоков одновременно не больше
+# TASK_QUEUE_SIZE задач (0 — вдвое больше MAX_CONCURRENT_DOWNLOADS).
+TASK_WINDOW = _get_int("TASK_WINDOW", 256)
+TASK_QUEUE_SIZE = _get_int("TASK_QUEUE_SIZE", 0)
+
+# Упреждающее разрешение ссылок
+# Пока качаются текущие треки, ссылки на следующие PREFETCH_LOOKAHEAD треков
+# запрашиваются заранее в PREFETCH_THREADS потоках (0 — выключить).
+# Ссылка старше PREFETCH_URL_TTL_SECONDS считается устаревшей и запрашивается заново
+PREFETCH_LOOKAHEAD = _get_int("PREFETCH_LOOKAHEAD", 8)
+PREFETCH_THREADS = _get_int("PREFETCH_THREADS", 2)
+PREFETCH_URL_TTL_SECONDS = _get_int("PREFETCH_URL_TTL_SECONDS", 60)
+
+# Выбор зеркала CDN
+# По каждому хосту CDN копится статистика (время до первого байта, скорость,
+# ошибки); ссылки перебираются от лучшего зеркала к худшему. Если скорость
+# после MIRROR_SPEED_GRACE_SECONDS ниже MIRROR_MIN_SPEED_KBPS (0 — не проверять),
+# скачивание продолжается со следующего зеркала
+MIRROR_STATS_ENABLED = _get_bool("MIRROR_STATS_ENABLED", True)
+MIRROR_STATS_FILE = os.getenv("MIRROR_STATS_FILE", "cache/mirrors.json")
+MIRROR_MIN_SPEED_KBPS = _get_int("MIRROR_MIN_SPEED_KBPS", 64)
+MIRROR_SPEED_GRACE_SECONDS = _get_float("MIRROR_SPEED_GRACE_SECONDS", 5.0)
+
+# Таймауты и защита от зависших скачиваний
+# Соединение и чтение с CDN ограничены по времени; передача медленнее
+# TRANSFER_MIN_SPEED_KBPS (0 — не проверять) прерывается с ошибкой.
+# Если скачивание длится дольше HEDGE_PERCENTILE-го перцентиля последних
+# скачиваний, запускается дублирующий запрос на другое зеркало; дублей не
+# больше HEDGE_BUDGET_PERCENT процентов от числа скачиваний
+HTTP_CONNECT_TIMEOUT = _get_float("HTTP_CONNECT_TIMEOUT", 10.0)
+HTTP_READ_TIMEOUT = _get_float("HTTP_READ_TIMEOUT", 30.0)
+TRANSFER_MIN_SPEED_KBPS = _get_int("TRANSFER_MIN_SPEED_KBPS", 4)
+# Наибольший блок чтения при скачивании в КБ: размер блока подстраивается под
+# скорость передачи, данные читаются и расшифровываются в одном буфере
+TRANSFER_MAX_CHUNK_KB = _get_int("TRANSFER_MAX_CHUNK_KB", 1024)
+# Резервировать место под файл по Content-Length до начала записи (fallocate):
+# меньше фрагментации больших библиотек FLAC
+PREALLOCATE_ENABLED = _get_bool("PREALLOCATE_ENABLED", True)
+HEDGE_ENABLED = _get_bool("HEDGE_ENABLED", True)
+HEDGE_PERCENTILE = _get_float("HEDGE_PERCENTILE", 95.0)
+HEDGE_MIN_SAMPLES = _get_int("HEDGE_MIN_SAMPLES", 20)
+HEDGE_BUDGET_PERCENT = _get_float("HEDGE_BUDGET_PERCENT", 10.0)
+
+# Проверка целостности
+# Во время скачивания сверяется длина с Content-Length, считается SHA-256 и
+# проверяется заголовок FLAC/MP3/M4A. Файл, не прошедший проверку, скачивается
+# заново до INTEGRITY_RETRIES раз. FLAC_VERIFY_ENABLED дополнительно декодирует
+# FLAC утилитой flac и сверяет с MD5 из STREAMINFO (не больше
+# FLAC_VERIFY_PROCESSES проверок одновременно)
+INTEGRITY_RETRIES = _get_int("INTEGRITY_RETRIES", 1)
+FLAC_VERIFY_ENABLED = _get_bool("FLAC_VERIFY_ENABLED", False)
+FLAC_VERIFY_PROCESSES = _get_int("FLAC_VERIFY_PROCESSES", 2)
+
+# Постобработка
+# После записи тегов трек обрабатывается в пуле процессов (POSTPROCESS_PROCESSES,
+# 0 — по числу доступных ядер): FLAC из контейнера MP4 перепаковывается в
+# обычный FLAC без перекодирования, записываются теги ReplayGain трека и, когда
+# скачаны все треки альбома, альбома. Для ReplayGain нужна утилита ffmpeg
+POSTPROCESS_ENABLED = _get_bool("POSTPROCESS_ENABLED", False)
+POSTPROCESS_REMUX_FLAC = _get_bool("POSTPROCESS_REMUX_FLAC", True)
+POSTPROCESS_REPLAYGAIN = _get_bool("POSTPROCESS_REPLAYGAIN", True)
+POSTPROCESS_PROCESSES = _get_int("POSTPROCESS_PROCESSES", 0)
+
+# Индекс библиотеки
+# Для каждого сохранённого файла запоминаются трек, кодек, размер и SHA-256
+LIBRARY_INDEX_ENABLED = _get_bool("LIBRARY_INDEX_ENABLED", True)
+LIBRARY_INDEX_FILE = os.getenv("LIBRARY_INDEX_FILE", "cache/library.sqlite3")
+
+# Бюджет памяти под буферы скачивания (на процесс, в мегабайтах)
+# Загрузка начинается, только когда её буферы помещаются в бюджет
+MEMORY_BUDGET_MB = _get_int("MEMORY_BUDGET_MB", 256)
+
+# Пробный прогон (python main.py URL --plan manifest.json)
+# Сколько треков одновременно разрешать и проверять при построении манифеста
+PLAN_CONCURRENCY = _get_int("PLAN_CONCURRENCY", 16)
+# История фактической скорости скачивания для оценки времени
+THROUGHPUT_HISTORY_FILE = os.getenv("THROUGHPUT_HISTORY_FILE", "cache/throughput.json")
+
+# Отображение прогресса
+# Доступные значения:
+#   "bar"     - один общий progress bar на задачу (по умолчанию)
+#   "summary" - периодическая однострочная сводка (удобно для логов Docker)
+#   "off"     - без вывода прогресса
+PROGRESS_MODE = os.getenv("PROGRESS_MODE", "bar")
+# Период обновления прогресса в секундах (0 — по умолчанию: 0.5 для bar, 10 для summary)
+PROGRESS_INTERVAL = _get_float("PROGRESS_INTERVAL", 0)
+
+# Демон с HTTP API (python main.py --daemon)
+# Адрес и порт API (в Docker используйте 0.0.0.0)
+DAEMON_HOST = os.getenv("DAEMON_HOST", "127.0.0.1")
+DAEMON_PORT = _get_int("DAEMON_PORT", 8080)
+# Количество потоков, обходящих каталог новых заданий
+DAEMON_PLANNER_THREADS = _get_int("DAEMON_PLANNER_THREADS", 2)
+# Сколько минут помнить завершённые задания и сколько их хранить не больше
+DAEMON_JOB_TTL_MINUTES = _get_int("DAEMON_JOB_TTL_MINUTES", 1440)
+DAEMON_MAX_FINISHED_JOBS = _get_int("DAEMON_MAX_FINISHED_JOBS", 200)
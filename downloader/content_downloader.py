@@ -2,57 +2,332 @@ import logging
 import os
 import re
 import time
-import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from tqdm import tqdm
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 from utils.file_utils import sanitize_filename
-from downloader.track_downloader import TrackDownloader
+from utils.job_journal import (
+    JobJournal,
+    make_task_key,
+    JOB_MODE_LOCAL,
+    TASK_DONE,
+    TASK_FAILED,
+    TASK_IN_FLIGHT,
+)
+from utils.metadata import AlbumContext
+from utils.output_sink import open_job_sink
+from utils.progress import ProgressAggregator
+from utils.throughput_history import ThroughputHistory
+from downloader.layout import LayoutPlanner
+from downloader.task_order import ORDER_LONGEST, ORDER_POLICIES, BatchStats, order_tasks
+from downloader.task_stream import TrackTask, drain, hydrate_tasks, iter_windows, tracks_total
+from downloader.track_downloader import AUDIO_QUALITIES, TrackDownloader
+from downloader.url_prefetcher import UrlPrefetcher
 
 
 logger = logging.getLogger(__name__)
 
+# Задания, созданные из манифеста, хранят в журнале путь к нему вместо ссылки
+MANIFEST_URL_PREFIX = "manifest:"
+
+
+def task_order_policy(config):
+    """Политика порядка скачивания из TASK_ORDER (неизвестное значение — longest)"""
+    policy = str(getattr(config, "TASK_ORDER", ORDER_LONGEST)).lower()
+    if policy not in ORDER_POLICIES:
+        logger.warning("Неизвестный TASK_ORDER=%s, используется %s", policy, ORDER_LONGEST)
+        return ORDER_LONGEST
+    return policy
+
 
 class ContentDownloader:
     """Класс для скачивания контента (альбомы, плейлисты, артисты)"""
 
-    def __init__(self, client, config):
+    # Режим заданий, которые создаёт загрузчик (см. utils.job_journal)
+    job_mode = JOB_MODE_LOCAL
+
+    def __init__(self, client, config, track_downloader=None, download_dir=None, use_journal=True):
         self.client = client
         self.config = config
-        self.track_downloader = TrackDownloader(client, config)
+        self.download_dir = download_dir or config.DOWNLOAD_DIR
+        if track_downloader is not None:
+            # Общий загрузчик (например, в режиме демона) — вместе с его кэшами и прогрессом
+            self.track_downloader = track_downloader
+            self.progress = track_downloader.progress
+        else:
+            self.progress = ProgressAggregator.from_config(config)
+            self.track_downloader = TrackDownloader(client, config, progress=self.progress)
         self.max_workers = max(1, getattr(config, "MAX_CONCURRENT_DOWNLOADS", 4))
+        self.prefetch_lookahead = max(0, getattr(config, "PREFETCH_LOOKAHEAD", 8))
+        self.prefetch_threads = max(1, getattr(config, "PREFETCH_THREADS", 2))
+        self.task_order = task_order_policy(config)
+        # Задачи читаются окнами по task_window, в пуле потоков — не больше task_queue_size
+        self.task_window = max(1, getattr(config, "TASK_WINDOW", 256))
+        self.task_queue_size = max(self.max_workers, getattr(config, "TASK_QUEUE_SIZE", 0) or 2 * self.max_workers)
+        self.throughput = ThroughputHistory(getattr(config, "THROUGHPUT_HISTORY_FILE", "cache/throughput.json"))
+        if use_journal and getattr(config, "JOB_JOURNAL_ENABLED", True):
+            self.journal = JobJournal(getattr(config, "JOB_JOURNAL_FILE", "cache/jobs.sqlite3"))
+        else:
+            self.journal = None
+        self.job_id = None
+        # Архив текущего задания (OUTPUT_SINK=tar/zip); None — общий приёмник загрузчика
+        self.sink = None
+        # Раскладка файлов текущего задания (имена без коллизий)
+        self.layout = None
+
+    def download_url(self, url):
+        """Определяет тип контента по ссылке и скачивает его как одно задание журнала"""
+        if 'track' in url:
+            handler = self.download_single_track
+        elif 'album' in url:
+            handler = self.download_album
+        elif 'playlist' in url:
+            handler = self.download_playlist
+        elif 'artist' in url:
+            handler = self.download_artist
+        else:
+            logger.error("Неверная ссылка. Поддерживаются треки, альбомы, плейлисты и артисты.")
+            print("Неверная ссылка. Поддерживаются треки, альбомы, плейлисты и артисты.")
+            return
 
-    def _download_track_wrapper(self, track, output_dir, album_name=None, total_tracks=None, total_discs=None):
-        """Обертка для передачи аргументов в пул потоков"""
-        self.track_downloader.download_track(track, output_dir, album_name, total_tracks, total_discs)
+        self._begin_job(url)
+        with self._job_output(url):
+            handler(url)
+        # При прерывании задание остаётся незавершённым и продолжится при следующем запуске
+        self._finish_job()
+
+    def _new_layout(self):
+        """Раскладка файлов задания; папки создаются через приёмник, куда пойдут треки"""
+        return LayoutPlanner(self.sink or self.track_downloader.sink)
+
+    @contextmanager
+    def _job_output(self, source):
+        """Открывает архив задания (OUTPUT_SINK=tar/zip) и раскладку файлов на время скачивания.
+        Архив закрывается даже при прерывании"""
+        self.sink = open_job_sink(self.config, source)
+        self.layout = self._new_layout()
+        try:
+            yield
+        finally:
+            sink, self.sink = self.sink, None
+            layout, self.layout = self.layout, None
+            if layout is not None and layout.collisions:
+                print(f"Совпадающих имён файлов: {layout.collisions} (к имени добавлена версия или id трека)")
+            if sink is not None:
+                sink.close()
+                if sink.files:
+                    print(f"Архив задания: {sink.archive_path} (добавлено треков: {sink.files})")
+                    logger.info("Архив %s: добавлено треков %s", sink.archive_path, sink.files)
+
+    @contextmanager
+    def _manifest_quality(self, manifest):
+        """Качество, с которым строился манифест, на время скачивания по нему.
+        Загрузчик с другим качеством делит с основным кэши, HTTP-пул и прогресс"""
+        quality = manifest.get("quality")
+        track_downloader = self.track_downloader
+        if quality and quality != track_downloader.audio_quality:
+            if quality in AUDIO_QUALITIES:
+                print(f"Качество из манифеста: {quality}")
+                logger.info("Качество из манифеста: %s (AUDIO_QUALITY=%s)", quality, track_downloader.audio_quality)
+                self.track_downloader = track_downloader.for_quality(quality)
+            else:
+                logger.warning(
+                    "Неизвестное качество в манифесте: %s, используется %s", quality, track_downloader.audio_quality,
+                )
+        try:
+            yield
+        finally:
+            self.track_downloader = track_downloader
 
-    def _download_tracks_concurrently(self, tasks, desc, colour="green"):
-        """Скачивает список треков параллельно с прогресс баром"""
-        if not tasks:
+    def _report_done(self, message):
+        """Сообщает о скачанном альбоме, плейлисте или артисте"""
+        print(message)
+
+    def _begin_job(self, url):
+        """Открывает (или продолжает) задание в журнале"""
+        if not self.journal:
             return
 
-        with tqdm(
-            total=len(tasks),
-            desc=desc,
-            unit=" трек",
-            bar_format='{desc}: {percentage:3.0f}%|{bar}| {n}/{total} [{elapsed}<{remaining}, {rate_fmt}]',
-            ncols=100,
-            colour=colour,
-            ascii=' ░▒▓█',
-            dynamic_ncols=True
-        ) as pbar:
-            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                futures = [
-                    executor.submit(self._download_track_wrapper, *args)
-                    for args in tasks
-                ]
-                for future in as_completed(futures):
-                    try:
-                        future.result()
-                    except Exception as e:
-                        logger.warning("Ошибка при скачивании трека: %s", e)
-                    finally:
-                        pbar.update(1)
+        job = self.journal.start_job(url, mode=self.job_mode)
+        self.job_id = job["id"]
+        if job["resumed"]:
+            counts = self.journal.task_counts(self.job_id)
+            done = counts.get(TASK_DONE, 0)
+            print(f"Продолжаю задание #{self.job_id}: уже скачано {done} из {sum(counts.values())} треков")
+            logger.info("Продолжение задания #%s (%s), скачано %s", self.job_id, url, done)
+        else:
+            logger.info("Создано задание #%s (%s)", self.job_id, url)
+
+    def _finish_job(self):
+        """Закрывает текущее задание и сообщает о неудачных треках"""
+        if not self.journal or self.job_id is None:
+            return
+
+        job_id, self.job_id = self.job_id, None
+        status = self.journal.finish_job(job_id)
+        failed = self.journal.task_counts(job_id).get(TASK_FAILED, 0)
+        logger.info("Задание #%s завершено со статусом %s", job_id, status)
+        if failed:
+            print(f"\nЗадание #{job_id}: не удалось скачать треков: {failed}")
+            print(f"Повторить только их: python main.py --retry-failed {job_id}")
+
+    @staticmethod
+    def _task_record(track, output_dir, album_name=None, total_tracks=None, total_discs=None, album_context=None):
+        """Описание задачи для журнала (контекст альбома не сохраняется: при возобновлении теги собираются по треку)"""
+        albums = getattr(track, 'albums', None)
+        return {
+            "track_id": track.id,
+            "album_id": str(albums[0].id) if albums else None,
+            "output_dir": output_dir,
+            "album_name": album_name,
+            "total_tracks": total_tracks,
+            "total_discs": total_discs,
+        }
+
+    def _register_window(self, tasks, states):
+        """Регистрирует окно задач в журнале и возвращает только ещё не скачанные"""
+        records = [self._task_record(*args) for args in tasks]
+        if self.layout is not None:
+            # Имя запоминается в журнале: повтор неудачных треков не обходит каталог заново
+            for args, record in zip(tasks, records):
+                record["file_name"] = self.layout.name(args[0], args[1])
+        self.journal.add_tasks(self.job_id, records)
+        return [
+            args for args, record in zip(tasks, records)
+            if states.get(make_task_key(record["track_id"], record["output_dir"])) != TASK_DONE
+        ]
+
+    def _task_windows(self, tasks):
+        """Читает задачи окнами по task_window штук: регистрирует в журнале, отбрасывает скачанные, упорядочивает.
+
+        Порядок TASK_ORDER действует внутри окна; задание не больше окна
+        упорядочивается целиком, как раньше.
+        """
+        journal = self.journal if self.job_id is not None else None
+        states = journal.task_states(self.job_id) if journal else None
+        skipped = 0
+        for window in iter_windows(tasks, self.task_window):
+            if self.layout is not None:
+                # Имена назначаются всем задачам в порядке обхода, включая уже скачанные, — так они не меняются
+                for args in window:
+                    self.layout.assign(args[0], args[1])
+            if journal:
+                pending = self._register_window(window, states)
+                for _ in range(len(window) - len(pending)):
+                    # Уже скачанные треки сразу засчитываются в прогресс задания
+                    self.progress.track_done()
+                skipped += len(window) - len(pending)
+                window = pending
+            if window:
+                yield order_tasks(window, self.task_order)
+        if skipped:
+            print(f"Пропущено уже скачанных треков: {skipped}")
+            logger.info("Задание #%s: пропущено уже скачанных треков: %s", self.job_id, skipped)
+
+    def _download_track_wrapper(self, track, output_dir, album_name=None, total_tracks=None, total_discs=None,
+                                album_context=None, prefetcher=None):
+        """Обертка для передачи аргументов в пул потоков и учёта состояния в журнале"""
+        source = prefetcher.take(track) if prefetcher is not None else None
+        name = self.layout.name(track, output_dir) if self.layout is not None else None
+        job_id = self.job_id
+        if not self.journal or job_id is None:
+            self.track_downloader.download_track(
+                track, output_dir, album_name, total_tracks, total_discs, source=source, album_context=album_context,
+                sink=self.sink, name=name,
+            )
+            return
+
+        task_key = make_task_key(track.id, output_dir)
+        self.journal.mark(job_id, task_key, TASK_IN_FLIGHT)
+        try:
+            output_path = self.track_downloader.download_track(
+                track, output_dir, album_name, total_tracks, total_discs, source=source, album_context=album_context,
+                sink=self.sink, name=name,
+            )
+        except Exception as e:
+            self.journal.mark(job_id, task_key, TASK_FAILED, str(e) or type(e).__name__)
+            raise
+        if output_path:
+            self.journal.mark(job_id, task_key, TASK_DONE)
+        else:
+            self.journal.mark(job_id, task_key, TASK_FAILED, "не удалось скачать трек")
+
+    def _download_tracks_concurrently(self, tasks, desc, colour="green", total=None):
+        """Скачивает треки параллельно с общим прогрессом.
+
+        tasks — список или генератор задач. Задачи читаются окнами
+        (_task_windows), а в пул потоков одновременно отдаётся не больше
+        task_queue_size штук: скачивание начинается, пока каталог ещё
+        обходится, и память не растёт с размером задания. total — число
+        задач для прогресса, если tasks — генератор.
+        """
+        if total is None:
+            total = tracks_total(tasks)
+        if total == 0:
+            return
+
+        prefetcher = self._make_prefetcher(total)
+        batch = BatchStats(min(self.max_workers, total or self.max_workers))
+        bytes_before = self.progress.totals()[0]
+        started_at = time.monotonic()
+        albums = set()
+        try:
+            with self.progress.job(desc, total_tracks=total, colour=colour):
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    in_flight = set()
+                    for window in self._task_windows(tasks):
+                        # Пул берёт задачи в порядке отправки: упреждающее разрешение ссылок идёт в том же порядке
+                        if prefetcher is not None:
+                            prefetcher.extend(args[0] for args in window)
+                        for args in window:
+                            if len(args) > 5 and args[5] is not None:
+                                albums.add(args[5])
+                            if len(in_flight) >= self.task_queue_size:
+                                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                                self._collect(done)
+                            in_flight.add(
+                                executor.submit(batch.run, self._download_track_wrapper, *args, prefetcher=prefetcher)
+                            )
+                    self._collect(wait(in_flight).done)
+        finally:
+            if prefetcher is not None:
+                prefetcher.close()
+            # Альбомы, скачанные не целиком, остаются без ReplayGain альбома
+            if self.track_downloader.postprocessor is not None:
+                self.track_downloader.postprocessor.discard(albums)
+            stats = batch.stats()
+            if stats["tasks"]:
+                report = batch.report(self.task_order)
+                logger.info(report, extra={"stage": "batch", "duration": stats["makespan"]})
+                if stats["tasks"] > 1:
+                    print(report)
+                logger.info(self.track_downloader.memory.report())
+                # Фактическая скорость пачки — для оценки времени в режиме планирования
+                self.throughput.record(
+                    self.progress.totals()[0] - bytes_before, time.monotonic() - started_at, self.max_workers,
+                )
+
+    def _collect(self, futures):
+        """Учитывает завершённые задачи пула"""
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                logger.warning("Ошибка при скачивании трека: %s", e)
+            finally:
+                self.progress.track_done()
+
+    def _make_prefetcher(self, total):
+        """Упреждающее разрешение ссылок имеет смысл, только когда треков больше, чем потоков"""
+        if not self.prefetch_lookahead or (total is not None and total <= self.max_workers):
+            return None
+        # Треки добавляются по мере чтения задач (UrlPrefetcher.extend)
+        return UrlPrefetcher(
+            self.track_downloader.resolve_source,
+            lookahead=self.prefetch_lookahead,
+            threads=self.prefetch_threads,
+        )
 
     def download_single_track(self, url):
         """Скачивает один трек"""
@@ -67,7 +342,7 @@ class ContentDownloader:
         track = self.client.tracks(track_id)[0]
 
         logger.info("Скачивание трека %s", url)
-        self.track_downloader.download_track(track, self.config.DOWNLOAD_DIR)
+        self._download_tracks_concurrently([(track, self.download_dir)], desc="🎵 Трек")
 
     def download_album(self, url):
         """Скачивает альбом"""
@@ -85,36 +360,50 @@ class ContentDownloader:
 
         total_tracks_all = sum(len(volume) for volume in album.volumes)
         total_discs = len(album.volumes)
+        album_context = AlbumContext.from_album(album, album_name, total_discs)
 
         # Сингл - сохраняем в корневую папку
         if total_tracks_all == 1:
             print(f"Скачиваю сингл: {album_name}")
-            for volume in album.volumes:
-                for track in volume:
-                    self.track_downloader.download_track(track, self.config.DOWNLOAD_DIR, album_name, total_tracks_all, total_discs)
-            print(f"Сингл '{album_name}' успешно скачан в {self.config.DOWNLOAD_DIR}")
+            records = self._compact_tasks(
+                (
+                    (track, self.download_dir, album_name, total_tracks_all, total_discs, album_context)
+                    for volume in album.volumes
+                    for track in volume
+                ),
+                total_tracks_all,
+            )
+            del album
+            self._download_tracks_concurrently(
+                self._stream_tasks(records), desc=f"🎵 Сингл: {album_name}", total=total_tracks_all,
+            )
+            self._report_done(f"Сингл '{album_name}' успешно скачан в {self.download_dir}")
             logger.info("Сингл '%s' скачан (%s)", album_name, album_id)
         else:
             safe_album_name = sanitize_filename(album_name)
-            album_dir = os.path.join(self.config.DOWNLOAD_DIR, safe_album_name)
+            album_dir = os.path.join(self.download_dir, safe_album_name)
 
             print(f"Скачиваю альбом: {album_name}")
 
-            # Собираем все треки и качаем параллельно
-            tasks = []
-            for volume in album.volumes:
-                tracks_in_volume = len(volume)
-                for track in volume:
-                    tasks.append((track, album_dir, album_name, tracks_in_volume, total_discs))
-
+            # Треки всех дисков качаем параллельно
+            records = self._compact_tasks(
+                (
+                    (track, album_dir, album_name, len(volume), total_discs, album_context)
+                    for volume in album.volumes
+                    for track in volume
+                ),
+                total_tracks_all,
+            )
+            del album
             self._download_tracks_concurrently(
-                tasks,
+                self._stream_tasks(records),
                 desc=f"💿 Альбом: {album_name}",
                 colour="blue",
+                total=total_tracks_all,
             )
             logger.info("Альбом '%s' скачан (%s)", album_name, album_id)
 
-            print(f"Альбом '{album_name}' успешно скачан в {album_dir}")
+            self._report_done(f"Альбом '{album_name}' успешно скачан в {album_dir}")
 
     def download_playlist(self, url):
         """Скачивает плейлист"""
@@ -131,32 +420,33 @@ class ContentDownloader:
 
         # ОбработкаUID плейлистов
         if playlist_uid:
-            headers = {
-                'Authorization': f'OAuth {self.config.YANDEX_MUSIC_TOKEN}',
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                'Accept': 'application/json',
-            }
+            # Запрос идёт через клиент: токен (или пул токенов) и разбор ошибок общие со всем API
+            from yandex_music.exceptions import BadRequestError, NetworkError, NotFoundError
 
-            result = False
+            result_data = None
             cnt = 0
-            while not result:
+            while result_data is None:
                 try:
-                    response = requests.get(f'https://api.music.yandex.ru/playlist/{playlist_uid}', headers=headers)
-
-                    if response.status_code == 200:
-                        data = response.json()
-                        if 'result' in data:
-                            result_data = data['result']
-                            playlist_user = result_data.get('uid')
-                            playlist_id = result_data.get('kind')
-                            result = True
-                    else:
-                        playlist_uid = f'lk.{playlist_uid}'
-
-                except requests.exceptions.RequestException:
+                    result_data = self.client.request.get(f'https://api.music.yandex.ru/playlist/{playlist_uid}')
+                    if result_data is None:
+                        raise NotFoundError(playlist_uid)
+                except (BadRequestError, NotFoundError):
+                    if playlist_uid.startswith('lk.'):
+                        logger.error("Плейлист %s не найден", url)
+                        print("Плейлист не найден")
+                        return
+                    playlist_uid = f'lk.{playlist_uid}'
+                except NetworkError:
                     cnt += 1
+                    if cnt > 5:
+                        logger.exception("Ошибка при запросе плейлиста %s", url)
+                        print("Не удалось получить плейлист: ошибка сети")
+                        return
                     time.sleep(2**cnt)
 
+            playlist_user = result_data.get('uid')
+            playlist_id = result_data.get('kind')
+
         try:
             playlist = self.client.users_playlists(kind=playlist_id, user_id=playlist_user)
         except:
@@ -166,34 +456,34 @@ class ContentDownloader:
 
         playlist_name = playlist.title
         safe_playlist_name = sanitize_filename(playlist_name)
-        playlist_dir = os.path.join(self.config.DOWNLOAD_DIR, safe_playlist_name)
+        playlist_dir = os.path.join(self.download_dir, safe_playlist_name)
 
         print(f"Скачиваю плейлист: {playlist_name}")
         logger.info("Скачивание плейлиста '%s' (%s)", playlist_name, url)
 
-        # Собираем все треки для прогресса и скачивания
-        tasks = []
-        for track_item in playlist.tracks:
-            try:
-                if hasattr(track_item, 'track') and track_item.track:
-                    track = track_item.track
-                else:
-                    track_id = f"{track_item.id}:{track_item.album_id}"
-                    track = self.client.tracks(track_id)[0]
-                if track:
-                    tasks.append((track, playlist_dir))
-            except Exception as e:
-                logger.warning("Ошибка при получении трека из плейлиста: %s", e)
-                print(f"Ошибка при получении трека из плейлиста: {e}")
-                continue
+        # От большого плейлиста остаются только компактные записи (id трека и альбома):
+        # полные треки подгружаются пачками непосредственно перед скачиванием
+        total = len(playlist.tracks)
+        keep_tracks = total <= self.task_window
+        records = deque(
+            TrackTask(
+                track_item.id,
+                track_item.album_id,
+                playlist_dir,
+                track=getattr(track_item, 'track', None) if keep_tracks else None,
+            )
+            for track_item in playlist.tracks
+        )
+        del playlist
 
         self._download_tracks_concurrently(
-            tasks,
+            self._stream_tasks(records),
             desc=f"🎶 Плейлист: {playlist_name}",
             colour="magenta",
+            total=total,
         )
 
-        print(f"Плейлист '{playlist_name}' успешно скачан в {playlist_dir}")
+        self._report_done(f"Плейлист '{playlist_name}' успешно скачан в {playlist_dir}")
         logger.info("Плейлист '%s' скачан (%s)", playlist_name, url)
 
     def download_artist(self, url):
@@ -215,7 +505,7 @@ class ContentDownloader:
             logger.info("Скачивание артиста '%s' (%s)", artist_name, url)
 
             safe_artist_name = sanitize_filename(artist_name)
-            artist_dir = os.path.join(self.config.DOWNLOAD_DIR, "artists", safe_artist_name)
+            artist_dir = os.path.join(self.download_dir, "artists", safe_artist_name)
 
             # Скачиваем альбомы
             albums = self.client.artists_direct_albums(artist_id, page_size=100)
@@ -231,14 +521,24 @@ class ContentDownloader:
 
                         total_tracks = sum(len(volume) for volume in full_album.volumes)
                         total_discs = len(full_album.volumes)
+                        album_context = AlbumContext.from_album(full_album, album_name, total_discs)
 
                         if total_tracks == 1:
                             print(f"\nСкачиваю сингл: {album_name}")
                             singles_dir = os.path.join(artist_dir, "Singles & Other Tracks")
 
-                            for volume in full_album.volumes:
-                                for track in volume:
-                                    self.track_downloader.download_track(track, singles_dir, album_name, total_tracks, total_discs)
+                            records = self._compact_tasks(
+                                (
+                                    (track, singles_dir, album_name, total_tracks, total_discs, album_context)
+                                    for volume in full_album.volumes
+                                    for track in volume
+                                ),
+                                total_tracks,
+                            )
+                            del full_album
+                            self._download_tracks_concurrently(
+                                self._stream_tasks(records), desc=f"🎵 Сингл: {album_name}", total=total_tracks,
+                            )
 
                             print(f"Сингл '{album_name}' скачан")
                         else:
@@ -247,17 +547,20 @@ class ContentDownloader:
 
                             print(f"\nСкачиваю альбом: {album_name}")
 
-                            # Собираем все треки для progress bar
-                            tasks = []
-                            for volume in full_album.volumes:
-                                tracks_in_volume = len(volume)
-                                for track in volume:
-                                    tasks.append((track, album_dir_path, album_name, tracks_in_volume, total_discs))
-
+                            records = self._compact_tasks(
+                                (
+                                    (track, album_dir_path, album_name, len(volume), total_discs, album_context)
+                                    for volume in full_album.volumes
+                                    for track in volume
+                                ),
+                                total_tracks,
+                            )
+                            del full_album
                             self._download_tracks_concurrently(
-                                tasks,
+                                self._stream_tasks(records),
                                 desc=f"💿 Альбом: {album_name}",
                                 colour="blue",
+                                total=total_tracks,
                             )
 
                             print(f"Альбом '{album_name}' скачан")
@@ -277,16 +580,134 @@ class ContentDownloader:
 
                 singles_dir = os.path.join(artist_dir, "Singles & Other Tracks")
 
-                tasks = [(track, singles_dir) for track in tracks.tracks]
+                total = len(tracks.tracks)
+                records = self._compact_tasks(((track, singles_dir) for track in tracks.tracks), total)
+                del tracks
                 self._download_tracks_concurrently(
-                    tasks,
+                    self._stream_tasks(records),
                     desc="🎵 Отдельные треки",
                     colour="yellow",
+                    total=total,
                 )
 
-            print(f"\nВсе треки артиста '{artist_name}' успешно скачаны в {artist_dir}")
+            self._report_done(f"\nВсе треки артиста '{artist_name}' успешно скачаны в {artist_dir}")
             logger.info("Артист '%s' скачан в %s", artist_name, artist_dir)
 
         except Exception as e:
             logger.exception("Ошибка при получении информации об артисте: %s", e)
-            print(f"Ошибка при получении информации об артисте: {e}")
\ No newline at end of file
+            print(f"Ошибка при получении информации об артисте: {e}")
+
+    def _stream_tasks(self, records, batch_size=100):
+        """Задачи из компактных записей TrackTask: треки подгружаются пачками по мере скачивания.
+
+        records — deque: выданные записи из неё удаляются, и в памяти остаются
+        только ещё не прочитанные компактные записи и текущее окно задач.
+        """
+        for task in hydrate_tasks(self.client, drain(records), batch_size):
+            if task.track is not None:
+                yield task.args()
+                continue
+            logger.warning("Трек %s недоступен", task.track_id)
+            if self.journal and self.job_id is not None:
+                task_key = make_task_key(task.track_id, task.output_dir)
+                self.journal.mark(self.job_id, task_key, TASK_FAILED, "трек недоступен")
+            self.progress.track_done()
+
+    def _compact_tasks(self, tasks, total):
+        """Компактные записи TrackTask для задач-кортежей (track, output_dir, ...) альбома или артиста.
+
+        Как для плейлиста: если задач больше task_window, полные объекты
+        треков не хранятся — они подгружаются пачками перед скачиванием
+        (_stream_tasks), а ответ каталога можно отпустить.
+        """
+        keep_tracks = total <= self.task_window
+        records = deque()
+        for args in tasks:
+            track, output_dir, album_name, total_tracks, total_discs, album_context = args + (None,) * (6 - len(args))
+            album_id = album_context.album_id if album_context is not None else self._task_record(track, output_dir)["album_id"]
+            records.append(TrackTask(
+                track.id, album_id, output_dir, album_name, total_tracks, total_discs, album_context,
+                track=track if keep_tracks else None,
+            ))
+        return records
+
+    def _hydrate_tasks(self, records):
+        """Восстанавливает задачи для скачивания из записей журнала или манифеста"""
+        return self._stream_tasks(deque(TrackTask.from_record(record) for record in records))
+
+    def resume_job(self, job_id):
+        """Продолжает ранее начатое задание по его номеру"""
+        job = self.journal.get_job(job_id) if self.journal else None
+        if not job:
+            print(f"Задание #{job_id} не найдено")
+            return
+        if job["url"].startswith(MANIFEST_URL_PREFIX):
+            self.download_manifest(job["url"][len(MANIFEST_URL_PREFIX):])
+        else:
+            self.download_url(job["url"])
+
+    def download_manifest(self, manifest_path):
+        """Скачивает треки из манифеста пробного прогона (python main.py --plan) как одно задание"""
+        from downloader.planner import load_manifest
+
+        try:
+            manifest = load_manifest(manifest_path)
+        except (OSError, ValueError) as e:
+            logger.error("Не удалось прочитать манифест %s: %s", manifest_path, e)
+            print(f"Не удалось прочитать манифест: {e}")
+            return
+
+        records = [entry for entry in manifest.get("tracks", []) if entry.get("available")]
+        if not records:
+            print("В манифесте нет доступных треков")
+            return
+
+        print(f"Скачиваю по манифесту {manifest_path}: треков {len(records)} ({manifest.get('url')})")
+        logger.info("Скачивание по манифесту %s: треков %s", manifest_path, len(records))
+        self._begin_job(MANIFEST_URL_PREFIX + os.path.abspath(manifest_path))
+        tasks = self._hydrate_tasks(records)
+        with self._manifest_quality(manifest), self._job_output(manifest_path):
+            if self.layout is not None:
+                # Имена из манифеста: файлы получают ровно те пути, что показал пробный прогон
+                for entry in records:
+                    if entry.get("destination"):
+                        name = os.path.splitext(os.path.basename(entry["destination"]))[0]
+                        self.layout.reserve(entry["track_id"], entry["output_dir"], name)
+            self._download_tracks_concurrently(tasks, desc=f"📋 {os.path.basename(manifest_path)}", total=len(records))
+        self._finish_job()
+
+    def retry_failed(self, job_id):
+        """Повторно скачивает только неудачные треки задания, без повторного обхода каталога"""
+        job = self.journal.get_job(job_id) if self.journal else None
+        if not job:
+            print(f"Задание #{job_id} не найдено")
+            return
+
+        failed = self.journal.tasks(job_id, [TASK_FAILED])
+        if not failed:
+            print(f"В задании #{job_id} нет неудачных треков")
+            return
+
+        print(f"Повторяю неудачные треки задания #{job_id}: {len(failed)}")
+        logger.info("Повтор неудачных треков задания #%s: %s", job_id, len(failed))
+        self.journal.reopen_job(job_id)
+        self.job_id = job_id
+        tasks = self._hydrate_tasks(failed)
+        source = job["url"]
+        manifest = {}
+        if source.startswith(MANIFEST_URL_PREFIX):
+            from downloader.planner import load_manifest
+
+            source = source[len(MANIFEST_URL_PREFIX):]
+            try:
+                manifest = load_manifest(source)
+            except (OSError, ValueError) as e:
+                logger.warning("Не удалось прочитать манифест %s, качество — из AUDIO_QUALITY: %s", source, e)
+        with self._manifest_quality(manifest), self._job_output(source):
+            if self.layout is not None:
+                # Имена всех треков задания, включая скачанные: повтор не займёт имя чужого файла
+                for record in self.journal.tasks(job_id):
+                    if record.get("file_name"):
+                        self.layout.reserve(record["track_id"], record["output_dir"], record["file_name"])
+            self._download_tracks_concurrently(tasks, desc=f"🔁 Задание #{job_id}", colour="red", total=len(failed))
+        self._finish_job()
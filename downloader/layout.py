@@ -0,0 +1,82 @@
+import logging
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from utils.file_utils import sanitize_filename
+
+
+logger = logging.getLogger(__name__)
+
+
+def base_name(track) -> str:
+    """Имя файла трека без расширения: «Исполнитель - Название»"""
+    artist = ', '.join(artist.name for artist in track.artists)
+    return f"{sanitize_filename(artist)} - {sanitize_filename(track.title)}"
+
+
+class LayoutPlanner:
+    """Раскладка файлов задания: имена без коллизий и папки, созданные один раз.
+
+    Имена назначаются в порядке обхода каталога, до скачивания. Если в одной
+    папке два разных трека получают одинаковое имя (без учёта регистра и
+    расширения — на Windows и macOS это один файл), первый сохраняет обычное
+    имя, остальные получают версию трека («Live», «Remix»), а если её нет или
+    она тоже совпала — id трека. Правило не зависит от того, какой трек
+    скачается раньше, поэтому при продолжении задания имена те же.
+    """
+
+    def __init__(self, sink=None):
+        self.sink = sink
+        self.collisions = 0
+        self._owners: Dict[Tuple[str, str], str] = {}
+        self._names: Dict[Tuple[str, str], str] = {}
+        self._dirs = set()
+        self._lock = threading.Lock()
+
+    def _claim(self, folder: str, name: str, track_id: str) -> bool:
+        owner = self._owners.setdefault((folder, name.casefold()), track_id)
+        return owner == track_id
+
+    def assign(self, track, output_dir: str) -> str:
+        """Назначает треку имя в папке output_dir (повторный вызов возвращает то же имя)"""
+        track_id = str(track.id)
+        with self._lock:
+            name = self._names.get((track_id, output_dir))
+            if name is not None:
+                return name
+
+            folder = os.path.normcase(os.path.abspath(output_dir))
+            name = base_name(track)
+            if not self._claim(folder, name, track_id):
+                self.collisions += 1
+                version = getattr(track, "version", None)
+                candidates = [f"{name} ({sanitize_filename(version)})"] if version else []
+                candidates.append(f"{name} ({track_id})")
+                for candidate in candidates:
+                    if self._claim(folder, candidate, track_id):
+                        name = candidate
+                        break
+                logger.info("Совпадение имён в %s: трек %s сохранится как %s", output_dir, track_id, name)
+
+            self._names[(track_id, output_dir)] = name
+            new_dir = output_dir not in self._dirs
+            self._dirs.add(output_dir)
+
+        if new_dir and self.sink is not None:
+            self.sink.ensure_dir(output_dir)
+        return name
+
+    def reserve(self, track_id, output_dir: str, name: str) -> None:
+        """Закрепляет за треком имя, назначенное раньше (из журнала задания): assign вернёт его же,
+        а другие треки в этой папке его не займут"""
+        track_id = str(track_id)
+        folder = os.path.normcase(os.path.abspath(output_dir))
+        with self._lock:
+            self._owners[(folder, name.casefold())] = track_id
+            self._names[(track_id, output_dir)] = name
+
+    def name(self, track, output_dir: str) -> Optional[str]:
+        """Назначенное имя без расширения (None, если трек не проходил через assign)"""
+        with self._lock:
+            return self._names.get((str(track.id), output_dir))
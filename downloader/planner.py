@@ -0,0 +1,147 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from downloader.content_downloader import ContentDownloader
+from downloader.layout import LayoutPlanner
+from utils.progress import format_bytes, format_duration
+
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+class PlanningContentDownloader(ContentDownloader):
+    """Пробный прогон: обходит каталог и разрешает ссылки, ничего не скачивая.
+
+    Для каждого трека определяет кодек, точный размер файла (HEAD или запрос
+    первого байта) и путь сохранения. Результат — JSON-манифест, который
+    потом можно скачать как обычное задание: python main.py --manifest FILE.
+    """
+
+    def __init__(self, client, config, track_downloader=None, download_dir=None):
+        # Пробный прогон не создаёт заданий в журнале
+        super().__init__(client, config, track_downloader, download_dir, use_journal=False)
+        self.concurrency = max(1, getattr(config, "PLAN_CONCURRENCY", 16))
+        self.entries = []
+
+    def _download_tracks_concurrently(self, tasks, desc, colour="green", total=None):
+        """Вместо скачивания разрешает ссылки и размеры треков параллельно"""
+        if not tasks:
+            return
+        tasks = list(tasks)
+        if self.layout is not None:
+            # Имена назначаются в порядке обхода — так же, как при скачивании по манифесту
+            for args in tasks:
+                self.layout.assign(args[0], args[1])
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            entries = list(executor.map(lambda args: self._plan_track(*args), tasks))
+        self.entries.extend(entries)
+        print(f"{desc}: запланировано треков: {len(entries)}")
+
+    def _report_done(self, message):
+        """Ничего не скачано — сообщать о скачивании нечего"""
+
+    def _new_layout(self):
+        """Только имена: пробный прогон не создаёт папок"""
+        return LayoutPlanner()
+
+    def _plan_track(self, track, output_dir, album_name=None, total_tracks=None, total_discs=None, album_context=None):
+        entry = self._task_record(track, output_dir, album_name, total_tracks, total_discs)
+        entry.update({
+            "artist": ', '.join(artist.name for artist in track.artists),
+            "title": track.title,
+            "duration_ms": getattr(track, "duration_ms", None),
+            "available": False,
+            "codec": None,
+            "bitrate": None,
+            "size": None,
+            "destination": None,
+        })
+        try:
+            source = self.track_downloader.resolve_source(track)
+        except Exception as e:
+            logger.warning("Не удалось получить ссылку на трек %s: %s", track.id, e)
+            source = None
+        if source is None:
+            return entry
+
+        file_ext = source.expected_ext
+        postprocessor = self.track_downloader.postprocessor
+        if postprocessor is not None and postprocessor.remux and source.codec == 'flac-mp4':
+            # После постобработки FLAC из MP4 сохраняется обычным FLAC
+            file_ext = '.flac'
+        entry.update({
+            "available": True,
+            "codec": source.codec,
+            "bitrate": source.bitrate,
+            "size": self.track_downloader.probe_size(source),
+            "destination": os.path.join(
+                output_dir,
+                self.track_downloader.output_filename(
+                    track, file_ext, self.layout.name(track, output_dir) if self.layout else None,
+                ),
+            ),
+        })
+        return entry
+
+    def plan(self, url, manifest_path):
+        """Строит манифест для ссылки и сохраняет его в manifest_path"""
+        started_at = time.monotonic()
+        self.entries = []
+        self.download_url(url)
+
+        available = [entry for entry in self.entries if entry["available"]]
+        total_bytes = sum(entry["size"] or 0 for entry in available)
+        throughput = self.throughput.estimate()
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "url": url,
+            "quality": self.track_downloader.audio_quality,
+            "download_dir": self.download_dir,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "tracks": self.entries,
+            "totals": {
+                "tracks": len(self.entries),
+                "available": len(available),
+                "unavailable": len(self.entries) - len(available),
+                "unknown_size": sum(1 for entry in available if entry["size"] is None),
+                "bytes": total_bytes,
+                "duration_ms": sum(entry["duration_ms"] or 0 for entry in available),
+            },
+            "throughput": throughput,
+            "eta_seconds": round(total_bytes / throughput) if throughput else None,
+        }
+
+        manifest_dir = os.path.dirname(manifest_path)
+        if manifest_dir:
+            os.makedirs(manifest_dir, exist_ok=True)
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+        totals = manifest["totals"]
+        print(f"\nМанифест сохранён: {manifest_path}")
+        print(f"Треков: {totals['tracks']} (недоступно: {totals['unavailable']})")
+        print(f"Объём: {format_bytes(total_bytes)}")
+        if manifest["eta_seconds"] is not None:
+            print(f"Примерное время скачивания: {format_duration(manifest['eta_seconds'])} "
+                  f"(при скорости {format_bytes(throughput)}/с)")
+        else:
+            print("Примерное время скачивания неизвестно: ещё нет замеров скорости")
+        logger.info(
+            "Построен манифест %s: треков %s, %s байт, за %.1f с",
+            manifest_path, totals["tracks"], total_bytes, time.monotonic() - started_at,
+        )
+        return manifest
+
+
+def load_manifest(manifest_path):
+    """Читает манифест пробного прогона"""
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"неподдерживаемый формат манифеста: {manifest_path}")
+    return manifest
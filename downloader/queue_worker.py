@@ -0,0 +1,236 @@
+import logging
+import os
+import socket
+import threading
+from collections import OrderedDict
+
+from downloader.content_downloader import ContentDownloader
+from downloader.layout import LayoutPlanner
+from downloader.track_downloader import TrackDownloader
+from utils.integrity import IntegrityError
+from utils.metadata import AlbumContext
+from utils.job_journal import JobJournal, task_track_ref, JOB_MODE_QUEUE, TASK_DONE, TASK_FAILED, TASK_PENDING
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueueingContentDownloader(ContentDownloader):
+    """Координатор: обходит каталог и ставит треки в общую очередь, ничего не скачивая сам"""
+
+    job_mode = JOB_MODE_QUEUE
+
+    def _download_tracks_concurrently(self, tasks, desc, colour="green", total=None):
+        """Вместо скачивания только регистрирует треки в журнале (воркеры берут их в порядке регистрации)"""
+        queued = sum(len(window) for window in self._task_windows(tasks))
+        print(f"{desc}: поставлено в очередь треков: {queued}")
+
+    def _report_done(self, message):
+        """Ничего не скачано — сообщать о скачивании нечего"""
+
+    def _new_layout(self):
+        """Только имена: они сохраняются в журнале (file_name), а папки создают воркеры,
+        возможно на других машинах"""
+        return LayoutPlanner()
+
+    def _begin_job(self, url):
+        """Пока каталог обходится, воркеры не закрывают задание, даже разобрав все поставленные треки"""
+        super()._begin_job(url)
+        if self.journal and self.job_id is not None:
+            self.journal.set_enumerating(self.job_id, True)
+
+    def _finish_job(self):
+        """Задание закроет воркер, обработавший последний трек (или координатор, если треки уже разобраны)"""
+        if not self.journal or self.job_id is None:
+            return
+
+        job_id, self.job_id = self.job_id, None
+        self.journal.set_enumerating(job_id, False)
+        self.journal.finish_job_if_complete(job_id)
+        counts = self.journal.task_counts(job_id)
+        print(f"\nЗадание #{job_id} в очереди: треков {sum(counts.values())}")
+        print("Запустите воркеры: python main.py --worker")
+
+
+class QueueWorker:
+    """Воркер общей очереди заданий.
+
+    Несколько потоков захватывают треки из журнала с арендой, скачивают их
+    обычным TrackDownloader и записывают результат. Отдельный поток
+    продлевает аренду захваченных треков, пока они скачиваются.
+
+    Имя файла трек получает из журнала (назначено координатором), а треки
+    альбома — общий контекст альбома: он запрашивается один раз на альбом
+    и хранится для последних ALBUM_CACHE_SIZE альбомов.
+    """
+
+    # Треки альбома стоят в очереди подряд: нескольких последних альбомов достаточно
+    ALBUM_CACHE_SIZE = 16
+
+    def __init__(self, client, config, journal=None):
+        self.client = client
+        self.journal = journal or JobJournal(getattr(config, "JOB_JOURNAL_FILE", "cache/jobs.sqlite3"))
+        self.track_downloader = TrackDownloader(client, config)
+        self.threads = max(1, getattr(config, "MAX_CONCURRENT_DOWNLOADS", 4))
+        self.lease_seconds = max(10, getattr(config, "WORKER_LEASE_SECONDS", 300))
+        self.poll_interval = max(1, getattr(config, "WORKER_POLL_SECONDS", 5))
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._held = {}
+        self._held_lock = threading.Lock()
+        self._albums = OrderedDict()
+        self._albums_lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def _heartbeat(self):
+        """Продлевает аренду всех захваченных треков каждую треть срока аренды"""
+        while not self._stop_event.wait(self.lease_seconds / 3):
+            with self._held_lock:
+                held = list(self._held.items())
+            for (job_id, task_key), worker_id in held:
+                if not self.journal.renew_lease(job_id, task_key, worker_id, self.lease_seconds):
+                    logger.warning("Аренда трека %s (задание #%s) потеряна", task_key, job_id)
+
+    def _album_context(self, record):
+        """Контекст альбома для трека, поставленного в очередь в составе альбома (иначе None)"""
+        album_id = record.get("album_id")
+        if not album_id or not record.get("album_name"):
+            return None
+        with self._albums_lock:
+            if album_id in self._albums:
+                self._albums.move_to_end(album_id)
+                return self._albums[album_id]
+
+        album_context = None
+        try:
+            album = self.client.albums_with_tracks(album_id)
+            if album is not None and album.volumes:
+                album_context = AlbumContext.from_album(album, record["album_name"], record["total_discs"])
+        except Exception as e:
+            logger.warning("Ошибка при получении альбома %s: %s", album_id, e)
+
+        evicted = []
+        with self._albums_lock:
+            album_context = self._albums.setdefault(album_id, album_context)
+            while len(self._albums) > self.ALBUM_CACHE_SIZE:
+                evicted.append(self._albums.popitem(last=False)[1])
+        # Остальные треки вытесненного альбома мог скачать другой воркер: ReplayGain альбома здесь не посчитать
+        postprocessor = self.track_downloader.postprocessor
+        if postprocessor is not None:
+            postprocessor.discard([context for context in evicted if context is not None])
+        return album_context
+
+    def _process(self, record, worker_id):
+        """Скачивает один захваченный трек и записывает результат в журнал"""
+        job_id, task_key = record["job_id"], record["task_key"]
+        state, reason = TASK_FAILED, None
+        try:
+            tracks = self.client.tracks(task_track_ref(record))
+            if not tracks:
+                reason = "трек недоступен"
+            else:
+                output_path = self.track_downloader.download_track(
+                    tracks[0],
+                    record["output_dir"],
+                    record["album_name"],
+                    record["total_tracks"],
+                    record["total_discs"],
+                    album_context=self._album_context(record),
+                    name=record.get("file_name"),
+                )
+                if output_path:
+                    state = TASK_DONE
+                else:
+                    reason = "не удалось скачать трек"
+        except IntegrityError as e:
+            reason = str(e)
+            # Повреждённый файл не сохранён: трек возвращается в очередь, пока не исчерпаны попытки
+            if record.get("attempts", 0) < self.track_downloader.integrity_retries:
+                logger.warning("Трек %s не прошёл проверку целостности, возвращён в очередь: %s", task_key, e)
+                state = TASK_PENDING
+            else:
+                logger.warning("Трек %s не прошёл проверку целостности: %s", task_key, e)
+        except Exception as e:
+            logger.warning("Ошибка при скачивании трека %s: %s", task_key, e)
+            reason = str(e) or type(e).__name__
+
+        if not self.journal.complete_task(job_id, task_key, worker_id, state, reason):
+            logger.warning("Результат трека %s отброшен: аренда истекла", task_key)
+        self.journal.finish_job_if_complete(job_id)
+
+    def _loop(self, index, follow):
+        worker_id = f"{self.worker_prefix}:{index}"
+        while not self._stop_event.is_set():
+            record = self.journal.claim_task(worker_id, self.lease_seconds)
+            if record is None:
+                if not follow:
+                    return
+                self._stop_event.wait(self.poll_interval)
+                continue
+
+            key = (record["job_id"], record["task_key"])
+            with self._held_lock:
+                self._held[key] = worker_id
+            try:
+                self._process(record, worker_id)
+            finally:
+                with self._held_lock:
+                    self._held.pop(key, None)
+
+    def run(self, follow=False):
+        """Разбирает очередь, пока в ней есть треки (или бесконечно при follow=True)"""
+        logger.info("Воркер %s запущен, потоков: %s", self.worker_prefix, self.threads)
+        heartbeat = threading.Thread(target=self._heartbeat, name="lease-heartbeat", daemon=True)
+        heartbeat.start()
+        loops = [
+            threading.Thread(target=self._loop, args=(index, follow), name=f"queue-worker-{index}")
+            for index in range(self.threads)
+        ]
+        for thread in loops:
+            thread.start()
+        try:
+            for thread in loops:
+                while thread.is_alive():
+                    thread.join(timeout=1)
+        finally:
+            self._stop_event.set()
+        logger.info("Воркер %s остановлен", self.worker_prefix)
+
+
+def run_worker_process(index=0, follow=False):
+    """Точка входа процесса-воркера (используется и для дочерних процессов)"""
+    import config
+    from utils.logging_setup import setup_logging
+    from utils.session_cache import create_client
+
+    # У каждого процесса свой файл лога: ротация не рассчитана на несколько процессов
+    log_file = getattr(config, "LOG_FILE", "logs/app.log")
+    if index:
+        base, ext = os.path.splitext(log_file)
+        config.LOG_FILE = f"{base}.worker{index}{ext}"
+    setup_logging(config)
+
+    QueueWorker(create_client(config), config).run(follow=follow)
+
+
+def run_workers(processes=1, follow=False):
+    """Запускает несколько процессов-воркеров и ждёт их завершения"""
+    import multiprocessing
+
+    if processes <= 1:
+        run_worker_process(0, follow)
+        return
+
+    children = [
+        multiprocessing.Process(target=run_worker_process, args=(index, follow), name=f"worker-{index}")
+        for index in range(1, processes + 1)
+    ]
+    for child in children:
+        child.start()
+    try:
+        for child in children:
+            child.join()
+    except KeyboardInterrupt:
+        for child in children:
+            child.terminate()
+        for child in children:
+            child.join()
@@ -0,0 +1,205 @@
+import logging
+import os
+from collections import OrderedDict
+
+from audio.audio_processor import AudioProcessor
+from downloader.task_stream import iter_windows
+from downloader.track_downloader import TrackDownloader
+from utils.metadata import AlbumContext, extract_metadata
+from utils.response_cache import revalidate
+
+
+logger = logging.getLogger(__name__)
+
+# Расширения, которые сохраняет загрузчик
+AUDIO_EXTENSIONS = ('.mp3', '.flac', '.m4a', '.mp4', '.ogg', '.oga', '.opus')
+
+
+class LibraryRefresher:
+    """Обновление тегов уже скачанной библиотеки без повторного скачивания аудио.
+
+    Обходит папку, находит трек каждого файла по собственному тегу
+    (AudioProcessor.read_identity) или по индексу библиотеки, подгружает
+    треки пачками одним запросом client.tracks и альбомы — по одному
+    запросу на альбом. Для каждого файла считается отпечаток тегов, которые
+    записал бы загрузчик сейчас; если он совпадает с записанным в файле,
+    файл не трогается. Иначе теги и обложка перезаписываются на месте через
+    AudioProcessor, аудиоданные не меняются. По сети идут только метаданные
+    и обложки изменившихся треков.
+
+    Кэш метаданных не используется, а сохранённые ответы API каталога
+    перепроверяются условным запросом (utils.response_cache.revalidate),
+    поэтому изменения в каталоге видны сразу, а не после истечения их TTL.
+    """
+
+    # Треков в одном запросе client.tracks
+    BATCH_SIZE = 100
+
+    # Сколько последних альбомов держать в памяти (файлы альбома обычно лежат рядом)
+    ALBUM_CACHE_SIZE = 32
+
+    def __init__(self, client, config, track_downloader=None):
+        self.client = client
+        self.download_dir = getattr(config, "DOWNLOAD_DIR", "downloads")
+        # Обложки и индекс библиотеки — общие с загрузчиком
+        self.track_downloader = track_downloader or TrackDownloader(client, config)
+        self.library = self.track_downloader.library
+        self._albums = OrderedDict()
+        self.counts = {"checked": 0, "current": 0, "retagged": 0, "unmatched": 0, "missing": 0, "failed": 0}
+
+    def refresh(self, root=None):
+        """Обновляет теги всех файлов в папке root (по умолчанию DOWNLOAD_DIR). Возвращает счётчики"""
+        root = root or self.download_dir
+        print(f"Обновление тегов библиотеки: {root}")
+        logger.info("Обновление тегов библиотеки: %s", root)
+        for window in iter_windows(self._identify_files(root), self.BATCH_SIZE):
+            self._refresh_batch(window)
+
+        counts = self.counts
+        print(
+            f"\nПроверено файлов: {counts['checked']}, обновлено: {counts['retagged']}, "
+            f"актуальны: {counts['current']}, не опознаны: {counts['unmatched']}, "
+            f"нет в каталоге: {counts['missing']}, ошибок: {counts['failed']}"
+        )
+        logger.info("Обновление тегов завершено: %s", counts)
+        return counts
+
+    # Поиск файлов и треков
+
+    def _identify_files(self, root):
+        """Файлы библиотеки с треком: (путь, track_id, album_id, записанный отпечаток тегов)"""
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                # Скрытые файлы — недокачанные временные файлы загрузчика
+                if filename.startswith('.') or os.path.splitext(filename)[1].lower() not in AUDIO_EXTENSIONS:
+                    continue
+                path = os.path.join(dirpath, filename)
+                self.counts["checked"] += 1
+                try:
+                    track_id, album_id, digest = AudioProcessor.read_identity(path)
+                except Exception as e:
+                    logger.warning("Не удалось прочитать теги %s: %s", path, e)
+                    self.counts["failed"] += 1
+                    continue
+                if track_id is None and self.library is not None:
+                    # Файл скачан до появления собственных тегов: трек известен по индексу
+                    entry = self.library.get(path)
+                    if entry is not None:
+                        track_id, album_id = entry["track_id"], entry["album_id"]
+                if track_id is None:
+                    logger.info("Трек файла не опознан: %s", path)
+                    self.counts["unmatched"] += 1
+                    continue
+                yield path, track_id, album_id, digest
+
+    def _fetch_tracks(self, window):
+        refs = [f"{track_id}:{album_id}" if album_id else track_id for _, track_id, album_id, _ in window]
+        try:
+            with revalidate():
+                tracks = self.client.tracks(refs)
+            return {str(track.id): track for track in tracks}
+        except Exception as e:
+            logger.warning("Ошибка при получении треков: %s", e)
+            return {}
+
+    def _album(self, album_id):
+        """(AlbumContext, {track_id: треков в его диске}, число дисков) или None, если альбом получить не удалось"""
+        if album_id in self._albums:
+            self._albums.move_to_end(album_id)
+            return self._albums[album_id]
+        entry = None
+        try:
+            with revalidate():
+                album = self.client.albums_with_tracks(album_id)
+        except Exception as e:
+            logger.warning("Ошибка при получении альбома %s: %s", album_id, e)
+            album = None
+        if album is not None and album.volumes:
+            disc_sizes = {str(track.id): len(volume) for volume in album.volumes for track in volume}
+            total_discs = len(album.volumes)
+            entry = (AlbumContext.from_album(album, album.title, total_discs), disc_sizes, total_discs)
+        self._albums[album_id] = entry
+        while len(self._albums) > self.ALBUM_CACHE_SIZE:
+            self._albums.popitem(last=False)
+        return entry
+
+    # Перезапись тегов
+
+    def _refresh_batch(self, window):
+        tracks = self._fetch_tracks(window)
+        for path, track_id, album_id, digest in window:
+            track = tracks.get(str(track_id))
+            if track is None:
+                logger.warning("Трек %s не найден в каталоге: %s", track_id, path)
+                self.counts["missing"] += 1
+                continue
+            try:
+                self._refresh_file(path, track, album_id, digest)
+            except Exception as e:
+                logger.warning("Ошибка при обновлении тегов %s: %s", path, e, extra={"track_id": track.id})
+                print(f"Ошибка при обновлении тегов {path}: {e}")
+                self.counts["failed"] += 1
+
+    def _refresh_file(self, path, track, album_id, digest):
+        # Теги собираются так же, как при скачивании альбома, но мимо кэша метаданных:
+        # обновление должно видеть текущие данные каталога
+        album_context, album_name, total_tracks, total_discs = None, None, None, None
+        if not album_id and getattr(track, "albums", None):
+            album_id = getattr(track.albums[0], "id", None)
+        entry = self._album(str(album_id)) if album_id else None
+        if entry is not None and str(track.id) in entry[1]:
+            album_context, disc_sizes, total_discs = entry
+            album_name = album_context.album
+            total_tracks = disc_sizes[str(track.id)]
+
+        metadata = extract_metadata(
+            track,
+            album_name=album_name,
+            total_tracks=total_tracks,
+            total_discs=total_discs,
+            metadata_cache=None,
+            album_context=album_context,
+        )
+        if digest == AudioProcessor.tags_digest(metadata, AudioProcessor.cover_uri(track, album_context)):
+            self.counts["current"] += 1
+            return
+
+        cover_content = None
+        try:
+            if album_context is not None:
+                cover_content = album_context.cover(self.track_downloader._get_cover, track.cover_uri)
+            elif track.cover_uri:
+                cover_content = self.track_downloader._get_cover(track.cover_uri)
+        except Exception as e:
+            logger.debug("Не удалось скачать обложку: %s", e, extra={"track_id": track.id})
+
+        AudioProcessor.process_audio(
+            path,
+            track,
+            cover_content,
+            album_name,
+            total_tracks,
+            total_discs,
+            metadata_cache=None,
+            album_context=album_context,
+        )
+        self.counts["retagged"] += 1
+        if self.library is not None:
+            # Аудиопоток не менялся: в индексе обновляется только размер файла
+            indexed = self.library.get(path)
+            if indexed is not None:
+                self.library.record(
+                    path,
+                    indexed["track_id"],
+                    os.path.getsize(path),
+                    album_id=indexed["album_id"],
+                    codec=indexed["codec"],
+                    bitrate=indexed["bitrate"],
+                    quality=indexed["quality"],
+                    stream_size=indexed["stream_size"],
+                    stream_sha256=indexed["stream_sha256"],
+                    remuxed_from=indexed.get("remuxed_from"),
+                )
+        logger.info("Обновлены теги: %s", path, extra={"track_id": track.id, "stage": "tag"})
+        print(f"Обновлены теги: {path}")
@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.progress import format_duration
+
+
+# Политики порядка скачивания треков пачки
+ORDER_SOURCE = "source"
+ORDER_LONGEST = "longest"
+ORDER_INTERLEAVE = "interleave"
+
+ORDER_POLICIES = (ORDER_SOURCE, ORDER_LONGEST, ORDER_INTERLEAVE)
+
+
+def task_weight(track) -> int:
+    """Оценка объёма работы по треку: размер файла, если известен, иначе длительность"""
+    size = getattr(track, "file_size", None)
+    if size:
+        return size
+    return getattr(track, "duration_ms", None) or 0
+
+
+def _task_group(args) -> Any:
+    """Группа для чередования: альбом трека, а если его нет — папка назначения"""
+    albums = getattr(args[0], "albums", None)
+    if albums:
+        return getattr(albums[0], "id", None) or args[1]
+    return args[1]
+
+
+def order_tasks(tasks: List[tuple], policy: str, weight: Callable[[Any], int] = task_weight) -> List[tuple]:
+    """Упорядочивает задачи (кортежи с треком первым элементом) по политике policy.
+
+    source     — как в альбоме/плейлисте;
+    longest    — сначала самые длинные треки (LPT): хвост пачки состоит из
+                 коротких треков, и потоки заканчивают почти одновременно;
+    interleave — по очереди из каждого альбома, чтобы ни один альбом пачки
+                 не ждал, пока скачаются все остальные.
+    """
+    if policy == ORDER_LONGEST:
+        # sorted устойчив: треки одинаковой длины остаются в исходном порядке
+        return sorted(tasks, key=lambda args: weight(args[0]), reverse=True)
+    if policy == ORDER_INTERLEAVE:
+        groups: "OrderedDict[Any, List[tuple]]" = OrderedDict()
+        for args in tasks:
+            groups.setdefault(_task_group(args), []).append(args)
+        ordered = []
+        queues = [iter(group) for group in groups.values()]
+        while queues:
+            alive = []
+            for group in queues:
+                args = next(group, None)
+                if args is not None:
+                    ordered.append(args)
+                    alive.append(group)
+            queues = alive
+        return ordered
+    return list(tasks)
+
+
+class BatchStats:
+    """Время выполнения пачки (makespan) и загрузка потоков.
+
+    Каждая задача пачки выполняется через run: по отметкам начала и конца
+    считаются makespan, суммарное время работы и нижняя граница makespan
+    для тех же задач (самая длинная задача или работа, поровну разделённая
+    между потоками) — по ней видно, насколько порядок далёк от идеального.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = max(1, workers)
+        self.tasks = 0
+        self.busy = 0.0
+        self.longest = 0.0
+        self._first: Optional[float] = None
+        self._last: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def run(self, fn: Callable, *args: Any, **kwargs: Any):
+        started_at = time.monotonic()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            finished_at = time.monotonic()
+            with self._lock:
+                self.tasks += 1
+                self.busy += finished_at - started_at
+                self.longest = max(self.longest, finished_at - started_at)
+                self._first = started_at if self._first is None else min(self._first, started_at)
+                self._last = finished_at if self._last is None else max(self._last, finished_at)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            makespan = (self._last - self._first) if self._first is not None else 0.0
+            lower_bound = max(self.longest, self.busy / self.workers)
+            return {
+                "tasks": self.tasks,
+                "workers": self.workers,
+                "makespan": round(makespan, 3),
+                "busy": round(self.busy, 3),
+                "utilization": round(self.busy / (self.workers * makespan), 3) if makespan else None,
+                "lower_bound": round(lower_bound, 3),
+            }
+
+    def report(self, policy: Optional[str] = None) -> str:
+        stats = self.stats()
+        line = f"Треков в пачке: {stats['tasks']}"
+        if policy:
+            line += f" (порядок {policy})"
+        line += f", время {format_duration(stats['makespan'])}"
+        if stats["utilization"] is not None:
+            line += (
+                f", загрузка потоков {stats['utilization'] * 100:.0f}%"
+                f", нижняя граница {format_duration(stats['lower_bound'])}"
+            )
+        return line
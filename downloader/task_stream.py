@@ -0,0 +1,99 @@
+import logging
+from collections import deque
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class TrackTask:
+    """Компактная задача скачивания: идентификаторы трека и место сохранения.
+
+    Полный объект трека (track) подгружается пачкой непосредственно перед
+    скачиванием (hydrate_tasks), поэтому очередь из десятков тысяч задач
+    занимает немного памяти. args() возвращает обычный кортеж задачи
+    (track, output_dir, album_name, total_tracks, total_discs, album_context).
+    """
+
+    __slots__ = ("track_id", "album_id", "output_dir", "album_name", "total_tracks", "total_discs",
+                 "album_context", "track")
+
+    def __init__(self, track_id, album_id, output_dir, album_name=None, total_tracks=None, total_discs=None,
+                 album_context=None, track=None):
+        self.track_id = str(track_id)
+        self.album_id = str(album_id) if album_id else None
+        self.output_dir = output_dir
+        self.album_name = album_name
+        self.total_tracks = total_tracks
+        self.total_discs = total_discs
+        self.album_context = album_context
+        self.track = track
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "TrackTask":
+        """Задача из записи журнала или манифеста"""
+        return cls(
+            record["track_id"],
+            record.get("album_id"),
+            record["output_dir"],
+            record.get("album_name"),
+            record.get("total_tracks"),
+            record.get("total_discs"),
+        )
+
+    @property
+    def ref(self) -> str:
+        """Идентификатор для client.tracks() в формате track_id:album_id"""
+        return f"{self.track_id}:{self.album_id}" if self.album_id else self.track_id
+
+    def args(self) -> tuple:
+        return (self.track, self.output_dir, self.album_name, self.total_tracks, self.total_discs, self.album_context)
+
+
+def drain(tasks: deque) -> Iterator[TrackTask]:
+    """Отдаёт задачи, удаляя их из очереди: выданная задача больше нигде не хранится"""
+    while tasks:
+        yield tasks.popleft()
+
+
+def _hydrate_batch(client, batch: List[TrackTask]) -> List[TrackTask]:
+    missing = [task for task in batch if task.track is None]
+    if missing:
+        try:
+            tracks = {str(track.id): track for track in client.tracks([task.ref for task in missing])}
+        except Exception as e:
+            logger.warning("Ошибка при получении треков: %s", e)
+            tracks = {}
+        for task in missing:
+            task.track = tracks.get(task.track_id)
+    return batch
+
+
+def hydrate_tasks(client, tasks: Iterable[TrackTask], batch_size: int = 100) -> Iterator[TrackTask]:
+    """Подгружает треки задач пачками по batch_size одним запросом client.tracks.
+
+    Порядок задач сохраняется; задачи с уже известным треком запрос не
+    тратят. Если трек получить не удалось, task.track остаётся None.
+    """
+    tasks = iter(tasks)
+    while True:
+        batch = list(islice(tasks, batch_size))
+        if not batch:
+            return
+        yield from _hydrate_batch(client, batch)
+
+
+def iter_windows(tasks: Iterable, size: int) -> Iterator[list]:
+    """Читает задачи окнами по size штук"""
+    tasks = iter(tasks)
+    while True:
+        window = list(islice(tasks, size))
+        if not window:
+            return
+        yield window
+
+
+def tracks_total(tasks) -> Optional[int]:
+    """Число задач, если его можно узнать, не читая генератор"""
+    return len(tasks) if hasattr(tasks, "__len__") else None
@@ -1,83 +1,223 @@
+import copy
 import logging
 import os
 import tempfile
 import shutil
-import requests
 import hmac
 import hashlib
 import base64
 import typing
-import random
 import time
-from Crypto.Cipher import AES
-from tqdm import tqdm
-
-from utils.file_utils import sanitize_filename, detect_audio_format
+import threading
+from collections import OrderedDict
+
+from utils.file_utils import detect_audio_format
+from utils.codec_cache import CodecCache, account_fingerprint
+from utils.integrity import FlacVerifier, IntegrityError, streaminfo_md5, validate_header
+from utils.library_index import LibraryIndex
+from utils.mirror_scoreboard import MirrorScoreboard
+from utils.memory_budget import process_budget
 from utils.metadata_cache import MetadataCache
+from utils.output_sink import create_sink
+from utils.shared_cache import shared_cache
+from utils.progress import ProgressAggregator
 from audio.audio_processor import AudioProcessor, UnsupportedAudioFormatError
-from yandex_music.utils.sign_request import DEFAULT_SIGN_KEY
+from audio.postprocess import PostProcessor
+from downloader.layout import base_name
+from downloader.transfer import HedgePolicy, MirrorTransfer, probe_size
 
 
 logger = logging.getLogger(__name__)
 
+# Допустимые значения AUDIO_QUALITY
+AUDIO_QUALITIES = ("lossless", "hq", "nq")
+
+
+class DownloadSource:
+    """Разрешённая ссылка на аудиофайл трека: адреса CDN, кодек и ключ расшифровки"""
+
+    __slots__ = ("track_id", "urls", "codec", "bitrate", "key", "lossless", "expires_at")
+
+    def __init__(self, track_id, urls, codec, bitrate=None, key=None, lossless=False, ttl=0):
+        self.track_id = track_id
+        self.urls = list(urls)
+        self.codec = codec
+        self.bitrate = bitrate
+        self.key = key
+        self.lossless = lossless
+        # Подписанные ссылки живут недолго: после expires_at ссылку нужно запросить заново
+        self.expires_at = time.time() + ttl if ttl else None
+
+    def expired(self):
+        return self.expires_at is not None and time.time() >= self.expires_at
+
+    @property
+    def file_ext(self):
+        """Расширение файла, если его можно определить по кодеку (иначе None)"""
+        if not self.lossless:
+            return None
+        # FLAC в контейнере MP4 - используем расширение .m4a
+        return '.m4a' if self.codec == 'flac-mp4' else '.flac'
+
+    @property
+    def expected_ext(self):
+        """Предполагаемое расширение до скачивания (точное для не-lossless определяется по заголовку файла)"""
+        if self.file_ext:
+            return self.file_ext
+        return '.m4a' if self.codec and self.codec.endswith('-mp4') else '.mp3'
+
+
+class _SharedSession:
+    """HTTP-пул для CDN и обложек: создаётся при первом запросе и общий для загрузчика
+    и его копий с другим качеством (TrackDownloader.for_quality)"""
+
+    def __init__(self, max_connections):
+        self.max_connections = max_connections
+        self._session = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(
+                        pool_connections=self.max_connections,
+                        pool_maxsize=self.max_connections * 2,
+                    )
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
 
 class TrackDownloader:
     """Класс для скачивания треков"""
 
-    # Секретный ключ для получения FLAC
-    SECRET = DEFAULT_SIGN_KEY
+    # Секретный ключ для получения FLAC (None — ключ по умолчанию из yandex_music)
+    SECRET = None
 
-    def __init__(self, client, config):
+    # Сколько последних обложек держать в памяти (треки альбома делят одну обложку)
+    COVER_CACHE_SIZE = 64
+
+    # Начальный размер блока при скачивании (дальше подстраивается под скорость)
+    # и оценка обложки, которую держит поток до записи тегов
+    CHUNK_SIZE = 64 * 1024
+    COVER_RESERVE = 256 * 1024
+
+    def __init__(self, client, config, progress=None):
         self.client = client
+        self.progress = progress or ProgressAggregator.from_config(config)
         self.audio_quality = getattr(config, "AUDIO_QUALITY", "hq")
+        self.max_connections = max(1, getattr(config, "MAX_CONCURRENT_DOWNLOADS", 4))
+        self.url_ttl = max(0, getattr(config, "PREFETCH_URL_TTL_SECONDS", 60))
+        self._http = _SharedSession(self.max_connections)
+        self._covers = OrderedDict()
+        self._covers_lock = threading.Lock()
+        # Сведения о последнем треке, сохранённом в потоке (см. last_transfer_size)
+        self._last = threading.local()
+        self.memory = process_budget(config)
+        # Наибольший блок чтения: данные читаются и расшифровываются в одном переиспользуемом буфере
+        self.max_chunk_size = max(self.CHUNK_SIZE, getattr(config, "TRANSFER_MAX_CHUNK_KB", 1024) * 1024)
+        # Буфер блока плюс обложка трека
+        self.buffer_reservation = self.max_chunk_size + self.COVER_RESERVE
+        # Место под файл резервируется по Content-Length до начала записи
+        self.preallocate = getattr(config, "PREALLOCATE_ENABLED", True)
+        # Общий для узлов уровень кэша за локальными кэшами (None — не настроен)
+        self.shared_cache = shared_cache(config)
         if getattr(config, "METADATA_CACHE_ENABLED", False):
             cache_file = getattr(config, "METADATA_CACHE_FILE", "cache/metadata.json")
             ttl_hours = getattr(config, "METADATA_CACHE_TTL_HOURS", 24)
-            self.metadata_cache = MetadataCache(cache_file, ttl_hours)
+            self.metadata_cache = MetadataCache(cache_file, ttl_hours, shared=self.shared_cache)
         else:
             self.metadata_cache = None
-
-    def _download_file_with_progress(self, url, file_path, desc="Скачивание"):
-        """Скачивает файл с отображением прогресса"""
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-
-        total_size = int(response.headers.get('content-length', 0))
-
-        # Если размер неизвестен, используем None для неопределенного прогресса
-        with open(file_path, 'wb') as f, tqdm(
-            desc=f"⬇️  {desc}",
-            total=total_size if total_size > 0 else None,
-            unit='B',
-            unit_scale=True,
-            unit_divisor=1024,
-            leave=False,
-            bar_format='{desc}: {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]',
-            ncols=100,
-            colour='green',
-            ascii=' ░▒▓█',
-            dynamic_ncols=True
-        ) as pbar:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-                    pbar.update(len(chunk))
-
-    def _decrypt_data(self, data: bytes, key: str) -> bytes:
-        """Расшифровывает данные используя AES-CTR
-        nonce равен 12 нулям согласно документации"""
-        nonce = bytes.fromhex('00' * 12)  # 12 нулей в hex формате
-        aes = AES.new(
-            key=bytes.fromhex(key),
-            nonce=nonce,
-            mode=AES.MODE_CTR,
+        if getattr(config, "CODEC_CACHE_ENABLED", True):
+            self.codec_cache = CodecCache(
+                getattr(config, "CODEC_CACHE_FILE", "cache/codecs.json"),
+                getattr(config, "CODEC_CACHE_TTL_HOURS", 168),
+                shared=self.shared_cache,
+            )
+            self.codec_cache.bind_account(account_fingerprint(client))
+        else:
+            self.codec_cache = None
+        if getattr(config, "MIRROR_STATS_ENABLED", True):
+            self.mirrors = MirrorScoreboard(getattr(config, "MIRROR_STATS_FILE", "cache/mirrors.json"))
+        else:
+            self.mirrors = None
+        self.min_speed = max(0, getattr(config, "MIRROR_MIN_SPEED_KBPS", 64)) * 1024
+        self.speed_grace_seconds = max(0.0, getattr(config, "MIRROR_SPEED_GRACE_SECONDS", 5.0))
+        self.timeout = (
+            getattr(config, "HTTP_CONNECT_TIMEOUT", 10.0),
+            getattr(config, "HTTP_READ_TIMEOUT", 30.0),
         )
-        return aes.decrypt(data)
-
-    def _download_lossless(self, track_id, temp_file_path):
-        """Скачивает трек в FLAC (lossless) используя прямой API
-        Возвращает кортеж (success: bool, codec: str) где codec может быть 'flac' или 'flac-mp4'
+        self.min_rate = max(0, getattr(config, "TRANSFER_MIN_SPEED_KBPS", 4)) * 1024
+        if getattr(config, "HEDGE_ENABLED", True):
+            self.hedge = HedgePolicy(
+                percentile=getattr(config, "HEDGE_PERCENTILE", 95),
+                min_samples=getattr(config, "HEDGE_MIN_SAMPLES", 20),
+                budget_percent=getattr(config, "HEDGE_BUDGET_PERCENT", 10),
+            )
+        else:
+            self.hedge = None
+        self.integrity_retries = max(0, getattr(config, "INTEGRITY_RETRIES", 1))
+        if getattr(config, "FLAC_VERIFY_ENABLED", False):
+            self.flac_verifier = FlacVerifier(getattr(config, "FLAC_VERIFY_PROCESSES", 2))
+        else:
+            self.flac_verifier = None
+        if getattr(config, "LIBRARY_INDEX_ENABLED", True):
+            self.library = LibraryIndex(getattr(config, "LIBRARY_INDEX_FILE", "cache/library.sqlite3"))
+        else:
+            self.library = None
+        # Куда попадают готовые треки: DOWNLOAD_DIR или S3 (архивы заданий — см. ContentDownloader)
+        self.sink = create_sink(config, memory=self.memory)
+        # Перепаковка FLAC из MP4 и ReplayGain в пуле процессов (None — выключено)
+        self.postprocessor = PostProcessor.from_config(config)
+
+    def for_quality(self, quality):
+        """Возвращает загрузчик с другим качеством, разделяющий с этим кэши, HTTP-пул и прогресс"""
+        if quality == self.audio_quality:
+            return self
+        downloader = copy.copy(self)
+        downloader.audio_quality = quality
+        return downloader
+
+    def last_transfer_size(self):
+        """Сколько байт скачано для последнего трека, сохранённого текущим потоком (0 — трек не сохранён).
+        Не зависит от приёмника: для архива или S3 размер готового файла на диске не узнать"""
+        return getattr(self._last, "transfer_size", 0)
+
+    @property
+    def session(self):
+        """Общий HTTP-пул для CDN и обложек: соединения переиспользуются между треками"""
+        return self._http.get()
+
+    def _get_cover(self, cover_uri):
+        """Скачивает обложку 200x200, повторно используя недавно скачанные"""
+        with self._covers_lock:
+            if cover_uri in self._covers:
+                self._covers.move_to_end(cover_uri)
+                return self._covers[cover_uri]
+
+        cover_url = f"https://{cover_uri.replace('%%', '200x200')}"
+        content = self.session.get(cover_url, timeout=self.timeout).content
+
+        with self._covers_lock:
+            if cover_uri not in self._covers:
+                self._covers[cover_uri] = content
+                self.memory.charge(len(content))
+            while len(self._covers) > self.COVER_CACHE_SIZE:
+                _, evicted = self._covers.popitem(last=False)
+                self.memory.uncharge(len(evicted))
+        return content
+
+    def _resolve_lossless(self, track_id):
+        """Получает ссылку на трек в FLAC (lossless) через прямой API
+        Возвращает DownloadSource с кодеком 'flac' или 'flac-mp4', либо None
         Использует тот же подход что и рабочий код из yandex-music-downloader-main"""
+        from yandex_music.utils.sign_request import DEFAULT_SIGN_KEY
+
         try:
             # Используем точно такой же подход как в рабочем коде
             # Список всех доступных кодеков (как в FILE_FORMAT_MAPPING)
@@ -96,7 +236,7 @@ class TrackDownloader:
             # Формируем HMAC подпись из значений параметров (точно как в рабочем коде)
             sign_data = ''.join(str(e) for e in params.values()).replace(',', '')
             hmac_sign = hmac.new(
-                self.SECRET.encode('utf-8'),
+                (self.SECRET or DEFAULT_SIGN_KEY).encode('utf-8'),
                 sign_data.encode('utf-8'),
                 hashlib.sha256
             )
@@ -114,81 +254,78 @@ class TrackDownloader:
             if 'error' in resp:
                 error_name = resp['error'].get('name', 'unknown')
                 if error_name == 'no-rights':
-                    print("FLAC недоступен для этого трека (нет прав), используется стандартное качество")
+                    self.progress.track_message("FLAC недоступен для этого трека (нет прав), используется стандартное качество")
+                    self._remember_codec(track_id, False, reason=error_name)
                 else:
                     print(f"Ошибка API: {error_name}")
-                return False, None
+                return None
 
             # Получаем информацию о скачивании (как в рабочем коде)
             download_info = resp.get('download_info')
             if not download_info:
-                return False, None
+                return None
 
             # Получаем кодек
             codec = download_info.get('codec', '')
 
             # Проверяем что это FLAC (чистый или в MP4)
             if codec not in ['flac', 'flac-mp4']:
-                print(f"FLAC недоступен, доступен только: {codec}")
-                return False, None
+                self.progress.track_message(f"FLAC недоступен, доступен только: {codec}")
+                self._remember_codec(track_id, False, codec=codec, reason='codec')
+                return None
+
+            self._remember_codec(track_id, True, codec=codec)
 
             # Получаем URLs (может быть несколько)
             urls = download_info.get('urls', [])
             if not urls:
-                return False, None
+                return None
 
-            # Выбираем случайный URL
-            download_url = random.choice(urls)
+            # Если transport = "encraw" и есть поле "key", файл нужно расшифровать
+            return DownloadSource(
+                track_id,
+                urls,
+                codec,
+                bitrate=download_info.get('bitrate'),
+                key=download_info.get('key'),
+                lossless=True,
+                ttl=self.url_ttl,
+            )
 
-            # Скачиваем файл с progress bar
-            artist_name = "Трек"
-            try:
-                # Пытаемся получить имя артиста для отображения в progress bar
-                track_info = self.client.tracks(track_id)[0]
-                artist_name = ', '.join(artist.name for artist in track_info.artists)
-            except:
-                pass
+        except Exception as e:
+            print(f"Ошибка при получении ссылки на FLAC: {e}")
+            return None
 
-            # Скачиваем файл с progress bar
-            response = requests.get(download_url, stream=True)
-            response.raise_for_status()
-
-            total_size = int(response.headers.get('content-length', 0))
-            track_data = b''
-
-            with tqdm(
-                desc=f"🎵 {artist_name}",
-                total=total_size,
-                unit='B',
-                unit_scale=True,
-                unit_divisor=1024,
-                leave=False,
-                bar_format='{desc}: {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]',
-                ncols=100,
-                colour='cyan',
-                ascii=' ░▒▓█',
-                dynamic_ncols=True
-            ) as pbar:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        track_data += chunk
-                        pbar.update(len(chunk))
-
-            # Проверяем нужна ли расшифровка
-            # Если transport = "encraw" и есть поле "key", нужно расшифровать
-            decryption_key = download_info.get('key')
-            if decryption_key:
-                track_data = self._decrypt_data(track_data, decryption_key)
-
-            # Сохраняем файл (как есть - flac или flac-mp4)
-            with open(temp_file_path, 'wb') as f:
-                f.write(track_data)
-
-            return True, codec
+    def _fetch(self, source, temp_file_path):
+        """Скачивает аудиофайл по разрешённой ссылке с лучшего зеркала, при необходимости расшифровывая его.
+        Возвращает TransferResult"""
+        transfer = MirrorTransfer(
+            self.session,
+            self.progress,
+            scoreboard=self.mirrors,
+            min_speed=self.min_speed,
+            grace_seconds=self.speed_grace_seconds,
+            chunk_size=self.CHUNK_SIZE,
+            max_chunk_size=self.max_chunk_size,
+            timeout=self.timeout,
+            min_rate=self.min_rate,
+            hedge=self.hedge,
+            memory=self.memory,
+            preallocate=self.preallocate,
+        )
+        return transfer.fetch(source.urls, temp_file_path, key=source.key)
 
-        except Exception as e:
-            print(f"Ошибка при скачивании FLAC: {e}")
-            return False, None
+    def _remember_codec(self, track_id, lossless, codec=None, reason=None):
+        """Запоминает исход запроса lossless для трека в кэше кодеков"""
+        if self.codec_cache is not None:
+            self.codec_cache.set(track_id, lossless, codec=codec, reason=reason)
+
+    def _lossless_known_unavailable(self, track_id):
+        """True, если по кэшу у трека заведомо нет lossless"""
+        if self.codec_cache is None:
+            return False
+        entry = self.codec_cache.get(track_id)
+        return bool(entry) and not entry.get("lossless")
 
     def _get_best_codec(self, track):
         """Определяет лучший доступный кодек в зависимости от настроек качества"""
@@ -211,37 +348,37 @@ class TrackDownloader:
                     # Вернем None, будем использовать прямой API
                     return None
                 else:
-                    print("FLAC недоступен в стандартном API, используется максимальное качество")
+                    self.progress.track_message("FLAC недоступен в стандартном API, используется максимальное качество")
                     return download_info[0]
 
             elif self.audio_quality == "hq":
                 # Ищем MP3 320 kbps или ближайший по качеству
                 for info in download_info:
                     if info.codec == "mp3" and info.bitrate_in_kbps >= 320:
-                        print(f"Качество: MP3 {info.bitrate_in_kbps} kbps")
+                        self.progress.track_message(f"Качество: MP3 {info.bitrate_in_kbps} kbps")
                         return info
                 # Если точно 320 нет, берем максимальный MP3
                 mp3_codecs = [info for info in download_info if info.codec == "mp3"]
                 if mp3_codecs:
-                    print(f"Качество: MP3 {mp3_codecs[0].bitrate_in_kbps} kbps")
+                    self.progress.track_message(f"Качество: MP3 {mp3_codecs[0].bitrate_in_kbps} kbps")
                     return mp3_codecs[0]
                 # Если MP3 недоступен, берем максимальный битрейт
-                print(f"MP3 недоступен, используем: {download_info[0].codec.upper()} {download_info[0].bitrate_in_kbps} kbps")
+                self.progress.track_message(f"MP3 недоступен, используем: {download_info[0].codec.upper()} {download_info[0].bitrate_in_kbps} kbps")
                 return download_info[0]
 
             elif self.audio_quality == "nq":
                 # Ищем MP3 192 kbps или ближайший
                 for info in download_info:
                     if info.codec == "mp3" and 128 <= info.bitrate_in_kbps <= 192:
-                        print(f"Качество: MP3 {info.bitrate_in_kbps} kbps")
+                        self.progress.track_message(f"Качество: MP3 {info.bitrate_in_kbps} kbps")
                         return info
                 # Если нет подходящего, берем минимальный MP3
                 mp3_codecs = [info for info in download_info if info.codec == "mp3"]
                 if mp3_codecs:
-                    print(f"Качество: MP3 {mp3_codecs[-1].bitrate_in_kbps} kbps")
+                    self.progress.track_message(f"Качество: MP3 {mp3_codecs[-1].bitrate_in_kbps} kbps")
                     return mp3_codecs[-1]
                 # Если MP3 недоступен, берем минимальный битрейт
-                print(f"MP3 недоступен, используем: {download_info[-1].codec.upper()} {download_info[-1].bitrate_in_kbps} kbps")
+                self.progress.track_message(f"MP3 недоступен, используем: {download_info[-1].codec.upper()} {download_info[-1].bitrate_in_kbps} kbps")
                 return download_info[-1]
 
             # По умолчанию максимальное качество
@@ -252,168 +389,270 @@ class TrackDownloader:
             print("Ошибка при выборе кодека")
             return None
 
-    def download_track(self, track, output_dir, album_name=None, total_tracks=None, total_discs=None):
-        """Скачивает трек и сохраняет его локально"""
-        artist = ', '.join(artist.name for artist in track.artists)
-        title = track.title
+    def _resolve_standard(self, track):
+        """Получает прямую ссылку на лучший подходящий кодек стандартного API"""
+        codec_info = self._get_best_codec(track)
+        if not codec_info:
+            return None
+        return DownloadSource(
+            track.id,
+            [codec_info.get_direct_link()],
+            codec_info.codec,
+            bitrate=codec_info.bitrate_in_kbps,
+            ttl=self.url_ttl,
+        )
 
-        print(f"\nСкачиваю: {artist} - {title}")
-        logger.info("Начало скачивания: %s - %s (качество: %s)", artist, title, self.audio_quality)
-        # Специальная обработка для lossless
+    def resolve_source(self, track):
+        """Разрешает ссылку на аудиофайл трека, ничего не скачивая.
+        Возвращает DownloadSource или None, если трек недоступен"""
         if self.audio_quality == "lossless":
-            # Пробуем скачать через прямой API
-            # Сначала создаем временный файл без расширения, потом определим правильное
-            with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                temp_file_path = temp_file.name
-
-            success, codec = self._download_lossless(track.id, temp_file_path)
-
-            if not success:
-                # Если не удалось через прямой API, используем стандартный метод
-                os.unlink(temp_file_path)
-                codec_info = self._get_best_codec(track)
-
-                if not codec_info:
-                    logger.error("Не удалось получить информацию о скачивании для трека '%s'", title)
-                    print(f"Ошибка: Не удалось получить информацию о скачивании для трека '{title}'")
-                    return
-
-                # Пытаемся получить URL для скачивания с progress bar
-                download_url = None
-                try:
-                    download_info_list = track.get_download_info()
-                    if download_info_list:
-                        # Находим соответствующий download_info
-                        for info in download_info_list:
-                            if info.codec == codec_info.codec and info.bitrate_in_kbps == codec_info.bitrate_in_kbps:
-                                # Пытаемся получить URL из download_info
-                                if hasattr(info, 'download_info'):
-                                    download_info_dict = info.download_info
-                                    # Проверяем разные варианты структуры данных
-                                    if isinstance(download_info_dict, dict):
-                                        urls = download_info_dict.get('urls', [])
-                                        if urls:
-                                            download_url = urls[0] if isinstance(urls, list) else None
-                                    elif hasattr(download_info_dict, 'urls'):
-                                        urls = download_info_dict.urls
-                                        if urls:
-                                            download_url = urls[0] if isinstance(urls, list) else None
-                                break
-                except Exception:
-                    # Если не удалось получить URL, используем стандартный метод
-                    pass
-
-                if download_url:
-                    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                        self._download_file_with_progress(download_url, temp_file.name, f"Скачивание: {artist} - {title}")
-                        temp_file_path = temp_file.name
-                else:
-                    # Fallback на стандартный метод без progress bar
-                    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                        codec_info.download(temp_file.name)
-                        temp_file_path = temp_file.name
-
-                file_ext = detect_audio_format(temp_file_path)
-                temp_file_with_ext = temp_file_path + file_ext
-                shutil.move(temp_file_path, temp_file_with_ext)
-                temp_file_path = temp_file_with_ext
+            if self._lossless_known_unavailable(track.id):
+                # Не тратим подписанный запрос: lossless для трека уже известен как недоступный
+                logger.info(
+                    "Lossless недоступен по кэшу кодеков, используется лучший доступный кодек",
+                    extra={"track_id": track.id, "stage": "resolve"},
+                )
             else:
-                # Определяем правильное расширение на основе кодека
-                if codec == 'flac-mp4':
-                    # FLAC в контейнере MP4 - используем расширение .m4a
-                    file_ext = '.m4a'
-                    temp_file_with_ext = temp_file_path + file_ext
-                    shutil.move(temp_file_path, temp_file_with_ext)
-                    temp_file_path = temp_file_with_ext
-                else:
-                    # Чистый FLAC
-                    file_ext = '.flac'
-                    temp_file_with_ext = temp_file_path + file_ext
-                    shutil.move(temp_file_path, temp_file_with_ext)
-                    temp_file_path = temp_file_with_ext
-        else:
-            # Стандартная обработка для hq и nq
-            codec_info = self._get_best_codec(track)
-
-            if not codec_info:
-                logger.error("Не удалось получить информацию о скачивании для трека '%s'", title)
-                print(f"Ошибка: Не удалось получить информацию о скачивании для трека '{title}'")
-                return
-
-            # Пытаемся получить URL для скачивания с progress bar
-            download_url = None
+                source = self._resolve_lossless(track.id)
+                if source is not None:
+                    return source
+        return self._resolve_standard(track)
+
+    def probe_size(self, source):
+        """Размер файла по ссылке без скачивания (None, если узнать не удалось)"""
+        urls = self.mirrors.rank(source.urls) if self.mirrors is not None else source.urls
+        for url in urls:
             try:
-                download_info_list = track.get_download_info()
-                if download_info_list:
-                    # Находим соответствующий download_info
-                    for info in download_info_list:
-                        if info.codec == codec_info.codec and info.bitrate_in_kbps == codec_info.bitrate_in_kbps:
-                            # Пытаемся получить URL из download_info
-                            if hasattr(info, 'download_info'):
-                                download_info_dict = info.download_info
-                                # Проверяем разные варианты структуры данных
-                                if isinstance(download_info_dict, dict):
-                                    urls = download_info_dict.get('urls', [])
-                                    if urls:
-                                        download_url = urls[0] if isinstance(urls, list) else None
-                                elif hasattr(download_info_dict, 'urls'):
-                                    urls = download_info_dict.urls
-                                    if urls:
-                                        download_url = urls[0] if isinstance(urls, list) else None
-                            break
-            except Exception:
-                # Если не удалось получить URL, используем стандартный метод
-                pass
+                size = probe_size(self.session, url, timeout=self.timeout)
+            except Exception as e:
+                logger.debug("Не удалось узнать размер файла по %s: %s", url, e)
+                continue
+            if size is not None:
+                return size
+        return None
+
+    @staticmethod
+    def output_filename(track, file_ext, name=None):
+        """Имя файла трека: «Исполнитель - Название.ext» или name (см. LayoutPlanner) с расширением"""
+        return f"{name or base_name(track)}{file_ext}"
+
+    def _fetch_with_fallback(self, track, source, temp_file_path):
+        """Скачивает файл; если не удалась lossless-ссылка, повторяет со стандартным кодеком
+        (кроме ошибки целостности — её обрабатывает повтор скачивания или очередь заданий).
+        Возвращает (фактически использованный источник, TransferResult) или (None, None)"""
+        try:
+            return source, self._fetch(source, temp_file_path)
+        except IntegrityError:
+            # Файл повреждён, а не недоступен: трек перекачивается в том же качестве
+            raise
+        except Exception as e:
+            if not source.lossless:
+                raise
+            print(f"Ошибка при скачивании FLAC: {e}")
 
-            if download_url:
-                with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                    self._download_file_with_progress(download_url, temp_file.name, f"Скачивание: {artist} - {title}")
-                    temp_file_path = temp_file.name
-            else:
-                # Fallback на стандартный метод без progress bar
-                with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                    codec_info.download(temp_file.name)
-                    temp_file_path = temp_file.name
+        source = self._resolve_standard(track)
+        if source is None:
+            return None, None
+        return source, self._fetch(source, temp_file_path)
+
+    def _download_audio(self, track, source, temp_dir=None):
+        """Скачивает и проверяет аудиофайл трека во временный файл (в папке temp_dir, если задана).
+        Возвращает (путь, расширение, источник, TransferResult) или None, если трек недоступен"""
+        if source is not None and source.expired():
+            logger.info("Ссылка на трек устарела, запрашивается заново", extra={"track_id": track.id, "stage": "resolve"})
+            source = None
+        if source is None:
+            source = self.resolve_source(track)
+        if source is None:
+            return None
+
+        # Сначала создаем временный файл без расширения, потом определим правильное
+        with tempfile.NamedTemporaryFile(delete=False, dir=temp_dir, prefix=".", suffix=".part") as temp_file:
+            temp_file_path = temp_file.name
+        try:
+            source, result = self._fetch_with_fallback(track, source, temp_file_path)
+            if source is None:
+                os.unlink(temp_file_path)
+                return None
 
-            file_ext = detect_audio_format(temp_file_path)
+            # Для lossless расширение известно по кодеку, иначе определяем по заголовку файла
+            file_ext = source.file_ext or detect_audio_format(temp_file_path)
             temp_file_with_ext = temp_file_path + file_ext
             shutil.move(temp_file_path, temp_file_with_ext)
             temp_file_path = temp_file_with_ext
 
+            validate_header(result.head, file_ext)
+            if self.flac_verifier is not None and file_ext == '.flac' and streaminfo_md5(result.head):
+                self.flac_verifier.verify(temp_file_path)
+        except Exception:
+            if os.path.exists(temp_file_path):
+                os.unlink(temp_file_path)
+            raise
+
+        return temp_file_path, file_ext, source, result
+
+    def _postprocess(self, track, temp_file_path, file_ext, source, tag):
+        """Постобработка в пуле процессов: FLAC из MP4 → FLAC (с повторной записью тегов) и ReplayGain трека.
+        Ошибка постобработки не мешает сохранить трек как есть.
+        Возвращает (путь, расширение, громкость блоков или None)"""
+        started_at = time.monotonic()
+        try:
+            processed_path, loudness = self.postprocessor.process(temp_file_path, source.codec)
+            if processed_path != temp_file_path:
+                # Теги MP4 не переносятся в FLAC: записываем заново, как для обычного FLAC
+                temp_file_path, file_ext = processed_path, '.flac'
+                tag(temp_file_path)
+            self.postprocessor.write_track_gain(temp_file_path, loudness)
+        except Exception as e:
+            logger.warning("Ошибка постобработки: %s", e, extra={"track_id": track.id, "stage": "postprocess"})
+            print(f"Ошибка постобработки: {e}")
+            return temp_file_path, file_ext, None
+        logger.debug(
+            "Постобработка завершена", extra={
+                "track_id": track.id, "stage": "postprocess", "duration": round(time.monotonic() - started_at, 3),
+            },
+        )
+        return temp_file_path, file_ext, loudness
+
+    def download_track(
+        self, track, output_dir, album_name=None, total_tracks=None, total_discs=None, source=None, album_context=None,
+        sink=None, name=None,
+    ):
+        """Скачивает трек и сохраняет его.
+        source — заранее разрешённая ссылка (если устарела, запрашивается заново).
+        album_context — общие данные альбома (utils.metadata.AlbumContext), если трек скачивается в составе альбома.
+        sink — приёмник файла (utils.output_sink), по умолчанию общий приёмник загрузчика.
+        name — имя файла без расширения, назначенное раскладкой задания (downloader.layout).
+        Возвращает, куда сохранён трек (путь, член архива или s3://-адрес), или None, если скачать не удалось"""
+        # Допуск по бюджету памяти: если буферы других загрузок заняли бюджет, ждём
+        with self.memory.reserve(self.buffer_reservation):
+            return self._download_track(
+                track, output_dir, album_name, total_tracks, total_discs, source, album_context, sink or self.sink,
+                name,
+            )
+
+    def _download_track(
+        self, track, output_dir, album_name, total_tracks, total_discs, source, album_context, sink, name,
+    ):
+        artist = ', '.join(artist.name for artist in track.artists)
+        title = track.title
+
+        started_at = time.monotonic()
+        self._last.transfer_size = 0
+
+        self.progress.track_message(f"\nСкачиваю: {artist} - {title}", log=False)
+        logger.info(
+            "Начало скачивания: %s - %s (качество: %s)", artist, title, self.audio_quality,
+            extra={"track_id": track.id, "stage": "start"},
+        )
+
+        # Повреждённый файл не сохраняем: трек скачивается заново по свежей ссылке
+        attempt = 0
+        while True:
+            try:
+                downloaded = self._download_audio(track, source, sink.staging_dir(output_dir))
+                break
+            except IntegrityError as e:
+                logger.warning(
+                    "Файл не прошёл проверку целостности: %s", e,
+                    extra={"track_id": track.id, "stage": "verify"},
+                )
+                print(f"Ошибка проверки целостности: {e}")
+                if attempt >= self.integrity_retries:
+                    raise
+                attempt += 1
+                source = None
+
+        if downloaded is None:
+            logger.error(
+                "Не удалось получить информацию о скачивании для трека '%s'", title,
+                extra={"track_id": track.id, "stage": "resolve"},
+            )
+            print(f"Ошибка: Не удалось получить информацию о скачивании для трека '{title}'")
+            return None
+        temp_file_path, file_ext, source, result = downloaded
+
         # Получаем обложку
         cover_content = None
-        if track.cover_uri:
-            cover_url = f"https://{track.cover_uri.replace('%%', '200x200')}"
+        if album_context is not None:
+            try:
+                cover_content = album_context.cover(self._get_cover, track.cover_uri)
+            except:
+                pass
+        elif track.cover_uri:
             try:
-                cover_content = requests.get(cover_url).content
+                cover_content = self._get_cover(track.cover_uri)
             except:
                 pass
 
         # Применяем метаданные
-        try:
+        def tag(path):
             AudioProcessor.process_audio(
-                temp_file_path,
+                path,
                 track,
                 cover_content,
                 album_name,
                 total_tracks,
                 total_discs,
                 metadata_cache=self.metadata_cache,
+                album_context=album_context,
             )
+
+        try:
+            tag(temp_file_path)
         except UnsupportedAudioFormatError as e:
-            logger.error("Неподдерживаемый формат: %s", e)
+            logger.error("Неподдерживаемый формат: %s", e, extra={"track_id": track.id, "stage": "tag"})
             print(f"Ошибка: {e}")
             os.unlink(temp_file_path)
-            return
-
-        # Сохраняем файл
-        safe_artist = sanitize_filename(artist)
-        safe_title = sanitize_filename(title)
-        filename = f"{safe_artist} - {safe_title}{file_ext}"
+            return None
 
-        os.makedirs(output_dir, exist_ok=True)
+        loudness = None
+        codec, remuxed_from = source.codec, None
+        if self.postprocessor is not None and self.postprocessor.applies(source.codec):
+            downloaded_path = temp_file_path
+            temp_file_path, file_ext, loudness = self._postprocess(track, temp_file_path, file_ext, source, tag)
+            if temp_file_path != downloaded_path:
+                # Файл перепакован: в индексе — кодек файла, а поток (размер, SHA-256) — исходный
+                codec, remuxed_from = 'flac', source.codec
 
-        output_path = os.path.join(output_dir, filename)
-        shutil.move(temp_file_path, output_path)
-        logger.info("Сохранено: %s", output_path)
-        print(f"\nСохранено: {output_path}")
\ No newline at end of file
+        # Сохраняем файл
+        filename = self.output_filename(track, file_ext, name)
+        size = os.path.getsize(temp_file_path)
+        try:
+            output_path = sink.store(temp_file_path, os.path.join(output_dir, filename))
+        finally:
+            if os.path.exists(temp_file_path):
+                os.unlink(temp_file_path)
+        self._last.transfer_size = result.size
+        if self.postprocessor is not None:
+            self.postprocessor.track_saved(album_context, output_path, loudness)
+        if self.library is not None:
+            if album_context is not None:
+                album_id = album_context.album_id
+            else:
+                album = track.albums[0] if getattr(track, "albums", None) else None
+                album_id = getattr(album, "id", None)
+            self.library.record(
+                output_path,
+                track.id,
+                size,
+                album_id=album_id,
+                codec=codec,
+                bitrate=source.bitrate,
+                quality=self.audio_quality,
+                stream_size=result.size,
+                stream_sha256=result.sha256,
+                local=sink.local,
+                remuxed_from=remuxed_from,
+            )
+        logger.info(
+            "Сохранено: %s", output_path,
+            extra={
+                "track_id": track.id,
+                "stage": "saved",
+                "duration": round(time.monotonic() - started_at, 3),
+                "bytes": size,
+            },
+        )
+        self.progress.track_message(f"\nСохранено: {output_path}", log=False)
+        return output_path
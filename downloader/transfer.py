@@ -0,0 +1,457 @@
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from utils.integrity import HEADER_SIZE, IntegrityError
+from utils.mirror_scoreboard import mirror_host
+
+
+logger = logging.getLogger(__name__)
+
+
+class SlowTransferError(IOError):
+    """Скорость передачи упала ниже допустимого минимума"""
+
+
+class _TransferCancelled(Exception):
+    """Передачу отменили: дублирующий запрос завершился раньше"""
+
+
+class TransferResult:
+    """Итог скачивания: ссылка, размер, SHA-256 и первые байты записанных данных"""
+
+    __slots__ = ("url", "size", "sha256", "head")
+
+    def __init__(self, url, size, sha256, head):
+        self.url = url
+        self.size = size
+        self.sha256 = sha256
+        self.head = head
+
+
+class HedgePolicy:
+    """Когда и как часто запускать дублирующие (hedged) запросы.
+
+    Запоминает длительность последних успешных скачиваний. Если текущее
+    скачивание длится дольше заданного перцентиля, можно запустить второй
+    запрос на другое зеркало. Число дублей ограничено бюджетом: не больше
+    budget_percent процентов от числа скачиваний, чтобы не умножать нагрузку.
+    """
+
+    # Сколько последних длительностей хранить
+    WINDOW = 200
+
+    # Сколько дублей можно накопить про запас
+    MAX_TOKENS = 5.0
+
+    def __init__(self, percentile=95, min_samples=20, budget_percent=10):
+        self.percentile = min(99.9, max(50.0, percentile))
+        self.min_samples = max(1, min_samples)
+        self.budget = max(0.0, budget_percent) / 100.0
+        self._durations = deque(maxlen=self.WINDOW)
+        self._tokens = 1.0
+        self._lock = threading.Lock()
+
+    def threshold(self):
+        """Порог в секундах, после которого стоит дублировать запрос (None — данных мало)"""
+        with self._lock:
+            if len(self._durations) < self.min_samples:
+                return None
+            ordered = sorted(self._durations)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return ordered[index]
+
+    def record(self, seconds):
+        with self._lock:
+            self._durations.append(seconds)
+            self._tokens = min(self.MAX_TOKENS, self._tokens + self.budget)
+
+    def try_acquire(self):
+        """Забирает один дубль из бюджета; False, если бюджет исчерпан"""
+        with self._lock:
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            return True
+
+
+class _Attempt:
+    """Одна попытка скачать файл в отдельном потоке (основная или дублирующая).
+
+    Каждая попытка пишет в свой файл. Проигравшую попытку не ждут: она
+    замечает отмену на следующем блоке данных и сама удаляет свой файл.
+    Байты проигравшей попытки вычитаются из общего прогресса, когда её
+    поток остановился: в итоге учитываются только байты победителя.
+    """
+
+    def __init__(self, transfer, urls, file_path, key, results, name, reserved=0):
+        self.urls = urls
+        self.file_path = file_path
+        self.result = None
+        self.error = None
+        # Байт, учтённых этой попыткой в общем прогрессе
+        self.received = 0
+        self.cancel_event = threading.Event()
+        self._transfer = transfer
+        self._key = key
+        self._results = results
+        self._reserved = reserved
+        self._done = False
+        self._discarded = False
+        self._lock = threading.Lock()
+        threading.Thread(target=self._run, name=name, daemon=True).start()
+
+    def _run(self):
+        try:
+            self.result = self._transfer._fetch_sequential(self.urls, self.file_path, self._key, self.cancel_event, self)
+        except BaseException as e:
+            self.error = e
+        if self._reserved:
+            self._transfer.memory.release(self._reserved)
+        with self._lock:
+            self._done = True
+            if self._discarded:
+                self._remove_file()
+                self._uncount()
+        self._results.put(self)
+
+    def _remove_file(self):
+        try:
+            os.unlink(self.file_path)
+        except OSError:
+            pass
+
+    def _uncount(self):
+        if self.received:
+            self._transfer.progress.add_bytes(-self.received)
+            self.received = 0
+
+    def discard(self):
+        """Отменяет попытку и удаляет её файл (сразу или по завершении потока)"""
+        self.cancel_event.set()
+        with self._lock:
+            self._discarded = True
+            if self._done:
+                self._remove_file()
+                self._uncount()
+
+
+class ChunkSizer:
+    """Размер блока чтения по измеренной скорости передачи.
+
+    Блок подбирается так, чтобы его чтение занимало около target_seconds:
+    на быстром канале — крупные блоки и меньше итераций цикла на мегабайт,
+    на медленном — мелкие, чтобы отмена и проверка скорости срабатывали
+    без задержки. Размер — степень двойки в пределах [minimum, maximum].
+    """
+
+    def __init__(self, initial=64 * 1024, minimum=16 * 1024, maximum=1024 * 1024, target_seconds=0.05):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.target_seconds = target_seconds
+        self.size = min(self.maximum, max(self.minimum, initial))
+
+    def update(self, received, elapsed):
+        """Пересчитывает размер по числу полученных байт за elapsed секунд"""
+        if elapsed <= 0:
+            return self.size
+        wanted = received / elapsed * self.target_seconds
+        size = self.minimum
+        while size * 2 <= wanted and size * 2 <= self.maximum:
+            size *= 2
+        self.size = size
+        return size
+
+
+def _body_reader(response):
+    """Функция readinto для тела ответа или None, если тело нужно читать через iter_content.
+
+    readinto у urllib3 всё равно создаёт промежуточный bytes, поэтому
+    читаем напрямую из http.client.HTTPResponse под ним: данные из сокета
+    попадают сразу в переданный буфер. Сжатое тело (Content-Encoding)
+    так читать нельзя — его распаковывает urllib3.
+    """
+    if response.headers.get("Content-Encoding"):
+        return None
+    fp = getattr(response.raw, "_fp", None)
+    readinto = getattr(fp, "readinto", None)
+    return readinto if readinto is not None else getattr(response.raw, "readinto", None)
+
+
+class _OutputFile:
+    """Файл назначения с расшифровкой на лету и поддержкой докачки.
+
+    Попутно считает SHA-256 и запоминает первые байты записанных
+    (расшифрованных) данных, чтобы проверить файл без повторного чтения.
+    """
+
+    def __init__(self, file_path, key=None):
+        self.key = key
+        self._file = open(file_path, "wb")
+        self._reset()
+
+    def _reset(self):
+        self.offset = 0
+        self.head = b""
+        self._hash = hashlib.sha256()
+        self._cipher = self._new_cipher()
+
+    def _new_cipher(self):
+        """AES-CTR, nonce равен 12 нулям согласно документации"""
+        if not self.key:
+            return None
+        from Crypto.Cipher import AES
+
+        return AES.new(key=bytes.fromhex(self.key), nonce=bytes(12), mode=AES.MODE_CTR)
+
+    def write(self, chunk):
+        """Записывает блок; memoryview на изменяемый буфер расшифровывается на месте, без копии"""
+        if self._cipher is not None:
+            if isinstance(chunk, memoryview) and not chunk.readonly:
+                self._cipher.decrypt(chunk, output=chunk)
+            else:
+                chunk = self._cipher.decrypt(chunk)
+        self._file.write(chunk)
+        self._hash.update(chunk)
+        if len(self.head) < HEADER_SIZE:
+            self.head += bytes(chunk[:HEADER_SIZE - len(self.head)])
+        self.offset += len(chunk)
+
+    def preallocate(self, size):
+        """Резервирует место под файл целиком (меньше фрагментации крупных FLAC); ошибки не критичны"""
+        if size <= self.offset or not hasattr(os, "posix_fallocate"):
+            return
+        try:
+            self._file.flush()
+            os.posix_fallocate(self._file.fileno(), self.offset, size - self.offset)
+        except OSError as e:
+            logger.debug("Не удалось зарезервировать место под файл: %s", e)
+
+    def restart(self):
+        """Сервер не поддержал докачку — начинаем файл заново"""
+        self._file.seek(0)
+        self._file.truncate()
+        self._reset()
+
+    def result(self, url):
+        return TransferResult(url, self.offset, self._hash.hexdigest(), self.head)
+
+    def close(self):
+        self._file.close()
+
+
+class MirrorTransfer:
+    """Скачивание файла с нескольких зеркал CDN.
+
+    Ссылки перебираются в порядке, который даёт MirrorScoreboard. Если
+    зеркало вернуло ошибку или скорость упала ниже min_speed, передача
+    продолжается со следующего зеркала (с той же позиции, если сервер
+    поддерживает Range). На последнем зеркале переключаться уже некуда,
+    поэтому там действует только нижний предел min_rate: передача, которая
+    почти стоит, прерывается с ошибкой вместо того, чтобы занимать поток.
+
+    Если задана политика HedgePolicy и скачивание затянулось дольше её
+    порога, параллельно запускается дублирующий запрос на следующее
+    зеркало; побеждает тот, кто закончит первым, второй отменяется.
+    """
+
+    def __init__(self, session, progress, scoreboard=None, min_speed=0, grace_seconds=5.0, chunk_size=64 * 1024,
+                 timeout=None, min_rate=0, hedge=None, memory=None, max_chunk_size=1024 * 1024, preallocate=False):
+        self.session = session
+        self.progress = progress
+        self.scoreboard = scoreboard
+        self.min_speed = min_speed
+        self.grace_seconds = grace_seconds
+        # Начальный и наибольший размер блока чтения (см. ChunkSizer)
+        self.chunk_size = chunk_size
+        self.max_chunk_size = max(chunk_size, max_chunk_size)
+        # (connect, read) в секундах для requests
+        self.timeout = timeout
+        self.min_rate = min_rate
+        self.hedge = hedge
+        self.memory = memory
+        self.preallocate = preallocate
+
+    def fetch(self, urls, file_path, key=None):
+        """Скачивает файл в file_path, возвращает TransferResult"""
+        ranked = self.scoreboard.rank(urls) if self.scoreboard is not None else list(urls)
+        threshold = self.hedge.threshold() if self.hedge is not None else None
+        started_at = time.monotonic()
+        if threshold is None:
+            result = self._fetch_sequential(ranked, file_path, key)
+        else:
+            result = self._fetch_hedged(ranked, file_path, key, threshold)
+        if self.hedge is not None:
+            self.hedge.record(time.monotonic() - started_at)
+        return result
+
+    def _fetch_hedged(self, ranked, file_path, key, threshold):
+        """Основная попытка в фоне; если она дольше порога — дубль на следующее зеркало"""
+        results = queue.Queue()
+        attempts = [_Attempt(self, ranked, file_path + ".primary", key, results, "transfer-primary")]
+        try:
+            finished = results.get(timeout=threshold)
+        except queue.Empty:
+            finished = None
+            reserved = self._reserve_hedge()
+            if reserved is not None:
+                # Дубль начинает со второго по качеству зеркала (или с того же, если оно одно)
+                hedge_urls = ranked[1:] + ranked[:1]
+                logger.info(
+                    "Скачивание идёт дольше %.1f с, запущен дублирующий запрос на %s",
+                    threshold, mirror_host(hedge_urls[0]),
+                )
+                attempts.append(
+                    _Attempt(self, hedge_urls, file_path + ".hedge", key, results, "transfer-hedge", reserved)
+                )
+
+        winner, errors = None, []
+        for _ in range(len(attempts)):
+            attempt = finished if finished is not None else results.get()
+            finished = None
+            if attempt.error is None:
+                winner = attempt
+                break
+            errors.append(attempt.error)
+
+        for attempt in attempts:
+            if attempt is not winner:
+                attempt.discard()
+        if winner is None:
+            raise errors[0]
+        os.replace(winner.file_path, file_path)
+        return winner.result
+
+    def _reserve_hedge(self):
+        """Память под буферы дубля и место в бюджете дублей; None, если чего-то не хватает"""
+        reserved = self.max_chunk_size if self.memory is not None else 0
+        if reserved and not self.memory.try_acquire(reserved):
+            return None
+        if not self.hedge.try_acquire():
+            if reserved:
+                self.memory.release(reserved)
+            return None
+        return reserved
+
+    def _fetch_sequential(self, ranked, file_path, key, cancel_event=None, attempt=None):
+        output = _OutputFile(file_path, key)
+        try:
+            for index, url in enumerate(ranked):
+                last = index == len(ranked) - 1
+                try:
+                    self._stream(url, output, self.min_rate if last else max(self.min_speed, self.min_rate), cancel_event, attempt)
+                    return output.result(url)
+                except _TransferCancelled:
+                    raise
+                except Exception as e:
+                    if last:
+                        raise
+                    logger.warning("Зеркало %s: %s, переключение на следующее", mirror_host(url), e)
+        finally:
+            output.close()
+
+    def _stream(self, url, output, min_speed, cancel_event=None, attempt=None):
+        host = mirror_host(url)
+        headers = {"Range": f"bytes={output.offset}-"} if output.offset else None
+        started_at = time.monotonic()
+        body_started_at = None
+        received = 0
+        try:
+            response = self.session.get(url, stream=True, headers=headers, timeout=self.timeout)
+            try:
+                response.raise_for_status()
+                if output.offset and response.status_code != 206:
+                    output.restart()
+                body_started_at = time.monotonic()
+                ttfb = body_started_at - started_at
+                length = response.headers.get("Content-Length")
+                if self.preallocate and length and length.isdigit() and not response.headers.get("Content-Encoding"):
+                    output.preallocate(output.offset + int(length))
+
+                for chunk in self._chunks(response):
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise _TransferCancelled()
+                    output.write(chunk)
+                    received += len(chunk)
+                    self.progress.add_bytes(len(chunk))
+                    if attempt is not None:
+                        attempt.received += len(chunk)
+
+                    if min_speed:
+                        elapsed = time.monotonic() - body_started_at
+                        if elapsed > self.grace_seconds and received / elapsed < min_speed:
+                            raise SlowTransferError(f"скорость {received / elapsed / 1024:.0f} КБ/с ниже минимума")
+
+                # Обрыв соединения без ошибки не должен давать усечённый файл
+                expected = response.headers.get("Content-Length")
+                if expected and not response.headers.get("Content-Encoding") and received != int(expected):
+                    raise IntegrityError(f"получено {received} байт из {expected}")
+            finally:
+                response.close()
+        except _TransferCancelled:
+            raise
+        except Exception:
+            if self.scoreboard is not None:
+                elapsed = time.monotonic() - body_started_at if body_started_at else 0.0
+                self.scoreboard.record_failure(host, received, elapsed)
+            raise
+
+        if self.scoreboard is not None:
+            self.scoreboard.record_success(host, ttfb, received, time.monotonic() - body_started_at)
+
+
+    def _chunks(self, response):
+        """Блоки тела ответа.
+
+        Данные читаются в один заранее выделенный буфер (readinto), и каждый
+        блок отдаётся как memoryview на него: до следующей итерации блок нужно
+        записать, дальше буфер переиспользуется. Размер блока подстраивается
+        под скорость передачи (ChunkSizer).
+        """
+        readinto = _body_reader(response)
+        if readinto is None:
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                if chunk:
+                    yield chunk
+            return
+
+        sizer = ChunkSizer(self.chunk_size, maximum=self.max_chunk_size)
+        view = memoryview(bytearray(self.max_chunk_size))
+        started_at = time.monotonic()
+        received = 0
+        while True:
+            count = readinto(view[:sizer.size])
+            if not count:
+                # Тело прочитано мимо urllib3: возвращаем соединение в пул сами, иначе close() его закроет
+                release_conn = getattr(response.raw, "release_conn", None)
+                if release_conn is not None:
+                    release_conn()
+                return
+            received += count
+            yield view[:count]
+            sizer.update(received, time.monotonic() - started_at)
+
+
+def probe_size(session, url, timeout=None):
+    """Размер файла по ссылке без скачивания: HEAD, а если длины нет — запрос первого байта"""
+    response = session.head(url, allow_redirects=True, timeout=timeout)
+    length = response.headers.get("Content-Length")
+    if response.ok and length and not response.headers.get("Content-Encoding"):
+        return int(length)
+
+    response = session.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=timeout)
+    try:
+        if response.status_code == 206:
+            total = response.headers.get("Content-Range", "").rpartition("/")[2]
+            if total.isdigit():
+                return int(total)
+        length = response.headers.get("Content-Length")
+        if response.status_code == 200 and length:
+            return int(length)
+    finally:
+        response.close()
+    return None
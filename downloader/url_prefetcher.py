@@ -0,0 +1,88 @@
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+
+class UrlPrefetcher:
+    """Заранее разрешает ссылки на следующие треки очереди.
+
+    Пока потоки скачивания качают текущие треки, несколько фоновых потоков
+    запрашивают ссылки (get-file-info / get_download_info) для следующих
+    `lookahead` треков в порядке очереди. Поток скачивания забирает готовую
+    ссылку через take() и сразу начинает передачу; устаревшую ссылку
+    TrackDownloader запросит заново. Если очередь читается по частям,
+    следующие треки добавляются через extend().
+    """
+
+    def __init__(self, resolve, tracks=(), lookahead=8, threads=2):
+        self._resolve = resolve
+        self._sources = deque([iter(tracks)])
+        self.lookahead = max(1, lookahead)
+        self._pending = OrderedDict()
+        self._taken = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="url-prefetch")
+        with self._lock:
+            self._fill()
+
+    def _next_track(self):
+        while self._sources:
+            track = next(self._sources[0], None)
+            if track is not None:
+                return track
+            self._sources.popleft()
+        return None
+
+    def _fill(self):
+        """Дополняет окно упреждения до lookahead треков (вызывать под lock)"""
+        while len(self._pending) < self.lookahead:
+            track = self._next_track()
+            if track is None:
+                return
+            # Трек уже забран потоком скачивания или уже разрешается
+            if track.id in self._taken or track.id in self._pending:
+                continue
+            self._pending[track.id] = self._executor.submit(self._resolve, track)
+
+    def extend(self, tracks):
+        """Добавляет треки в конец очереди упреждения"""
+        with self._lock:
+            self._sources.append(iter(tracks))
+            self._fill()
+
+    def take(self, track):
+        """Возвращает заранее разрешённую ссылку на трек или None, если её нет"""
+        with self._lock:
+            future = self._pending.pop(track.id, None)
+            if future is None:
+                # Поток скачивания обогнал окно: этот трек разрешать заранее уже незачем
+                self._taken.add(track.id)
+            self._fill()
+
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except Exception as e:
+            logger.warning("Не удалось заранее получить ссылку на трек %s: %s", track.id, e)
+            return None
+
+    def close(self):
+        """Останавливает упреждение; уже запущенные запросы завершаются в фоне"""
+        with self._lock:
+            self._sources.clear()
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+        self._executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
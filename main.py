@@ -1,15 +1,57 @@
+import argparse
 import logging
-from yandex_music import Client
+from concurrent.futures import ThreadPoolExecutor
 import config
 from downloader.content_downloader import ContentDownloader
+from utils.job_journal import JobJournal
 from utils.logging_setup import setup_logging
+from utils.session_cache import create_client
 
 
 logger = logging.getLogger(__name__)
 
 
+def parse_args():
+    """Разбирает аргументы командной строки"""
+    parser = argparse.ArgumentParser(description="YandexMusicDownloader")
+    parser.add_argument("url", nargs="?", help="ссылка на трек, альбом, плейлист или артиста")
+    parser.add_argument("--jobs", action="store_true", help="показать последние задания из журнала")
+    parser.add_argument("--resume", type=int, metavar="JOB_ID", help="продолжить прерванное задание")
+    parser.add_argument("--retry-failed", type=int, metavar="JOB_ID", help="повторить только неудачные треки задания")
+    parser.add_argument("--enqueue", action="store_true", help="только поставить треки по ссылке в общую очередь")
+    parser.add_argument("--worker", action="store_true", help="запустить воркер общей очереди")
+    parser.add_argument("--processes", type=int, default=1, help="количество процессов-воркеров (с --worker)")
+    parser.add_argument("--follow", action="store_true", help="воркер ждёт новые задания вместо завершения")
+    parser.add_argument("--daemon", action="store_true", help="запустить демон с HTTP API заданий")
+    parser.add_argument("--plan", metavar="FILE", help="пробный прогон: сохранить манифест с размерами и временем в FILE")
+    parser.add_argument("--manifest", metavar="FILE", help="скачать треки из манифеста пробного прогона")
+    parser.add_argument(
+        "--refresh", nargs="?", const="", metavar="DIR",
+        help="обновить теги уже скачанных файлов без повторного скачивания (по умолчанию в DOWNLOAD_DIR)",
+    )
+    return parser.parse_args()
+
+
+def print_jobs():
+    """Выводит последние задания из журнала"""
+    journal = JobJournal(getattr(config, "JOB_JOURNAL_FILE", "cache/jobs.sqlite3"))
+    jobs = journal.list_jobs()
+    if not jobs:
+        print("Журнал заданий пуст")
+        return
+    for job in jobs:
+        counts = job["counts"]
+        print(
+            f"#{job['id']} [{job['status']}] {job['url']} — "
+            f"скачано {counts.get('done', 0)}/{sum(counts.values())}, "
+            f"ошибок {counts.get('failed', 0)}"
+        )
+
+
 def main():
     """Главная функция"""
+    args = parse_args()
+
     print("YandexMusicDownloader")
     print("=" * 50)
 
@@ -17,8 +59,32 @@ def main():
     setup_logging(config)
     logger.info("Приложение запущено")
 
-    # Инициализация клиента
-    client = Client(config.YANDEX_MUSIC_TOKEN).init()
+    if args.jobs:
+        print_jobs()
+        return
+
+    if args.worker:
+        from downloader.queue_worker import run_workers
+
+        print(f"Запуск воркеров очереди: {max(1, args.processes)}")
+        run_workers(processes=max(1, args.processes), follow=args.follow)
+        return
+
+    if args.daemon:
+        from service import JobScheduler, serve
+
+        scheduler = JobScheduler(create_client(config), config)
+        serve(
+            scheduler,
+            host=getattr(config, "DAEMON_HOST", "127.0.0.1"),
+            port=getattr(config, "DAEMON_PORT", 8080),
+        )
+        return
+
+    # Инициализация клиента идёт в фоне, пока пользователь вводит ссылку
+    init_executor = ThreadPoolExecutor(max_workers=1)
+    client_future = init_executor.submit(create_client, config)
+    init_executor.shutdown(wait=False)
 
     # Показываем текущие настройки
     quality_names = {
@@ -30,30 +96,49 @@ def main():
     print(f"Директория: {config.DOWNLOAD_DIR}")
     print("=" * 50)
 
-    # Создаём загрузчик
-    downloader = ContentDownloader(client, config)
-    logger.info("Инициализирован ContentDownloader")
+    if args.resume is not None or args.retry_failed is not None:
+        downloader = ContentDownloader(client_future.result(), config)
+        if args.resume is not None:
+            downloader.resume_job(args.resume)
+        else:
+            downloader.retry_failed(args.retry_failed)
+        return
+
+    if args.manifest:
+        ContentDownloader(client_future.result(), config).download_manifest(args.manifest)
+        return
+
+    if args.refresh is not None:
+        from downloader.refresher import LibraryRefresher
+
+        LibraryRefresher(client_future.result(), config).refresh(args.refresh or None)
+        return
 
-    url = input("Введите ссылку на трек, альбом, плейлист или артиста: ").strip()
+    url = args.url or input("Введите ссылку на трек, альбом, плейлист или артиста: ").strip()
 
     if not url.startswith('https://music.yandex.ru/'):
         print("Неверная ссылка. Должна начинаться с https://music.yandex.ru/")
         logger.error("Неверная ссылка: %s", url)
         return
 
-    # Определяем тип контента и скачиваем
-    if 'track' in url:
-        downloader.download_single_track(url)
-    elif 'album' in url:
-        downloader.download_album(url)
-    elif 'playlist' in url:
-        downloader.download_playlist(url)
-    elif 'artist' in url:
-        downloader.download_artist(url)
+    # Создаём загрузчик
+    client = client_future.result()
+    if args.plan:
+        from downloader.planner import PlanningContentDownloader
+
+        PlanningContentDownloader(client, config).plan(url, args.plan)
+        return
+    if args.enqueue:
+        from downloader.queue_worker import QueueingContentDownloader
+
+        downloader = QueueingContentDownloader(client, config)
     else:
-        logger.error("Неверная ссылка. Поддерживаются треки, альбомы, плейлисты и артисты.")
-        print("Неверная ссылка. Поддерживаются треки, альбомы, плейлисты и артисты.")
+        downloader = ContentDownloader(client, config)
+    logger.info("Инициализирован %s", type(downloader).__name__)
+
+    # Определяем тип контента и скачиваем
+    downloader.download_url(url)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,8 @@
+"""
+Долгоживущий демон с HTTP API заданий
+"""
+
+from .scheduler import JobScheduler, DaemonJob, JobRequestError
+from .http_api import serve
+
+__all__ = ['JobScheduler', 'DaemonJob', 'JobRequestError', 'serve']
@@ -0,0 +1,152 @@
+import json
+import logging
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from service.scheduler import JobRequestError
+
+
+logger = logging.getLogger(__name__)
+
+_JOB_PATH = re.compile(r"^/jobs/(\d+)(/progress|/cancel)?/?$")
+
+# Ограничение на размер тела запроса: задание — это небольшой JSON
+MAX_BODY_SIZE = 64 * 1024
+
+
+class JobApiHandler(BaseHTTPRequestHandler):
+    """HTTP API демона.
+
+    POST   /jobs                 — создать задание {"url", "quality", "destination", "priority"}
+    GET    /jobs                 — список заданий
+    GET    /jobs/<id>            — состояние задания
+    GET    /jobs/<id>/progress   — прогресс задания
+    POST   /jobs/<id>/cancel     — отменить задание (то же, что DELETE /jobs/<id>)
+    GET    /health               — проверка работоспособности, расход памяти под буферы, кэш API, общий кэш, аккаунты и приёмник файлов
+    """
+
+    server_version = "YandexMusicDownloader"
+
+    @property
+    def scheduler(self):
+        return self.server.scheduler
+
+    def log_message(self, format, *args):
+        # Вместо stderr пишем в общий лог приложения
+        logger.info("%s %s", self.address_string(), format % args)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message):
+        self._send_json(status, {"error": message})
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_SIZE:
+            raise JobRequestError("слишком большое тело запроса")
+        raw = self.rfile.read(length) if length else b"{}"
+        try:
+            data = json.loads(raw.decode("utf-8"))
+        except ValueError:
+            raise JobRequestError("тело запроса должно быть JSON")
+        if not isinstance(data, dict):
+            raise JobRequestError("тело запроса должно быть JSON-объектом")
+        return data
+
+    def _job_or_404(self, job_id):
+        job = self.scheduler.get(job_id)
+        if job is None:
+            self._send_error(404, f"задание #{job_id} не найдено")
+        return job
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/health":
+            health = {"status": "ok", "memory": self.scheduler.track_downloader.memory.stats()}
+            api_cache = getattr(getattr(self.scheduler.client, "_request", None), "cache", None)
+            if api_cache is not None:
+                health["api_cache"] = api_cache.stats()
+            account_pool = getattr(self.scheduler.client, "account_pool", None)
+            if account_pool is not None:
+                health["accounts"] = account_pool.stats()
+            shared = self.scheduler.track_downloader.shared_cache
+            if shared is not None:
+                health["shared_cache"] = shared.stats()
+            sink_stats = self.scheduler.track_downloader.sink.stats()
+            if sink_stats:
+                health["output"] = sink_stats
+            self._send_json(200, health)
+            return
+        if self.path.rstrip("/") == "/jobs":
+            self._send_json(200, {"jobs": [job.to_dict() for job in self.scheduler.list()]})
+            return
+
+        match = _JOB_PATH.match(self.path)
+        if not match or match.group(2) == "/cancel":
+            self._send_error(404, "неизвестный адрес")
+            return
+        job = self._job_or_404(int(match.group(1)))
+        if job is None:
+            return
+        if match.group(2) == "/progress":
+            self._send_json(200, job.progress())
+        else:
+            self._send_json(200, dict(job.to_dict(), progress=job.progress()))
+
+    def do_POST(self):
+        if self.path.rstrip("/") == "/jobs":
+            try:
+                data = self._read_json()
+                job = self.scheduler.submit(
+                    data.get("url"),
+                    quality=data.get("quality"),
+                    destination=data.get("destination"),
+                    priority=data.get("priority", 0),
+                )
+            except JobRequestError as e:
+                self._send_error(400, str(e))
+                return
+            self._send_json(201, job.to_dict())
+            return
+
+        match = _JOB_PATH.match(self.path)
+        if match and match.group(2) == "/cancel":
+            self._cancel(int(match.group(1)))
+            return
+        self._send_error(404, "неизвестный адрес")
+
+    def do_DELETE(self):
+        match = _JOB_PATH.match(self.path)
+        if match and not match.group(2):
+            self._cancel(int(match.group(1)))
+            return
+        self._send_error(404, "неизвестный адрес")
+
+    def _cancel(self, job_id):
+        job = self.scheduler.cancel(job_id)
+        if job is None:
+            self._send_error(404, f"задание #{job_id} не найдено")
+            return
+        self._send_json(200, job.to_dict())
+
+
+def serve(scheduler, host="127.0.0.1", port=8080):
+    """Запускает HTTP API и планировщик; блокирует поток до Ctrl+C"""
+    server = ThreadingHTTPServer((host, port), JobApiHandler)
+    server.daemon_threads = True
+    server.scheduler = scheduler
+    scheduler.start()
+    print(f"Демон слушает http://{host}:{port}")
+    logger.info("HTTP API демона запущен на %s:%s", host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        scheduler.stop()
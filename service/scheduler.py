@@ -0,0 +1,332 @@
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from downloader.content_downloader import ContentDownloader
+from downloader.task_order import BatchStats, order_tasks
+from downloader.task_stream import iter_windows
+from downloader.track_downloader import AUDIO_QUALITIES, TrackDownloader
+
+
+logger = logging.getLogger(__name__)
+
+
+# Состояния задания демона
+JOB_QUEUED = "queued"
+JOB_PLANNING = "planning"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+_FINAL_STATES = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+# Маркер остановки потоков
+_STOP = object()
+
+
+class JobRequestError(ValueError):
+    """Некорректные параметры задания (ссылка, качество, папка назначения)"""
+
+
+class DaemonJob:
+    """Задание демона: ссылка, качество, папка назначения, приоритет и счётчики прогресса"""
+
+    def __init__(self, job_id: int, url: str, quality: str, download_dir: str, priority: int, workers: int = 1):
+        self.id = job_id
+        self.url = url
+        self.quality = quality
+        self.download_dir = download_dir
+        self.priority = priority
+        self.status = JOB_QUEUED
+        self.error: Optional[str] = None
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.bytes = 0
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.planning_done = False
+        # Контексты альбомов задания: после закрытия задания их незавершённый ReplayGain забывается
+        self.albums = set()
+        # Makespan и доля общего пула потоков, занятая треками задания
+        self.batch = BatchStats(workers)
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+
+    def _maybe_finish(self) -> None:
+        """Закрывает задание, когда все запланированные треки обработаны (вызывать под lock)"""
+        if self.status in _FINAL_STATES or not self.planning_done:
+            return
+        if self.done + self.failed >= self.total:
+            self.status = JOB_FAILED if self.failed else JOB_DONE
+            self.finished_at = time.time()
+            logger.info("Задание демона #%s завершено: %s", self.id, self.status)
+            logger.info("Задание демона #%s: %s", self.id, self.batch.report())
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "id": self.id,
+                "url": self.url,
+                "quality": self.quality,
+                "destination": self.download_dir,
+                "priority": self.priority,
+                "status": self.status,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+    def progress(self) -> Dict[str, Any]:
+        with self.lock:
+            processed = self.done + self.failed
+            end = self.finished_at or time.time()
+            elapsed = end - self.started_at if self.started_at else 0
+            batch = self.batch.stats()
+            return {
+                "id": self.id,
+                "status": self.status,
+                "planning_done": self.planning_done,
+                "total": self.total,
+                "done": self.done,
+                "failed": self.failed,
+                "bytes": self.bytes,
+                "percent": round(100 * processed / self.total, 1) if self.total else 0.0,
+                "elapsed": round(elapsed, 1),
+                "makespan": batch["makespan"],
+                "utilization": batch["utilization"],
+            }
+
+
+class _SchedulingContentDownloader(ContentDownloader):
+    """Обходит каталог задания и отдаёт треки в общую очередь планировщика"""
+
+    def __init__(self, scheduler: "JobScheduler", job: DaemonJob, track_downloader: TrackDownloader):
+        self.scheduler = scheduler
+        self.job = job
+        # Состояние заданий демона хранится в памяти, журнал не нужен
+        super().__init__(scheduler.client, scheduler.config, track_downloader, job.download_dir, use_journal=False)
+
+    def _download_tracks_concurrently(self, tasks, desc, colour="green", total=None):
+        # Треки попадают в очередь окнами: первые начинают качаться, пока остальные ещё подгружаются
+        for window in iter_windows(tasks, self.task_window):
+            if self.job.cancel_event.is_set():
+                return
+            self.scheduler._enqueue_tasks(self.job, order_tasks(window, self.task_order))
+
+    def _report_done(self, message):
+        """Треки только поставлены в очередь — о готовности сообщит прогресс задания"""
+
+    def _new_layout(self):
+        """Треки скачивают потоки планировщика под обычными именами"""
+        return None
+
+
+class JobScheduler:
+    """Планировщик долгоживущего демона.
+
+    Один клиент, один TrackDownloader (HTTP-пул, кэш метаданных и обложек)
+    и общий пул потоков на всё время жизни процесса. Треки всех заданий
+    попадают в одну очередь с приоритетами: более высокий priority
+    обслуживается раньше, внутри приоритета — в порядке поступления.
+
+    Завершённые задания хранятся в памяти DAEMON_JOB_TTL_MINUTES минут,
+    но не больше DAEMON_MAX_FINISHED_JOBS штук: более старые забываются.
+    """
+
+    QUALITIES = AUDIO_QUALITIES
+
+    def __init__(self, client, config):
+        self.client = client
+        self.config = config
+        self.download_root = os.path.abspath(config.DOWNLOAD_DIR)
+        self.track_downloader = TrackDownloader(client, config)
+        self.workers = max(1, getattr(config, "MAX_CONCURRENT_DOWNLOADS", 4))
+        self.planners = max(1, getattr(config, "DAEMON_PLANNER_THREADS", 2))
+        self.job_ttl = max(0, getattr(config, "DAEMON_JOB_TTL_MINUTES", 1440)) * 60
+        self.max_finished_jobs = max(0, getattr(config, "DAEMON_MAX_FINISHED_JOBS", 200))
+        self._jobs: Dict[int, DaemonJob] = {}
+        self._jobs_lock = threading.Lock()
+        self._job_ids = itertools.count(1)
+        self._seq = itertools.count()
+        self._plan_queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._task_queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._threads: List[threading.Thread] = []
+
+    # --- жизненный цикл ---
+
+    def start(self) -> None:
+        for index in range(self.planners):
+            self._spawn(self._planner_loop, f"daemon-planner-{index}")
+        for index in range(self.workers):
+            self._spawn(self._worker_loop, f"daemon-worker-{index}")
+        logger.info("Планировщик запущен: потоков скачивания %s, планирования %s", self.workers, self.planners)
+
+    def _spawn(self, target, name: str) -> None:
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self) -> None:
+        # Маркер остановки идёт с наивысшим приоритетом
+        for _ in range(self.planners):
+            self._plan_queue.put((float("-inf"), next(self._seq), _STOP))
+        for _ in range(self.workers):
+            self._task_queue.put((float("-inf"), next(self._seq), _STOP))
+        for thread in self._threads:
+            thread.join()
+        logger.info("Планировщик остановлен")
+
+    # --- задания ---
+
+    def _resolve_destination(self, destination: Optional[str]) -> str:
+        """Папка назначения — только внутри DOWNLOAD_DIR"""
+        if not destination:
+            return self.download_root
+        path = os.path.abspath(os.path.join(self.download_root, destination))
+        if os.path.commonpath([path, self.download_root]) != self.download_root:
+            raise JobRequestError("destination должен быть путём внутри DOWNLOAD_DIR")
+        return path
+
+    def submit(self, url: str, quality: Optional[str] = None, destination: Optional[str] = None, priority: int = 0) -> DaemonJob:
+        if not isinstance(url, str) or not url.startswith('https://music.yandex.ru/'):
+            raise JobRequestError("url должен начинаться с https://music.yandex.ru/")
+        quality = quality or self.track_downloader.audio_quality
+        if quality not in self.QUALITIES:
+            raise JobRequestError(f"quality должен быть одним из: {', '.join(self.QUALITIES)}")
+        try:
+            priority = int(priority)
+        except (TypeError, ValueError):
+            raise JobRequestError("priority должен быть целым числом")
+
+        download_dir = self._resolve_destination(destination)
+        job = DaemonJob(next(self._job_ids), url, quality, download_dir, priority, workers=self.workers)
+        with self._jobs_lock:
+            self._prune_jobs()
+            self._jobs[job.id] = job
+        self._plan_queue.put((-priority, next(self._seq), job))
+        logger.info("Принято задание демона #%s: %s (качество %s, приоритет %s)", job.id, url, quality, priority)
+        return job
+
+    def get(self, job_id: int) -> Optional[DaemonJob]:
+        with self._jobs_lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[DaemonJob]:
+        with self._jobs_lock:
+            self._prune_jobs()
+            return list(self._jobs.values())
+
+    def _prune_jobs(self) -> None:
+        """Забывает завершённые задания старше job_ttl и сверх max_finished_jobs (вызывать под _jobs_lock)"""
+        finished = sorted(
+            (job for job in self._jobs.values() if job.status in _FINAL_STATES and job.finished_at),
+            key=lambda job: job.finished_at,
+        )
+        deadline = time.time() - self.job_ttl
+        excess = len(finished) - self.max_finished_jobs
+        for index, job in enumerate(finished):
+            if index < excess or job.finished_at < deadline:
+                del self._jobs[job.id]
+
+    def cancel(self, job_id: int) -> Optional[DaemonJob]:
+        """Отменяет задание: треки из очереди пропускаются, уже начатые докачиваются"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        with job.lock:
+            if job.status not in _FINAL_STATES:
+                job.cancel_event.set()
+                job.status = JOB_CANCELLED
+                job.finished_at = time.time()
+                logger.info("Задание демона #%s отменено", job.id)
+        self._release_albums(job)
+        return job
+
+    def _release_albums(self, job: DaemonJob) -> None:
+        """Забывает незавершённые альбомы закрытого задания: остальные их треки уже не придут.
+        Повторный вызов безопасен — трек, докачанный после отмены, тоже не оставит альбом в памяти"""
+        postprocessor = self.track_downloader.postprocessor
+        with job.lock:
+            if job.status not in _FINAL_STATES or not job.albums:
+                return
+            albums = list(job.albums)
+        if postprocessor is not None:
+            postprocessor.discard(albums)
+
+    def _enqueue_tasks(self, job: DaemonJob, tasks) -> None:
+        with job.lock:
+            job.total += len(tasks)
+            job.albums.update(args[5] for args in tasks if len(args) > 5 and args[5] is not None)
+        for args in tasks:
+            self._task_queue.put((-job.priority, next(self._seq), (job, args)))
+
+    # --- потоки ---
+
+    def _planner_loop(self) -> None:
+        while True:
+            _, _, job = self._plan_queue.get()
+            if job is _STOP:
+                return
+            if job.cancel_event.is_set():
+                continue
+
+            with job.lock:
+                job.status = JOB_PLANNING
+                job.started_at = time.time()
+            try:
+                planner = _SchedulingContentDownloader(self, job, self.track_downloader.for_quality(job.quality))
+                planner.download_url(job.url)
+            except Exception as e:
+                logger.exception("Ошибка при обходе задания демона #%s", job.id)
+                with job.lock:
+                    job.error = str(e) or type(e).__name__
+                    if job.status not in _FINAL_STATES:
+                        job.status = JOB_FAILED
+                        job.finished_at = time.time()
+                continue
+
+            with job.lock:
+                job.planning_done = True
+                if job.status == JOB_PLANNING:
+                    job.status = JOB_RUNNING
+                job._maybe_finish()
+            self._release_albums(job)
+
+    def _worker_loop(self) -> None:
+        while True:
+            _, _, item = self._task_queue.get()
+            if item is _STOP:
+                return
+            job, args = item
+            if job.cancel_event.is_set():
+                continue
+
+            output_path = None
+            size = 0
+            try:
+                downloader = self.track_downloader.for_quality(job.quality)
+                # Шестой элемент задачи — необязательный AlbumContext альбома
+                output_path = job.batch.run(
+                    downloader.download_track, *args[:5], album_context=args[5] if len(args) > 5 else None,
+                )
+                # Трек может уйти в архив или S3: объём берётся из скачивания, а не с диска
+                size = downloader.last_transfer_size()
+            except Exception as e:
+                logger.warning("Ошибка при скачивании трека задания #%s: %s", job.id, e)
+
+            with job.lock:
+                if output_path:
+                    job.done += 1
+                    job.bytes += size
+                else:
+                    job.failed += 1
+                job._maybe_finish()
+            self._release_albums(job)
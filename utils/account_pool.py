@@ -0,0 +1,255 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+# Ответ API с этими кодами означает, что аккаунт упёрся в ограничение частоты запросов
+_THROTTLE_STATUS = re.compile(r"\((?:429|503)\)")
+
+# Пользователь, чьи данные запрашиваются (лайки, плейлисты, настройки)
+_USER_PATH = re.compile(r"/users/([^/?]+)(?:[/?]|$)")
+
+
+class NoHealthyAccountsError(Exception):
+    """Все аккаунты пула отозваны — запросы к API выполнять нечем"""
+
+
+class Account:
+    """Аккаунт пула: собственный клиент, темп запросов и состояние здоровья"""
+
+    __slots__ = (
+        "label", "client", "request", "min_interval", "next_slot", "cooldown_until", "throttles",
+        "auth_failures", "revoked", "in_flight", "requests", "errors", "last_error",
+    )
+
+    def __init__(self, label: str, client, request, max_rps: float = 0.0):
+        self.label = label
+        self.client = client
+        # Request именно этого аккаунта: у основного клиента он подменяется PooledRequest
+        self.request = request
+        self.min_interval = 1.0 / max_rps if max_rps > 0 else 0.0
+        self.next_slot = 0.0
+        self.cooldown_until = 0.0
+        self.throttles = 0
+        self.auth_failures = 0
+        self.revoked = False
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "account": self.label,
+            "state": "revoked" if self.revoked else ("cooldown" if self.cooldown_until > time.monotonic() else "ok"),
+            "requests": self.requests,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "last_error": self.last_error,
+        }
+
+
+class AccountPool:
+    """Пул аккаунтов Яндекс Музыки для распределения запросов к API.
+
+    Каждый запрос уходит аккаунту с наименьшим числом запросов в работе и
+    ближайшим свободным слотом по темпу (max_rps). Аккаунт, получивший 429/503,
+    выводится из ротации на cooldown_seconds (при повторах — вдвое дольше, до
+    max_cooldown_seconds); после auth_failures ошибок авторизации подряд токен
+    считается отозванным и больше не используется. Неудавшийся по этим причинам
+    запрос повторяется на другом аккаунте.
+
+    Ошибкой авторизации считается только отказ в самом токене: API отвечает
+    403 и здоровому токену, если у аккаунта нет доступа к ресурсу, поэтому
+    после UnauthorizedError токен проверяется запросом account/status.
+    Первый аккаунт пула — основной: запросы к данным его владельца
+    (call_primary) выполняются только его токеном.
+    """
+
+    def __init__(
+        self,
+        accounts: List[Account],
+        cooldown_seconds: float = 30.0,
+        max_cooldown_seconds: float = 600.0,
+        auth_failures: int = 3,
+    ):
+        self.accounts = accounts
+        self.cooldown_seconds = cooldown_seconds
+        self.max_cooldown_seconds = max_cooldown_seconds
+        self.auth_failures = max(1, auth_failures)
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def token_label(token: Optional[str]) -> str:
+        """Обозначение токена для логов: сам токен не выводится"""
+        return hashlib.sha256(str(token or "").encode("utf-8")).hexdigest()[:8]
+
+    def _acquire(self, accounts, exclude) -> Account:
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                alive = [account for account in accounts if not account.revoked]
+                if not alive:
+                    raise NoHealthyAccountsError("все подходящие токены из пула отозваны")
+                candidates = [account for account in alive if account not in exclude] or alive
+                ready = [account for account in candidates if account.cooldown_until <= now]
+                if ready:
+                    account = min(ready, key=lambda a: (a.in_flight, a.next_slot))
+                    account.in_flight += 1
+                    delay = max(0.0, account.next_slot - now)
+                    account.next_slot = max(now, account.next_slot) + account.min_interval
+                    break
+                # Все подходящие аккаунты на паузе — ждём, пока первый из них вернётся в ротацию
+                self._cond.wait(min(account.cooldown_until for account in candidates) - now)
+        if delay:
+            time.sleep(delay)
+        return account
+
+    def _release(self, account: Account) -> None:
+        with self._cond:
+            account.in_flight -= 1
+            self._cond.notify_all()
+
+    def _record_success(self, account: Account) -> None:
+        with self._cond:
+            account.requests += 1
+            account.throttles = 0
+            account.auth_failures = 0
+
+    def _record_throttle(self, account: Account, error: Exception) -> None:
+        with self._cond:
+            account.errors += 1
+            account.last_error = str(error)[:200]
+            pause = min(self.max_cooldown_seconds, self.cooldown_seconds * 2 ** account.throttles)
+            account.throttles += 1
+            account.cooldown_until = time.monotonic() + pause
+        logger.warning("Аккаунт %s упёрся в ограничение API, пауза %.0f с", account.label, pause)
+
+    def _record_error(self, account: Account, error: Exception) -> None:
+        with self._cond:
+            account.errors += 1
+            account.last_error = str(error)[:200]
+
+    @staticmethod
+    def _token_rejected(account: Account) -> bool:
+        """Отклоняет ли API сам токен: 403 на конкретный ресурс токен не отзывает"""
+        from yandex_music.exceptions import UnauthorizedError
+
+        try:
+            account.request.get(f"{account.client.base_url}/account/status")
+        except UnauthorizedError:
+            return True
+        except Exception:
+            # Проверить не удалось (сеть) — это не повод отзывать токен
+            return False
+        return False
+
+    def _record_auth_failure(self, account: Account, error: Exception) -> None:
+        with self._cond:
+            account.errors += 1
+            account.last_error = str(error)[:200]
+            account.auth_failures += 1
+            if account.auth_failures >= self.auth_failures:
+                account.revoked = True
+        if account.revoked:
+            logger.error("Токен аккаунта %s отклонён API, аккаунт выведен из ротации", account.label)
+            print(f"Токен аккаунта {account.label} больше не действителен и исключён из пула")
+
+    def call(self, method: str, *args: Any, **kwargs: Any):
+        """Выполняет метод Request (get, post, ...) через подходящий аккаунт"""
+        return self._call(self.accounts, method, args, kwargs)
+
+    def call_primary(self, method: str, *args: Any, **kwargs: Any):
+        """Выполняет метод Request токеном основного аккаунта (данные его владельца)"""
+        return self._call(self.accounts[:1], method, args, kwargs)
+
+    def _call(self, accounts: List[Account], method: str, args, kwargs):
+        from yandex_music.exceptions import NetworkError, UnauthorizedError
+
+        tried = []
+        while True:
+            account = self._acquire(accounts, tried)
+            try:
+                result = getattr(account.request, method)(*args, **kwargs)
+            except UnauthorizedError as e:
+                if not self._token_rejected(account):
+                    # Токен в порядке, нет доступа к самому ресурсу: другой аккаунт тут не поможет
+                    self._record_error(account, e)
+                    raise
+                self._record_auth_failure(account, e)
+                error = e
+            except NetworkError as e:
+                if not _THROTTLE_STATUS.search(str(e)):
+                    raise
+                self._record_throttle(account, e)
+                error = e
+            else:
+                self._record_success(account)
+                return result
+            finally:
+                self._release(account)
+
+            tried.append(account)
+            # Каждый аккаунт пробуем не больше одного раза за запрос
+            if all(other in tried or other.revoked for other in accounts):
+                raise error
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._cond:
+            return [account.stats() for account in self.accounts]
+
+
+class PooledRequest:
+    """Подменяет Request основного клиента: запросы к API распределяются по пулу.
+
+    Через клиент идут и запросы объектов, привязанных к нему (например,
+    track.get_download_info()), поэтому пул охватывает всю работу с API.
+    Запросы к данным владельца основного аккаунта (его лайки и плейлисты,
+    плейлисты lk., account/...) идут только его токеном: у другого аккаунта
+    на них нет прав, а ответ был бы не про того пользователя.
+    """
+
+    def __init__(self, pool: AccountPool, base_request, owner_ids=()):
+        self.pool = pool
+        self._base = base_request
+        # uid и логин владельца основного аккаунта
+        self.owner_ids = {str(owner_id) for owner_id in owner_ids if owner_id}
+
+    def __getattr__(self, name: str):
+        # Заголовки, язык, json_backend и прочее — от Request основного клиента
+        return getattr(self._base, name)
+
+    def _owner_only(self, args, kwargs) -> bool:
+        url = str(args[0] if args else kwargs.get("url", ""))
+        match = _USER_PATH.search(url)
+        if match:
+            return match.group(1) in self.owner_ids
+        return "/playlist/lk." in url or "/account/" in url
+
+    def _call(self, method: str, args, kwargs):
+        if self._owner_only(args, kwargs):
+            return self.pool.call_primary(method, *args, **kwargs)
+        return self.pool.call(method, *args, **kwargs)
+
+    def get(self, *args: Any, **kwargs: Any):
+        return self._call("get", args, kwargs)
+
+    def post(self, *args: Any, **kwargs: Any):
+        return self._call("post", args, kwargs)
+
+    def put(self, *args: Any, **kwargs: Any):
+        return self._call("put", args, kwargs)
+
+    def delete(self, *args: Any, **kwargs: Any):
+        return self._call("delete", args, kwargs)
+
+    def retrieve(self, *args: Any, **kwargs: Any):
+        return self._call("retrieve", args, kwargs)
+
+    def download(self, *args: Any, **kwargs: Any):
+        return self._call("download", args, kwargs)
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import re
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from yandex_music.exceptions import NetworkError, TimedOutError
+from yandex_music.utils.request import Request
+from yandex_music.utils.schema_mismatch import set_current_endpoint
+
+from utils.response_cache import ResponseCache, revalidation_forced
+from utils.shared_cache import shared_cache
+
+# Кэшируемые запросы каталога: (группа, метод, путь). Группа задаёт TTL по умолчанию
+_ENDPOINTS = (
+    ("albums", "GET", re.compile(r"/albums/\d+/with-tracks$")),
+    ("artists", "POST", re.compile(r"/artists$")),
+    ("artists", "GET", re.compile(r"/artists/\d+/direct-albums$")),
+    ("playlists", "GET", re.compile(r"/users/[^/]+/playlists/\d+$")),
+    ("playlists", "POST", re.compile(r"/users/[^/]+/playlists$")),
+    ("tracks", "POST", re.compile(r"/tracks$")),
+)
+
+
+def _parse_http_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def freshness(headers, now: float, default_ttl: float) -> Tuple[bool, float]:
+    """Можно ли сохранить ответ и до какого момента он свежий.
+
+    Учитываются Cache-Control (no-store, no-cache, max-age), Age и Expires;
+    если сервер ничего не указал, срок свежести — default_ttl секунд.
+    """
+    directives = {}
+    for part in (headers.get("Cache-Control") or "").lower().split(","):
+        name, _, value = part.strip().partition("=")
+        if name:
+            directives[name] = value.strip('"')
+
+    if "no-store" in directives:
+        return False, now
+    if "no-cache" in directives:
+        # Хранить можно, но перед каждым использованием — перепроверять
+        return True, now
+    if "max-age" in directives:
+        try:
+            age = float(headers.get("Age") or 0)
+            return True, now + max(0.0, float(directives["max-age"]) - age)
+        except ValueError:
+            pass
+    expires = _parse_http_date(headers.get("Expires"))
+    if expires is not None:
+        # Сдвигаем на разницу часов сервера и клиента
+        date = _parse_http_date(headers.get("Date"))
+        return True, now + max(0.0, expires - (date if date is not None else now))
+    return True, now + default_ttl
+
+
+class CachingRequest(Request):
+    """Request клиента Яндекс Музыки с кэшем ответов каталога.
+
+    Ответы albums_with_tracks, artists, artists_direct_albums, users_playlists
+    и tracks хранятся в ResponseCache. Свежий ответ отдаётся без запроса;
+    устаревший перепроверяется условным запросом (If-None-Match,
+    If-Modified-Since), и на 304 Not Modified используется сохранённое тело.
+    Внутри utils.response_cache.revalidate() перепроверяются и свежие ответы.
+    Остальные запросы проходят как обычно.
+    """
+
+    def __init__(self, cache: ResponseCache, ttls: Dict[str, float], *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.cache = cache
+        self.ttls = ttls
+
+    @classmethod
+    def from_config(cls, config) -> "CachingRequest":
+        cache = ResponseCache(
+            getattr(config, "API_CACHE_FILE", "cache/api.sqlite3"),
+            max(1, getattr(config, "API_CACHE_MAX_MB", 64)) * 1024 * 1024,
+            shared=shared_cache(config),
+        )
+        ttls = {
+            "albums": getattr(config, "API_CACHE_TTL_ALBUMS_MINUTES", 1440) * 60,
+            "artists": getattr(config, "API_CACHE_TTL_ARTISTS_MINUTES", 360) * 60,
+            "playlists": getattr(config, "API_CACHE_TTL_PLAYLISTS_MINUTES", 10) * 60,
+            "tracks": getattr(config, "API_CACHE_TTL_TRACKS_MINUTES", 1440) * 60,
+        }
+        return cls(cache, ttls)
+
+    @staticmethod
+    def _endpoint(method: str, url: str) -> Optional[str]:
+        path = urlsplit(url).path
+        for name, endpoint_method, pattern in _ENDPOINTS:
+            if method == endpoint_method and pattern.search(path):
+                return name
+        return None
+
+    def _cache_key(self, method: str, url: str, kwargs: Dict[str, Any]) -> str:
+        # Ответ зависит от аккаунта и языка: они тоже входят в ключ (сам токен — только хэшем)
+        headers = {**self.headers, **(kwargs.get("headers") or {})}
+        data = kwargs.get("data")
+        if isinstance(data, bytes):
+            data = data.decode("utf-8", "replace")
+        parts = [
+            method,
+            url,
+            kwargs.get("params"),
+            data,
+            hashlib.sha256(str(headers.get("Authorization", "")).encode("utf-8")).hexdigest(),
+            headers.get("Accept-Language"),
+        ]
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def _send(self, method: str, url: str, kwargs: Dict[str, Any]):
+        import requests
+
+        set_current_endpoint(method, url)
+        kwargs = self._prepare_kwargs(kwargs)
+        try:
+            return requests.request(method, url, **kwargs)  # noqa: S113
+        except requests.Timeout as e:
+            raise TimedOutError from e
+        except requests.RequestException as e:
+            raise NetworkError(e) from e
+
+    def _request_wrapper(self, *args: Any, **kwargs: Any) -> bytes:
+        endpoint = self._endpoint(*args[:2]) if len(args) == 2 else None
+        if endpoint is None:
+            return super()._request_wrapper(*args, **kwargs)
+
+        method, url = args
+        key = self._cache_key(method, url, kwargs)
+        now = time.time()
+        entry = self.cache.get(key)
+        if entry is not None and entry["expires_at"] > now and not revalidation_forced():
+            self.cache.note("hits")
+            return bytes(entry["body"])
+
+        headers = dict(kwargs.get("headers") or {})
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        kwargs["headers"] = headers
+
+        resp = self._send(method, url, kwargs)
+        ttl = self.ttls.get(endpoint, 0)
+
+        if resp.status_code == 304 and entry is not None:
+            _, expires_at = freshness(resp.headers, now, ttl)
+            self.cache.touch(key, expires_at)
+            self.cache.note("revalidated")
+            return bytes(entry["body"])
+
+        if not 200 <= resp.status_code < 300:
+            self._handle_error_response(resp.status_code, resp.content)
+
+        self.cache.note("misses")
+        store, expires_at = freshness(resp.headers, now, ttl)
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
+        if store and (expires_at > now or etag or last_modified):
+            self.cache.put(key, endpoint, resp.content, expires_at, etag=etag, last_modified=last_modified)
+        elif entry is not None:
+            self.cache.remove(key)
+        return resp.content
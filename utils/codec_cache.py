@@ -0,0 +1,150 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+def account_fingerprint(client) -> Optional[str]:
+    """Отпечаток подписки аккаунта: при его смене кэш кодеков сбрасывается."""
+    me = getattr(client, "me", None)
+    if me is None:
+        return None
+
+    account = getattr(me, "account", None)
+    plus = getattr(me, "plus", None)
+    permissions = getattr(me, "permissions", None)
+    fingerprint = {
+        "uid": getattr(account, "uid", None),
+        "has_plus": getattr(plus, "has_plus", None),
+        "permissions": sorted(getattr(permissions, "values", None) or []),
+    }
+    return json.dumps(fingerprint, sort_keys=True)
+
+
+class CodecCache:
+    """Файловый кэш доступности кодеков для треков.
+
+    Запоминает исход запроса get-file-info: есть ли у трека lossless и какой
+    кодек пришёл вместо него. Треки, для которых lossless заведомо недоступен,
+    сразу скачиваются в лучшем доступном кодеке без лишнего подписанного
+    запроса. Кэш целиком сбрасывается при смене подписки аккаунта.
+
+    Новые записи копятся в памяти и сбрасываются на диск не чаще раза в
+    SAVE_INTERVAL секунд и при выходе, а не переписывают файл на каждый трек.
+
+    С shared (utils.shared_cache.SharedCache) записи делятся между узлами;
+    ключи в общем кэше разделены по подписке, поэтому узлы с разными
+    подписками друг другу не мешают.
+    """
+
+    # Как часто сбрасывать кэш на диск
+    SAVE_INTERVAL = 10.0
+
+    def __init__(self, cache_file: str = "cache/codecs.json", ttl_hours: int = 168, shared=None):
+        self.cache_file = cache_file
+        self.ttl_seconds = ttl_hours * 3600 if ttl_hours else 0
+        self.shared = shared
+        self._account: Optional[str] = None
+        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self._ensure_dir()
+        self._load()
+        atexit.register(self.flush)
+
+    def _ensure_dir(self) -> None:
+        cache_dir = os.path.dirname(self.cache_file)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _load(self) -> None:
+        try:
+            if os.path.exists(self.cache_file):
+                with open(self.cache_file, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                    if isinstance(data, dict) and isinstance(data.get("entries"), dict):
+                        self._account = data.get("account")
+                        self._cache = data["entries"]
+        except Exception:
+            # Если файл повреждён — просто начинаем с пустого кэша
+            self._cache = {}
+
+    def _save_unlocked(self) -> None:
+        try:
+            with open(self.cache_file, "w", encoding="utf-8") as f:
+                json.dump({"account": self._account, "entries": self._cache}, f, ensure_ascii=False)
+            self._dirty = False
+            self._saved_at = time.monotonic()
+        except Exception:
+            # Кэш — вспомогательный, при ошибке записи просто пропускаем
+            pass
+
+    def _touch_unlocked(self) -> None:
+        self._dirty = True
+        if time.monotonic() - self._saved_at >= self.SAVE_INTERVAL:
+            self._save_unlocked()
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._dirty:
+                self._save_unlocked()
+
+    def bind_account(self, fingerprint: Optional[str]) -> None:
+        """Привязывает кэш к подписке аккаунта; при смене подписки сбрасывает все записи."""
+        if fingerprint is None:
+            return
+        with self._lock:
+            if self._account == fingerprint:
+                return
+            if self._cache:
+                self._cache = {}
+            self._account = fingerprint
+            self._save_unlocked()
+
+    def _shared_namespace(self) -> Optional[str]:
+        """Пространство ключей подписки в общем кэше (None — подписка неизвестна, общий кэш не используется)"""
+        if self.shared is None or self._account is None:
+            return None
+        return "codecs:" + hashlib.sha256(self._account.encode("utf-8")).hexdigest()[:16]
+
+    def _expired(self, entry: Dict[str, Any]) -> bool:
+        return bool(self.ttl_seconds) and (time.time() - entry.get("ts", 0)) > self.ttl_seconds
+
+    def get(self, track_id: Any) -> Optional[Dict[str, Any]]:
+        key = str(track_id)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and self._expired(entry):
+                self._cache.pop(key, None)
+                entry = None
+            if entry:
+                return dict(entry)
+            namespace = self._shared_namespace()
+
+        if namespace is None:
+            return None
+        entry = self.shared.get_json(namespace, key)
+        if not isinstance(entry, dict) or self._expired(entry):
+            return None
+        with self._lock:
+            self._cache[key] = entry
+            self._touch_unlocked()
+        return dict(entry)
+
+    def set(self, track_id: Any, lossless: bool, codec: Optional[str] = None, reason: Optional[str] = None) -> None:
+        key = str(track_id)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and entry.get("lossless") == lossless and entry.get("codec") == codec:
+                # Исход не изменился — файл не переписываем
+                return
+            entry = {"lossless": lossless, "codec": codec, "reason": reason, "ts": time.time()}
+            self._cache[key] = entry
+            self._touch_unlocked()
+            namespace = self._shared_namespace()
+        if namespace is not None:
+            self.shared.set_json(namespace, key, entry, self.ttl_seconds)
@@ -13,7 +13,7 @@ def detect_audio_format(file_path):
 
     if header[:3] == b'ID3' or (len(header) > 2 and header[0] == 0xFF and (header[1] & 0xE0) == 0xE0):
         return '.mp3'
-    if len(header) > 12 and header[4:8] == b'ftyp':
+    if len(header) >= 12 and header[4:8] == b'ftyp':
         return '.m4a'
     if header[:4] == b'fLaC':
         return '.flac'
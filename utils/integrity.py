@@ -0,0 +1,87 @@
+import logging
+import shutil
+import subprocess
+import threading
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+
+# Сколько первых байт файла нужно для проверки заголовка
+HEADER_SIZE = 64
+
+
+class IntegrityError(IOError):
+    """Скачанный файл не прошёл проверку целостности"""
+
+
+def _mp3_frame_sync(head: bytes) -> bool:
+    return len(head) > 1 and head[0] == 0xFF and (head[1] & 0xE0) == 0xE0
+
+
+def validate_header(head: bytes, file_ext: str) -> None:
+    """Проверяет, что начало файла соответствует формату; иначе IntegrityError"""
+    if file_ext == ".flac":
+        if head[:4] != b"fLaC":
+            raise IntegrityError("нет сигнатуры fLaC")
+        # Первый блок метаданных — STREAMINFO (тип 0) длиной 34 байта
+        if len(head) < 42 or head[4] & 0x7F != 0 or int.from_bytes(head[5:8], "big") != 34:
+            raise IntegrityError("повреждён блок STREAMINFO")
+    elif file_ext == ".m4a":
+        if head[4:8] != b"ftyp":
+            raise IntegrityError("нет атома ftyp")
+    elif file_ext == ".ogg":
+        if head[:4] != b"OggS":
+            raise IntegrityError("нет сигнатуры OggS")
+    elif file_ext == ".mp3":
+        if head[:3] == b"ID3":
+            # Размер тега ID3 — syncsafe-целое: старший бит каждого байта равен нулю
+            if len(head) < 10 or any(byte & 0x80 for byte in head[6:10]):
+                raise IntegrityError("повреждён заголовок ID3")
+        elif not _mp3_frame_sync(head):
+            raise IntegrityError("нет заголовка ID3 или MPEG-кадра")
+
+
+def streaminfo_md5(head: bytes) -> Optional[bytes]:
+    """MD5 декодированного звука из STREAMINFO (None, если кодер его не записал)"""
+    if len(head) < 42 or head[:4] != b"fLaC":
+        return None
+    md5 = head[26:42]
+    return md5 if any(md5) else None
+
+
+class FlacVerifier:
+    """Полная проверка FLAC: декодирование и сверка с MD5 из STREAMINFO.
+
+    Декодирует утилита flac (flac --test) в отдельных процессах; одновременно
+    работает не больше processes проверок. Если утилита не установлена,
+    проверка пропускается с предупреждением в логе.
+    """
+
+    def __init__(self, processes: int = 2, timeout: float = 300.0):
+        self.executable = shutil.which("flac")
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(1, processes))
+        if self.executable is None:
+            logger.warning("Утилита flac не найдена, полная проверка FLAC отключена")
+
+    @property
+    def available(self) -> bool:
+        return self.executable is not None
+
+    def verify(self, file_path: str) -> None:
+        if self.executable is None:
+            return
+        with self._slots:
+            try:
+                result = subprocess.run(
+                    [self.executable, "--test", "--silent", file_path],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.PIPE,
+                    timeout=self.timeout,
+                )
+            except subprocess.TimeoutExpired:
+                raise IntegrityError("проверка FLAC не уложилась в отведённое время")
+        if result.returncode != 0:
+            message = result.stderr.decode("utf-8", "replace").strip().splitlines()
+            raise IntegrityError(f"FLAC не прошёл проверку MD5: {message[-1] if message else result.returncode}")
@@ -0,0 +1,328 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+
+# Состояния задачи (трека) в журнале
+TASK_PENDING = "pending"
+TASK_IN_FLIGHT = "in_flight"
+TASK_DONE = "done"
+TASK_FAILED = "failed"
+
+# Состояния задания целиком
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# Режимы задания: local — качает создавший его процесс,
+# queue — треки разбирают процессы-воркеры (python main.py --worker)
+JOB_MODE_LOCAL = "local"
+JOB_MODE_QUEUE = "queue"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL,
+    status TEXT NOT NULL,
+    mode TEXT NOT NULL DEFAULT 'local',
+    enumerating INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    job_id INTEGER NOT NULL REFERENCES jobs(id),
+    task_key TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    track_id TEXT NOT NULL,
+    album_id TEXT,
+    output_dir TEXT NOT NULL,
+    album_name TEXT,
+    total_tracks INTEGER,
+    total_discs INTEGER,
+    file_name TEXT,
+    state TEXT NOT NULL,
+    reason TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (job_id, task_key)
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks(job_id, state);
+"""
+
+# Колонки, добавленные после первой версии схемы: (таблица, колонка, определение)
+_MIGRATIONS = (
+    ("jobs", "mode", "TEXT NOT NULL DEFAULT 'local'"),
+    ("tasks", "lease_owner", "TEXT"),
+    ("tasks", "lease_expires", "REAL"),
+    ("tasks", "file_name", "TEXT"),
+    ("jobs", "enumerating", "INTEGER NOT NULL DEFAULT 0"),
+)
+
+
+def make_task_key(track_id: Any, output_dir: str) -> str:
+    """Ключ задачи внутри задания: один и тот же трек может попасть в разные папки."""
+    return f"{track_id}|{output_dir}"
+
+
+def task_track_ref(record: Dict[str, Any]) -> str:
+    """Идентификатор трека для client.tracks() в формате track_id:album_id."""
+    if record.get("album_id"):
+        return f"{record['track_id']}:{record['album_id']}"
+    return str(record["track_id"])
+
+
+class JobJournal:
+    """Персистентный журнал заданий на SQLite.
+
+    Для каждого задания (ссылки) хранит все запланированные треки и их
+    состояние: pending, in_flight, done или failed с причиной. После падения
+    процесса задание можно продолжить — повторно скачиваются только
+    незавершённые треки.
+
+    Задания в режиме queue работают как общая очередь для нескольких
+    процессов (в том числе на разных машинах с общим томом): воркер
+    захватывает трек с арендой (lease) и продлевает её, пока качает.
+    Если воркер упал, аренда истекает и трек снова становится доступен.
+    """
+
+    def __init__(self, db_file: str = "cache/jobs.sqlite3"):
+        self.db_file = db_file
+        db_dir = os.path.dirname(db_file)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.executescript(_SCHEMA)
+            self._migrate()
+
+    def _migrate(self) -> None:
+        for table, column, definition in _MIGRATIONS:
+            columns = {row["name"] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _execute(self, sql: str, params: Iterable[Any] = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._conn.execute(sql, tuple(params))
+
+    # --- задания ---
+
+    def start_job(self, url: str, mode: str = JOB_MODE_LOCAL) -> Dict[str, Any]:
+        """Возвращает незавершённое задание для url или создаёт новое.
+
+        Незавершённым считается прерванное задание или задание с ошибками.
+        В возвращаемом словаре поле resumed = True, если задание продолжается.
+        """
+        row = self._execute(
+            "SELECT * FROM jobs WHERE url = ? AND mode = ? AND status != ? ORDER BY id DESC LIMIT 1",
+            (url, mode, JOB_DONE),
+        ).fetchone()
+        if row:
+            self.reopen_job(row["id"])
+            job = self.get_job(row["id"])
+            job["resumed"] = True
+            return job
+
+        now = time.time()
+        cursor = self._execute(
+            "INSERT INTO jobs (url, status, mode, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (url, JOB_RUNNING, mode, now, now),
+        )
+        job = self.get_job(cursor.lastrowid)
+        job["resumed"] = False
+        return job
+
+    def get_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        row = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def reopen_job(self, job_id: int) -> None:
+        self._execute(
+            "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?",
+            (JOB_RUNNING, time.time(), job_id),
+        )
+
+    def finish_job(self, job_id: int) -> str:
+        """Закрывает задание: done, если все треки скачаны, иначе failed."""
+        counts = self.task_counts(job_id)
+        status = JOB_DONE if counts.get(TASK_DONE, 0) == sum(counts.values()) else JOB_FAILED
+        self._execute(
+            "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?",
+            (status, time.time(), job_id),
+        )
+        return status
+
+    def set_enumerating(self, job_id: int, enumerating: bool) -> None:
+        """Отмечает, что координатор ещё обходит каталог и добавляет в задание треки."""
+        self._execute(
+            "UPDATE jobs SET enumerating = ?, updated_at = ? WHERE id = ?",
+            (1 if enumerating else 0, time.time(), job_id),
+        )
+
+    def finish_job_if_complete(self, job_id: int) -> Optional[str]:
+        """Закрывает задание, если в нём не осталось ожидающих и выполняемых треков.
+
+        Задание, каталог которого ещё обходится (set_enumerating), не закрывается:
+        в него ещё будут добавлены треки.
+        """
+        job = self.get_job(job_id)
+        if job is None or job.get("enumerating"):
+            return None
+        counts = self.task_counts(job_id)
+        if counts.get(TASK_PENDING, 0) or counts.get(TASK_IN_FLIGHT, 0):
+            return None
+        return self.finish_job(job_id)
+
+    def list_jobs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        rows = self._execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        jobs = []
+        for row in rows:
+            job = dict(row)
+            job["counts"] = self.task_counts(job["id"])
+            jobs.append(job)
+        return jobs
+
+    # --- задачи ---
+
+    def add_tasks(self, job_id: int, records: List[Dict[str, Any]]) -> None:
+        """Регистрирует запланированные треки. Уже известные задачи не трогаются,
+        только получают имя файла (file_name), если его ещё не было."""
+        now = time.time()
+        with self._lock:
+            next_seq = self._conn.execute(
+                "SELECT COALESCE(MAX(seq), -1) + 1 FROM tasks WHERE job_id = ?", (job_id,)
+            ).fetchone()[0]
+            self._conn.execute("BEGIN")
+            try:
+                for offset, record in enumerate(records):
+                    task_key = make_task_key(record["track_id"], record["output_dir"])
+                    self._conn.execute(
+                        "INSERT OR IGNORE INTO tasks (job_id, task_key, seq, track_id, album_id, output_dir, "
+                        "album_name, total_tracks, total_discs, file_name, state, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            job_id,
+                            task_key,
+                            next_seq + offset,
+                            str(record["track_id"]),
+                            record.get("album_id"),
+                            record["output_dir"],
+                            record.get("album_name"),
+                            record.get("total_tracks"),
+                            record.get("total_discs"),
+                            record.get("file_name"),
+                            TASK_PENDING,
+                            now,
+                        ),
+                    )
+                    if record.get("file_name"):
+                        # Задание из журнала без имён файлов: имя запоминается при продолжении
+                        self._conn.execute(
+                            "UPDATE tasks SET file_name = ? WHERE job_id = ? AND task_key = ? AND file_name IS NULL",
+                            (record["file_name"], job_id, task_key),
+                        )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def task_states(self, job_id: int) -> Dict[str, str]:
+        rows = self._execute("SELECT task_key, state FROM tasks WHERE job_id = ?", (job_id,)).fetchall()
+        return {row["task_key"]: row["state"] for row in rows}
+
+    def task_counts(self, job_id: int) -> Dict[str, int]:
+        rows = self._execute(
+            "SELECT state, COUNT(*) AS cnt FROM tasks WHERE job_id = ? GROUP BY state", (job_id,)
+        ).fetchall()
+        return {row["state"]: row["cnt"] for row in rows}
+
+    def mark(self, job_id: int, task_key: str, state: str, reason: Optional[str] = None) -> None:
+        attempts_inc = 1 if state == TASK_IN_FLIGHT else 0
+        self._execute(
+            "UPDATE tasks SET state = ?, reason = ?, attempts = attempts + ?, updated_at = ? "
+            "WHERE job_id = ? AND task_key = ?",
+            (state, reason, attempts_inc, time.time(), job_id, task_key),
+        )
+
+    def tasks(self, job_id: int, states: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        sql = "SELECT * FROM tasks WHERE job_id = ?"
+        params: List[Any] = [job_id]
+        if states:
+            states = list(states)
+            sql += f" AND state IN ({', '.join('?' for _ in states)})"
+            params.extend(states)
+        rows = self._execute(sql + " ORDER BY seq", params).fetchall()
+        return [dict(row) for row in rows]
+
+    def reset_tasks(self, job_id: int, states: Iterable[str]) -> int:
+        """Возвращает задачи в указанных состояниях в pending. Возвращает их количество."""
+        states = list(states)
+        cursor = self._execute(
+            f"UPDATE tasks SET state = ?, reason = NULL, lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+            f"WHERE job_id = ? AND state IN ({', '.join('?' for _ in states)})",
+            [TASK_PENDING, time.time(), job_id, *states],
+        )
+        return cursor.rowcount
+
+    # --- общая очередь с арендой ---
+
+    def claim_task(self, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """Атомарно захватывает следующий трек из заданий в режиме queue.
+
+        Берётся ожидающий трек или трек, аренда которого истекла
+        (его воркер, скорее всего, упал).
+        """
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE сразу берёт блокировку на запись: два процесса не захватят один трек
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT t.* FROM tasks t JOIN jobs j ON j.id = t.job_id "
+                    "WHERE j.mode = ? AND j.status = ? AND ("
+                    "  t.state = ? OR (t.state = ? AND t.lease_expires IS NOT NULL AND t.lease_expires < ?)"
+                    ") ORDER BY t.job_id, t.seq LIMIT 1",
+                    (JOB_MODE_QUEUE, JOB_RUNNING, TASK_PENDING, TASK_IN_FLIGHT, now),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE tasks SET state = ?, lease_owner = ?, lease_expires = ?, "
+                    "attempts = attempts + 1, updated_at = ? WHERE job_id = ? AND task_key = ?",
+                    (TASK_IN_FLIGHT, worker_id, now + lease_seconds, now, row["job_id"], row["task_key"]),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return dict(row)
+
+    def renew_lease(self, job_id: int, task_key: str, worker_id: str, lease_seconds: float) -> bool:
+        """Продлевает аренду. False — аренда уже потеряна (трек отдан другому воркеру)."""
+        cursor = self._execute(
+            "UPDATE tasks SET lease_expires = ? WHERE job_id = ? AND task_key = ? AND lease_owner = ? AND state = ?",
+            (time.time() + lease_seconds, job_id, task_key, worker_id, TASK_IN_FLIGHT),
+        )
+        return cursor.rowcount > 0
+
+    def complete_task(
+        self, job_id: int, task_key: str, worker_id: str, state: str, reason: Optional[str] = None
+    ) -> bool:
+        """Записывает результат захваченного трека, если аренда всё ещё принадлежит воркеру."""
+        cursor = self._execute(
+            "UPDATE tasks SET state = ?, reason = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+            "WHERE job_id = ? AND task_key = ? AND lease_owner = ?",
+            (state, reason, time.time(), job_id, task_key, worker_id),
+        )
+        return cursor.rowcount > 0
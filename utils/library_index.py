@@ -0,0 +1,118 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    track_id TEXT NOT NULL,
+    album_id TEXT,
+    codec TEXT,
+    bitrate INTEGER,
+    quality TEXT,
+    size INTEGER NOT NULL,
+    stream_size INTEGER,
+    stream_sha256 TEXT,
+    remuxed_from TEXT,
+    saved_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_track ON files(track_id);
+"""
+
+# Колонки, добавленные после первой версии схемы: (колонка, определение)
+_MIGRATIONS = (
+    ("remuxed_from", "TEXT"),
+)
+
+
+class LibraryIndex:
+    """Индекс скачанной библиотеки на SQLite.
+
+    Для каждого сохранённого файла хранит трек, кодек, размер и контрольную
+    сумму аудиопотока (SHA-256 скачанных и расшифрованных данных до записи
+    тегов), посчитанную на лету во время скачивания.
+
+    codec — кодек сохранённого файла. Если файл перепакован постобработкой
+    (FLAC из MP4 → FLAC), remuxed_from хранит исходный кодек, а stream_size
+    и stream_sha256 относятся к скачанному исходному потоку, а не к файлу.
+
+    Файлы на диске хранятся по абсолютному пути. Треки, сохранённые не на
+    диск (член архива «архив.tar:путь», s3://-адрес), — с local=False, под
+    адресом как есть.
+    """
+
+    def __init__(self, db_file: str = "cache/library.sqlite3"):
+        self.db_file = db_file
+        db_dir = os.path.dirname(db_file)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.executescript(_SCHEMA)
+            self._migrate()
+
+    def _migrate(self) -> None:
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(files)")}
+        for column, definition in _MIGRATIONS:
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE files ADD COLUMN {column} {definition}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _execute(self, sql: str, params: Iterable[Any] = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._conn.execute(sql, tuple(params))
+
+    @staticmethod
+    def _location(path: str, local: bool) -> str:
+        return os.path.abspath(path) if local else path
+
+    def record(
+        self,
+        path: str,
+        track_id: Any,
+        size: int,
+        album_id: Any = None,
+        codec: Optional[str] = None,
+        bitrate: Optional[int] = None,
+        quality: Optional[str] = None,
+        stream_size: Optional[int] = None,
+        stream_sha256: Optional[str] = None,
+        local: bool = True,
+        remuxed_from: Optional[str] = None,
+    ) -> None:
+        self._execute(
+            "INSERT OR REPLACE INTO files (path, track_id, album_id, codec, bitrate, quality, size, "
+            "stream_size, stream_sha256, remuxed_from, saved_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                self._location(path, local),
+                str(track_id),
+                str(album_id) if album_id is not None else None,
+                codec,
+                bitrate,
+                quality,
+                size,
+                stream_size,
+                stream_sha256,
+                remuxed_from,
+                time.time(),
+            ),
+        )
+
+    def get(self, path: str, local: bool = True) -> Optional[Dict[str, Any]]:
+        row = self._execute("SELECT * FROM files WHERE path = ?", (self._location(path, local),)).fetchone()
+        return dict(row) if row else None
+
+    def find_track(self, track_id: Any) -> List[Dict[str, Any]]:
+        rows = self._execute("SELECT * FROM files WHERE track_id = ? ORDER BY saved_at", (str(track_id),))
+        return [dict(row) for row in rows]
+
+    def remove(self, path: str, local: bool = True) -> None:
+        self._execute("DELETE FROM files WHERE path = ?", (self._location(path, local),))
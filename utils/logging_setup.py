@@ -1,9 +1,76 @@
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
 import os
+import queue
+from typing import Optional
+
+
+# Структурированные поля, которые можно передать через extra={...}
+STRUCTURED_FIELDS = ("track_id", "stage", "duration", "bytes")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Кладёт в очередь копию записи с уже подставленными аргументами.
+
+    Стек исключения сохраняется в exc_text, чтобы итоговый форматтер
+    (текстовый или JSON) вывел его сам, а не внутри сообщения.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Форматирует записи лога в JSON Lines (одна запись — одна строка)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def stop_logging() -> None:
+    """Останавливает фоновый поток записи логов, дописывая очередь до конца."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
 
 
 def setup_logging(config) -> None:
-    """Настраивает логирование в файл по настройкам из config."""
+    """Настраивает логирование в файл по настройкам из config.
+
+    Потоки загрузки только кладут записи в очередь, а запись на диск
+    (с ротацией по размеру) выполняет отдельный фоновый поток.
+    """
+    global _listener
+    stop_logging()
+
     # Полностью отключаем логирование, если выключено в конфиге
     if not getattr(config, "LOGGING_ENABLED", False):
         logging.disable(logging.CRITICAL)
@@ -14,17 +81,42 @@ def setup_logging(config) -> None:
     log_file = getattr(config, "LOG_FILE", "app.log")
     log_level_name = getattr(config, "LOG_LEVEL", "INFO")
     log_level = getattr(logging, log_level_name.upper(), logging.INFO)
+    log_format = str(getattr(config, "LOG_FORMAT", "text")).lower()
+    max_bytes = max(0, getattr(config, "LOG_MAX_BYTES", 10 * 1024 * 1024))
+    backup_count = max(0, getattr(config, "LOG_BACKUP_COUNT", 5))
 
     log_dir = os.path.dirname(log_file)
     if log_dir:
         os.makedirs(log_dir, exist_ok=True)
 
+    # Ротация по размеру: при max_bytes = 0 файл растёт без ограничений
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file,
+        maxBytes=max_bytes,
+        backupCount=backup_count,
+        encoding="utf-8",
+    )
+    if log_format == "json":
+        file_handler.setFormatter(JsonLinesFormatter())
+    else:
+        file_handler.setFormatter(
+            logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+        )
+
+    # Неограниченная очередь: вызов логгера никогда не блокирует поток загрузки
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+
     logging.basicConfig(
         level=log_level,
-        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-        handlers=[logging.FileHandler(log_file, encoding="utf-8")],
+        handlers=[_QueueHandler(log_queue)],
         force=True,  # гарантируем отсутствие вывода в консоль
     )
 
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=False)
+    _listener.start()
+
     # Урезаем шум от внешних библиотек
     logging.getLogger("yandex_music").setLevel(logging.WARNING)
+
+
+atexit.register(stop_logging)
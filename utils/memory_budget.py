@@ -0,0 +1,130 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from utils.progress import format_bytes
+
+
+_process_budget: Optional["MemoryBudget"] = None
+_process_budget_lock = threading.Lock()
+
+
+def process_budget(config) -> "MemoryBudget":
+    """Общий на процесс бюджет памяти (создаётся при первом обращении)"""
+    global _process_budget
+    with _process_budget_lock:
+        if _process_budget is None:
+            _process_budget = MemoryBudget(max(1, getattr(config, "MEMORY_BUDGET_MB", 256)) * 1024 * 1024)
+        return _process_budget
+
+
+def peak_rss() -> Optional[int]:
+    """Пиковый размер резидентной памяти процесса в байтах (None, если не поддерживается ОС)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    import sys
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MemoryBudget:
+    """Бюджет памяти под буферы скачивания, общий для всех потоков процесса.
+
+    Перед началом скачивания поток резервирует оценку своих буферов
+    (reserve). Если резерв не помещается в лимит, поток ждёт, пока другие
+    освободят память — так число одновременно держащих буферы загрузок
+    ограничивается памятью, а не только MAX_CONCURRENT_DOWNLOADS. Ждать
+    имеет смысл, только пока есть чужие резервы: если их нет, резерв
+    пропускается, даже когда он не помещается в лимит.
+
+    Пик занятой памяти (high_water) показывает, сколько памяти реально
+    нужно под буферы при текущих настройках.
+    """
+
+    def __init__(self, limit_bytes: int):
+        self.limit = limit_bytes
+        self._in_use = 0
+        self._reservations = 0
+        self._high_water = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+        self._cond = threading.Condition()
+
+    def _take_unlocked(self, nbytes: int) -> None:
+        self._in_use += nbytes
+        self._high_water = max(self._high_water, self._in_use)
+
+    def _must_wait_unlocked(self, nbytes: int) -> bool:
+        return self._reservations > 0 and self._in_use + nbytes > self.limit
+
+    def acquire(self, nbytes: int) -> None:
+        """Резервирует nbytes, при нехватке бюджета ждёт освобождения"""
+        with self._cond:
+            if self._must_wait_unlocked(nbytes):
+                started_at = time.monotonic()
+                self._waits += 1
+                while self._must_wait_unlocked(nbytes):
+                    self._cond.wait()
+                self._wait_seconds += time.monotonic() - started_at
+            self._reservations += 1
+            self._take_unlocked(nbytes)
+
+    def try_acquire(self, nbytes: int) -> bool:
+        """Резервирует nbytes, только если они помещаются в бюджет прямо сейчас"""
+        with self._cond:
+            if self._in_use + nbytes > self.limit:
+                return False
+            self._reservations += 1
+            self._take_unlocked(nbytes)
+            return True
+
+    def charge(self, nbytes: int) -> None:
+        """Учитывает уже занятую память без ожидания (например, кэш обложек); снимается через uncharge"""
+        with self._cond:
+            self._take_unlocked(nbytes)
+
+    def uncharge(self, nbytes: int) -> None:
+        with self._cond:
+            self._in_use = max(0, self._in_use - nbytes)
+            self._cond.notify_all()
+
+    def release(self, nbytes: int) -> None:
+        """Освобождает резерв, полученный через acquire или try_acquire"""
+        with self._cond:
+            self._in_use = max(0, self._in_use - nbytes)
+            self._reservations = max(0, self._reservations - 1)
+            self._cond.notify_all()
+
+    @contextmanager
+    def reserve(self, nbytes: int):
+        self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "in_use": self._in_use,
+                "high_water": self._high_water,
+                "waits": self._waits,
+                "wait_seconds": round(self._wait_seconds, 3),
+                "peak_rss": peak_rss(),
+            }
+
+    def report(self) -> str:
+        stats = self.stats()
+        line = (
+            f"Память под буферы: пик {format_bytes(stats['high_water'])} "
+            f"из {format_bytes(stats['limit'])}, ожиданий бюджета {stats['waits']}"
+        )
+        if stats["peak_rss"]:
+            line += f", пик памяти процесса {format_bytes(stats['peak_rss'])}"
+        return line
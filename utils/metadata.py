@@ -1,4 +1,124 @@
-from typing import Optional
+import threading
+from typing import Callable, Hashable, Optional
+
+
+def _genre_name(genre) -> Optional[str]:
+    if isinstance(genre, str):
+        return genre or None
+    return getattr(genre, 'name', None) or None
+
+
+def _artist_names(artists) -> Optional[str]:
+    names = ', '.join(a.name for a in artists if getattr(a, 'name', None))
+    return names or None
+
+
+class AlbumContext:
+    """Общие для всех треков альбома данные для тегов.
+
+    Строится один раз на альбом (download_album, download_artist): название,
+    исполнитель альбома, год, жанр, число дисков и обложка. Для каждого трека
+    остаётся вычислить только его собственные поля. Готовые кадры тегов и
+    кадр обложки каждого формата собираются при первом треке и переиспользуются
+    остальными (shared). total_tracks — число треков во всех дисках (по нему
+    постобработка понимает, что альбом скачан целиком).
+    """
+
+    __slots__ = ('album_id', 'album', 'album_artist', 'year', 'genre', 'total_discs', 'cover_uri', 'total_tracks',
+                 '_cover', '_cover_loaded', '_shared', '_lock')
+
+    def __init__(self, album_id=None, album=None, album_artist=None, year=None, genre=None,
+                 total_discs=None, cover_uri=None, total_tracks=None):
+        self.album_id = album_id
+        self.album = album
+        self.album_artist = album_artist
+        self.year = year
+        self.genre = genre
+        self.total_discs = total_discs
+        self.cover_uri = cover_uri
+        self.total_tracks = total_tracks
+        self._cover = None
+        self._cover_loaded = False
+        self._shared = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_album(cls, album, album_name: Optional[str] = None, total_discs: Optional[int] = None) -> "AlbumContext":
+        """Контекст по объекту альбома из albums_with_tracks"""
+        artists = getattr(album, 'artists', None)
+        year = getattr(album, 'year', None)
+        genre = getattr(album, 'genre', None)
+        volumes = getattr(album, 'volumes', None)
+        return cls(
+            album_id=getattr(album, 'id', None),
+            album=album_name or getattr(album, 'title', None),
+            album_artist=_artist_names(artists) if artists else None,
+            year=str(year) if year else None,
+            genre=_genre_name(genre) if genre else None,
+            total_discs=str(total_discs) if total_discs is not None else None,
+            cover_uri=getattr(album, 'cover_uri', None),
+            total_tracks=sum(len(volume) for volume in volumes) if volumes else None,
+        )
+
+    def cover(self, load: Callable[[str], Optional[bytes]], cover_uri: Optional[str] = None) -> Optional[bytes]:
+        """Обложка альбома: скачивается через load один раз на весь альбом"""
+        with self._lock:
+            if not self._cover_loaded:
+                uri = self.cover_uri or cover_uri
+                self._cover = load(uri) if uri else None
+                self._cover_loaded = True
+            return self._cover
+
+    def shared(self, key: Hashable, build: Callable[[], object]):
+        """Значение, общее для всех треков альбома (готовые кадры тегов и т.п.)"""
+        with self._lock:
+            if key not in self._shared:
+                self._shared[key] = build()
+            return self._shared[key]
+
+    def common_metadata(self) -> dict:
+        metadata = {}
+        for field in ('album', 'album_artist', 'year', 'genre', 'total_discs'):
+            value = getattr(self, field)
+            if value:
+                metadata[field] = value
+        return metadata
+
+
+def _track_metadata(track, album_context: AlbumContext, total_tracks: Optional[int]) -> dict:
+    """Метаданные трека альбома: общие поля берутся из контекста, вычисляются только собственные"""
+    metadata = album_context.common_metadata()
+
+    if track.title:
+        metadata['title'] = track.title
+    if track.artists:
+        artist = _artist_names(track.artists)
+        if artist:
+            metadata['artist'] = artist
+
+    position = track.albums[0].track_position if track.albums else None
+    position = position or getattr(track, 'track_position', None)
+    if position is not None:
+        if position.index:
+            metadata['track_number'] = str(position.index)
+        if position.volume:
+            metadata['disc_number'] = str(position.volume)
+
+    # Год и жанр трека — если их нет у альбома
+    if 'year' not in metadata and getattr(track, 'year', None):
+        metadata['year'] = str(track.year)
+    if 'genre' not in metadata and getattr(track, 'genre', None):
+        genre = _genre_name(track.genre)
+        if genre:
+            metadata['genre'] = genre
+
+    if total_tracks is not None:
+        metadata['total_tracks'] = str(total_tracks)
+    if track.version:
+        metadata['version'] = track.version
+    if track.duration_ms:
+        metadata['duration'] = str(int(track.duration_ms / 1000))
+    return metadata
 
 
 def extract_metadata(
@@ -7,8 +127,20 @@ def extract_metadata(
     total_tracks: Optional[int] = None,
     total_discs: Optional[int] = None,
     metadata_cache=None,
+    album_context: Optional[AlbumContext] = None,
 ):
-    """Извлекает все доступные метаданные из объекта track с кэшированием"""
+    """Извлекает все доступные метаданные из объекта track с кэшированием.
+
+    С album_context общие поля альбома берутся из него, а кэш не нужен:
+    собственных полей трека немного и они вычисляются сразу.
+    """
+    if album_context is not None:
+        try:
+            return _track_metadata(track, album_context, total_tracks)
+        except Exception:
+            # Нестандартный объект трека — разбираем его полностью, как без контекста
+            pass
+
     metadata = {}
     cache_key = None
 
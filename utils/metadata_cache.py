@@ -6,11 +6,19 @@ from typing import Any, Dict, Optional
 
 
 class MetadataCache:
-    """Простой файловый кэш для метаданных треков."""
+    """Простой файловый кэш для метаданных треков.
 
-    def __init__(self, cache_file: str = "cache/metadata.json", ttl_hours: int = 24):
+    С shared (utils.shared_cache.SharedCache) промах локального кэша
+    проверяется в общем кэше узлов, а новые записи отправляются и туда.
+    """
+
+    # Пространство ключей в общем кэше
+    SHARED_NAMESPACE = "metadata"
+
+    def __init__(self, cache_file: str = "cache/metadata.json", ttl_hours: int = 24, shared=None):
         self.cache_file = cache_file
         self.ttl_seconds = ttl_hours * 3600 if ttl_hours else 0
+        self.shared = shared
         self._cache: Dict[str, Dict[str, Any]] = {}
         self._lock = threading.Lock()
         self._ensure_dir()
@@ -70,20 +78,30 @@ class MetadataCache:
     def get(self, key: str) -> Optional[Dict[str, Any]]:
         with self._lock:
             entry = self._cache.get(key)
-            if not entry:
-                return None
-
-            ts = entry.get("ts", 0)
-            if self._is_expired(ts):
+            if entry and self._is_expired(entry.get("ts", 0)):
                 # Удаляем протухшие данные
                 self._cache.pop(key, None)
                 self._save_unlocked()
+                entry = None
+
+        if not entry and self.shared is not None:
+            entry = self.shared.get_json(self.SHARED_NAMESPACE, key)
+            if not isinstance(entry, dict) or self._is_expired(entry.get("ts", 0)):
                 return None
+            # Запись другого узла сохраняется локально вместе с её временем
+            with self._lock:
+                self._cache[key] = entry
+                self._save_unlocked()
+        if not entry:
+            return None
 
-            metadata = entry.get("metadata")
-            return dict(metadata) if isinstance(metadata, dict) else None
+        metadata = entry.get("metadata")
+        return dict(metadata) if isinstance(metadata, dict) else None
 
     def set(self, key: str, metadata: Dict[str, Any]) -> None:
+        entry = {"metadata": metadata, "ts": time.time()}
         with self._lock:
-            self._cache[key] = {"metadata": metadata, "ts": time.time()}
+            self._cache[key] = entry
             self._save_unlocked()
+        if self.shared is not None:
+            self.shared.set_json(self.SHARED_NAMESPACE, key, entry, self.ttl_seconds)
@@ -0,0 +1,131 @@
+import atexit
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+
+def mirror_host(url: str) -> str:
+    return urlparse(url).netloc
+
+
+class MirrorScoreboard:
+    """Статистика CDN-хостов: время до первого байта, скорость и ошибки.
+
+    По каждому хосту хранятся экспоненциально сглаженные TTFB, скорость
+    передачи и доля ошибок. По ним оценивается, сколько займёт скачивание
+    типичного трека, и ссылки упорядочиваются от лучшего зеркала к худшему.
+    Статистика сохраняется в JSON-файл и переживает перезапуск.
+    """
+
+    # Размер «типичного» трека для оценки времени скачивания
+    REFERENCE_BYTES = 10 * 1024 * 1024
+
+    # Вес нового наблюдения в сглаженных значениях
+    ALPHA = 0.3
+
+    # Как часто сбрасывать статистику на диск
+    SAVE_INTERVAL = 10.0
+
+    def __init__(self, stats_file: str = "cache/mirrors.json"):
+        self.stats_file = stats_file
+        self._hosts: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self._ensure_dir()
+        self._load()
+        atexit.register(self.flush)
+
+    def _ensure_dir(self) -> None:
+        stats_dir = os.path.dirname(self.stats_file)
+        if stats_dir:
+            os.makedirs(stats_dir, exist_ok=True)
+
+    def _load(self) -> None:
+        try:
+            if os.path.exists(self.stats_file):
+                with open(self.stats_file, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                    if isinstance(data, dict):
+                        self._hosts = data
+        except Exception:
+            # Если файл повреждён — просто начинаем с пустой статистики
+            self._hosts = {}
+
+    def _save_unlocked(self) -> None:
+        try:
+            with open(self.stats_file, "w", encoding="utf-8") as f:
+                json.dump(self._hosts, f, ensure_ascii=False)
+            self._dirty = False
+            self._saved_at = time.monotonic()
+        except Exception:
+            # Статистика — вспомогательная, при ошибке записи просто пропускаем
+            pass
+
+    def _touch_unlocked(self) -> None:
+        self._dirty = True
+        if time.monotonic() - self._saved_at >= self.SAVE_INTERVAL:
+            self._save_unlocked()
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._dirty:
+                self._save_unlocked()
+
+    def _smooth(self, old: Optional[float], new: float) -> float:
+        if old is None:
+            return new
+        return old + self.ALPHA * (new - old)
+
+    def record_success(self, host: str, ttfb: float, size: int, seconds: float) -> None:
+        with self._lock:
+            stats = self._hosts.setdefault(host, {})
+            stats["ttfb"] = self._smooth(stats.get("ttfb"), ttfb)
+            if size and seconds > 0:
+                stats["speed"] = self._smooth(stats.get("speed"), size / seconds)
+            stats["errors"] = self._smooth(stats.get("errors"), 0.0)
+            stats["ok"] = stats.get("ok", 0) + 1
+            stats["ts"] = time.time()
+            self._touch_unlocked()
+
+    def record_failure(self, host: str, size: int = 0, seconds: float = 0.0) -> None:
+        """Ошибка или слишком медленная передача; частичная скорость тоже учитывается"""
+        with self._lock:
+            stats = self._hosts.setdefault(host, {})
+            if size and seconds > 0:
+                stats["speed"] = self._smooth(stats.get("speed"), size / seconds)
+            stats["errors"] = self._smooth(stats.get("errors"), 1.0)
+            stats["failed"] = stats.get("failed", 0) + 1
+            stats["ts"] = time.time()
+            self._touch_unlocked()
+
+    def estimate(self, host: str) -> Optional[float]:
+        """Ожидаемое время скачивания типичного трека в секундах (None — хост ещё не встречался)"""
+        with self._lock:
+            stats = self._hosts.get(host)
+            if not stats or not stats.get("speed"):
+                if stats and stats.get("errors"):
+                    # Хост только ошибался: скорость неизвестна, но он заведомо хуже прочих
+                    return float("inf")
+                return None
+            seconds = stats.get("ttfb", 0.0) + self.REFERENCE_BYTES / stats["speed"]
+            return seconds / max(0.05, 1.0 - stats.get("errors", 0.0))
+
+    def rank(self, urls: List[str]) -> List[str]:
+        """Упорядочивает ссылки от лучшего зеркала к худшему.
+
+        Незнакомые хосты идут первыми, чтобы статистика по ним накопилась;
+        при равных оценках порядок случайный, чтобы нагрузка распределялась.
+        """
+        urls = list(urls)
+        random.shuffle(urls)
+
+        def key(url):
+            estimate = self.estimate(mirror_host(url))
+            return (0, 0.0) if estimate is None else (1, estimate)
+
+        return sorted(urls, key=key)
@@ -0,0 +1,351 @@
+import logging
+import os
+import re
+import shutil
+import tarfile
+import threading
+import time
+import zipfile
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+from utils.file_utils import sanitize_filename
+
+
+logger = logging.getLogger(__name__)
+
+SINK_LOCAL = "local"
+SINK_TAR = "tar"
+SINK_ZIP = "zip"
+SINK_S3 = "s3"
+
+SINK_KINDS = (SINK_LOCAL, SINK_TAR, SINK_ZIP, SINK_S3)
+ARCHIVE_KINDS = (SINK_TAR, SINK_ZIP)
+
+# Блок копирования в архив: файл трека не читается в память целиком
+COPY_CHUNK = 1024 * 1024
+
+# Минимальный размер части multipart-загрузки в S3 (кроме последней)
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+def sink_kind(config) -> str:
+    """Вид приёмника из OUTPUT_SINK (неизвестное значение — local)"""
+    kind = str(getattr(config, "OUTPUT_SINK", SINK_LOCAL)).lower()
+    if kind not in SINK_KINDS:
+        logger.warning("Неизвестный OUTPUT_SINK=%s, используется %s", kind, SINK_LOCAL)
+        return SINK_LOCAL
+    return kind
+
+
+class OutputSink(ABC):
+    """Приёмник готовых треков: куда попадает файл после записи тегов.
+
+    store() забирает временный файл (после успешного вызова его больше нет)
+    и возвращает, куда сохранён трек: путь, член архива или s3://-адрес.
+    output_path — путь, который трек получил бы в DOWNLOAD_DIR; приёмники,
+    пишущие не на диск, берут от него только путь относительно корня.
+    local — store() возвращает путь к файлу на диске (а не член архива или адрес в S3).
+    """
+
+    local = False
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    def relative_path(self, output_path: str) -> str:
+        relative = os.path.relpath(os.path.abspath(output_path), self.root)
+        if relative.startswith(os.pardir):
+            # Трек вне DOWNLOAD_DIR: в архиве или бакете — без абсолютной части пути
+            relative = os.path.abspath(output_path).lstrip(os.sep)
+        return relative.replace(os.sep, "/")
+
+    def ensure_dir(self, path: str) -> None:
+        """Готовит папку назначения (для приёмников, пишущих на диск)"""
+
+    def staging_dir(self, output_dir: str) -> Optional[str]:
+        """Где создавать временный файл трека (None — во временной папке системы)"""
+        return None
+
+    @abstractmethod
+    def store(self, temp_path: str, output_path: str) -> str:
+        """Сохраняет временный файл трека и возвращает, куда он сохранён"""
+
+    def close(self) -> None:
+        """Завершает запись (для архива — дописывает конец файла)"""
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class LocalSink(OutputSink):
+    """Сохранение в DOWNLOAD_DIR.
+
+    Временные файлы треков создаются в служебной папке STAGING_DIR внутри
+    DOWNLOAD_DIR: она на той же файловой системе, поэтому сохранение — это
+    переименование, а не копирование, а после падения процесса недокачанные
+    файлы не остаются в папках библиотеки. Файлы старше STALE_SECONDS
+    (брошенные упавшими процессами) удаляются при первом скачивании. Уже
+    созданные папки запоминаются, чтобы не повторять makedirs на каждый трек.
+    """
+
+    local = True
+
+    STAGING_DIR = ".staging"
+
+    # Временный файл старше суток точно не скачивается прямо сейчас
+    STALE_SECONDS = 24 * 3600
+
+    def __init__(self, root: str):
+        super().__init__(root)
+        self.staging_path = os.path.join(self.root, self.STAGING_DIR)
+        self._dirs = set()
+        self._swept = False
+        self._lock = threading.Lock()
+
+    def ensure_dir(self, path: str) -> None:
+        if not path or path in self._dirs:
+            return
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            self._dirs.add(path)
+
+    def staging_dir(self, output_dir: str) -> Optional[str]:
+        self.ensure_dir(output_dir)
+        self.ensure_dir(self.staging_path)
+        if not self._swept:
+            self._swept = True
+            self._sweep()
+        return self.staging_path
+
+    def _sweep(self) -> None:
+        """Удаляет временные файлы, брошенные упавшими процессами"""
+        deadline = time.time() - self.STALE_SECONDS
+        try:
+            entries = list(os.scandir(self.staging_path))
+        except OSError:
+            return
+        removed = 0
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.stat().st_mtime < deadline:
+                    os.unlink(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+        if removed:
+            logger.info("Удалено брошенных временных файлов: %s (%s)", removed, self.staging_path)
+
+    def store(self, temp_path: str, output_path: str) -> str:
+        self.ensure_dir(os.path.dirname(output_path))
+        shutil.move(temp_path, output_path)
+        return output_path
+
+
+class ArchiveSink(OutputSink):
+    """Архив задания (tar или zip) — треки дописываются в него по мере готовности.
+
+    Файл трека копируется в архив блоками по COPY_CHUNK, потоки скачивания
+    пишут по очереди. Архив открывается на дозапись: при продолжении
+    задания уже скачанные треки остаются в нём. Аудио уже сжато, поэтому
+    zip пишется без сжатия.
+    """
+
+    def __init__(self, root: str, archive_path: str, kind: str = SINK_TAR):
+        super().__init__(root)
+        self.archive_path = archive_path
+        self.kind = kind
+        self._archive = None
+        self._lock = threading.Lock()
+        self.files = 0
+        self.bytes = 0
+
+    def _open_unlocked(self):
+        # Архив создаётся при первом треке: задание без скачанных треков не оставляет пустой файл
+        if self._archive is None:
+            archive_dir = os.path.dirname(self.archive_path)
+            if archive_dir:
+                os.makedirs(archive_dir, exist_ok=True)
+            if self.kind == SINK_ZIP:
+                self._archive = zipfile.ZipFile(
+                    self.archive_path, "a", compression=zipfile.ZIP_STORED, allowZip64=True,
+                )
+            else:
+                self._archive = tarfile.open(self.archive_path, "a", format=tarfile.PAX_FORMAT)
+        return self._archive
+
+    @staticmethod
+    def archive_name(source: str) -> str:
+        """Имя архива по ссылке задания: https://music.yandex.ru/album/1 → album-1"""
+        path = urlsplit(source).path if "://" in source else os.path.splitext(os.path.basename(source))[0]
+        name = "-".join(part for part in re.split(r"[/\\]+", path) if part)
+        return sanitize_filename(name) or "download"
+
+    def store(self, temp_path: str, output_path: str) -> str:
+        member = self.relative_path(output_path)
+        size = os.path.getsize(temp_path)
+        with self._lock, open(temp_path, "rb") as src:
+            archive = self._open_unlocked()
+            if self.kind == SINK_ZIP:
+                info = zipfile.ZipInfo(member, date_time=time.localtime()[:6])
+                info.compress_type = zipfile.ZIP_STORED
+                with archive.open(info, "w", force_zip64=size > 0x7FFFFFFF) as dst:
+                    shutil.copyfileobj(src, dst, COPY_CHUNK)
+            else:
+                info = tarfile.TarInfo(member)
+                info.size = size
+                info.mtime = int(time.time())
+                archive.addfile(info, src)
+            self.files += 1
+            self.bytes += size
+        os.unlink(temp_path)
+        return f"{self.archive_path}:{member}"
+
+    def close(self) -> None:
+        with self._lock:
+            if self._archive is not None:
+                self._archive.close()
+                self._archive = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"archive": self.archive_path, "files": self.files, "bytes": self.bytes}
+
+
+class S3Sink(OutputSink):
+    """Загрузка в S3-совместимое хранилище (AWS S3, MinIO и т.п.) без копии на диске.
+
+    Файл больше одной части загружается multipart: части читаются из
+    временного файла и отправляются параллельно в upload_threads потоках,
+    поэтому в памяти одновременно не больше upload_threads частей; их объём
+    учитывается в бюджете памяти процесса. Нужен пакет boto3.
+    """
+
+    def __init__(self, root: str, bucket: str, prefix: str = "", client=None, part_size: int = 8 * 1024 * 1024,
+                 upload_threads: int = 4, memory=None):
+        super().__init__(root)
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = client
+        self.part_size = max(S3_MIN_PART_SIZE, part_size)
+        self.memory = memory
+        self._executor = ThreadPoolExecutor(max_workers=max(1, upload_threads), thread_name_prefix="s3-upload")
+        self._lock = threading.Lock()
+        self.files = 0
+        self.bytes = 0
+        self.parts = 0
+
+    @classmethod
+    def from_config(cls, config, root: str, memory=None) -> "S3Sink":
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("Для OUTPUT_SINK=s3 нужен пакет boto3: pip install boto3")
+
+        bucket = getattr(config, "S3_BUCKET", None)
+        if not bucket:
+            raise RuntimeError("Для OUTPUT_SINK=s3 нужно указать S3_BUCKET")
+        client = boto3.client(
+            "s3",
+            endpoint_url=getattr(config, "S3_ENDPOINT_URL", None) or None,
+            region_name=getattr(config, "S3_REGION", None) or None,
+            aws_access_key_id=getattr(config, "S3_ACCESS_KEY_ID", None) or None,
+            aws_secret_access_key=getattr(config, "S3_SECRET_ACCESS_KEY", None) or None,
+        )
+        return cls(
+            root,
+            bucket,
+            prefix=getattr(config, "S3_PREFIX", ""),
+            client=client,
+            part_size=max(5, getattr(config, "S3_PART_SIZE_MB", 8)) * 1024 * 1024,
+            upload_threads=getattr(config, "S3_UPLOAD_THREADS", 4),
+            memory=memory,
+        )
+
+    def _key(self, output_path: str) -> str:
+        relative = self.relative_path(output_path)
+        return f"{self.prefix}/{relative}" if self.prefix else relative
+
+    def _upload_part(self, temp_path: str, key: str, upload_id: str, number: int, offset: int, size: int):
+        if self.memory is not None:
+            # Только учёт: загрузка идёт под резервом потока скачивания, ждать здесь нельзя
+            self.memory.charge(size)
+        try:
+            with open(temp_path, "rb") as f:
+                f.seek(offset)
+                data = f.read(size)
+            response = self.client.upload_part(
+                Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=data,
+            )
+        finally:
+            if self.memory is not None:
+                self.memory.uncharge(size)
+        return {"PartNumber": number, "ETag": response["ETag"]}
+
+    def store(self, temp_path: str, output_path: str) -> str:
+        key = self._key(output_path)
+        size = os.path.getsize(temp_path)
+        if size <= self.part_size:
+            with open(temp_path, "rb") as f:
+                self.client.put_object(Bucket=self.bucket, Key=key, Body=f)
+            parts = 1
+        else:
+            upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=key)["UploadId"]
+            futures = []
+            try:
+                for number, offset in enumerate(range(0, size, self.part_size), start=1):
+                    futures.append(self._executor.submit(
+                        self._upload_part, temp_path, key, upload_id, number, offset,
+                        min(self.part_size, size - offset),
+                    ))
+                uploaded = [future.result() for future in futures]
+                self.client.complete_multipart_upload(
+                    Bucket=self.bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": uploaded},
+                )
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                try:
+                    self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+                except Exception as e:
+                    logger.warning("Не удалось отменить загрузку %s: %s", key, e)
+                raise
+            parts = len(uploaded)
+        with self._lock:
+            self.files += 1
+            self.bytes += size
+            self.parts += parts
+        os.unlink(temp_path)
+        return f"s3://{self.bucket}/{key}"
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"bucket": self.bucket, "files": self.files, "bytes": self.bytes, "parts": self.parts}
+
+
+def create_sink(config, memory=None) -> OutputSink:
+    """Общий приёмник загрузчика: S3 или DOWNLOAD_DIR.
+
+    Архивы создаются на каждое задание отдельно (ArchiveSink), поэтому
+    здесь для tar/zip возвращается LocalSink — он используется там, где
+    задания нет (демон, воркеры очереди).
+    """
+    root = getattr(config, "DOWNLOAD_DIR", "downloads")
+    if sink_kind(config) == SINK_S3:
+        return S3Sink.from_config(config, root, memory=memory)
+    return LocalSink(root)
+
+
+def open_job_sink(config, source: str) -> Optional[ArchiveSink]:
+    """Архив для задания, если OUTPUT_SINK=tar/zip (иначе None — используется общий приёмник)"""
+    kind = sink_kind(config)
+    if kind not in ARCHIVE_KINDS:
+        return None
+    root = getattr(config, "DOWNLOAD_DIR", "downloads")
+    archive_dir = getattr(config, "OUTPUT_ARCHIVE_DIR", "") or root
+    archive_path = os.path.join(archive_dir, f"{ArchiveSink.archive_name(source)}.{kind}")
+    return ArchiveSink(root, archive_path, kind)
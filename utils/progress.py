@@ -0,0 +1,215 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_MODES = ("bar", "summary", "off")
+
+# Период перерисовки по умолчанию для каждого режима (в секундах)
+_DEFAULT_INTERVALS = {"bar": 0.5, "summary": 10.0, "off": 0.0}
+
+
+def format_bytes(size: float) -> str:
+    """Форматирует размер в байтах в человекочитаемый вид."""
+    if abs(size) < 1024:
+        return f"{int(size)} Б"
+    for unit in ("КБ", "МБ"):
+        size /= 1024
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+    return f"{size / 1024:.1f} ГБ"
+
+
+def format_duration(seconds: float) -> str:
+    """Форматирует длительность в секундах как ЧЧ:ММ:СС (или ММ:СС)."""
+    seconds = int(max(0, seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours:d}:{minutes:02d}:{secs:02d}"
+    return f"{minutes:02d}:{secs:02d}"
+
+
+class _Counter:
+    """Счётчики одного потока. Пишет в них только поток-владелец."""
+
+    __slots__ = ("bytes", "tracks")
+
+    def __init__(self):
+        self.bytes = 0
+        self.tracks = 0
+
+
+class ProgressAggregator:
+    """Единый прогресс для всех потоков загрузки.
+
+    Каждый поток увеличивает только свои счётчики, поэтому на горячем пути
+    нет блокировок. Отдельный поток раз в interval секунд суммирует счётчики
+    и перерисовывает один общий progress bar ("bar"), печатает однострочную
+    сводку ("summary") или ничего не выводит ("off").
+
+    Счётчики завершившихся потоков (пулы пачек, попытки скачивания)
+    складываются в общий итог и удаляются из списка, поэтому в долгоживущем
+    процессе (демон, воркер с --follow) список не растёт.
+    """
+
+    def __init__(self, mode: str = "bar", interval: Optional[float] = None):
+        self.mode = mode if mode in PROGRESS_MODES else "bar"
+        if interval is None or interval <= 0:
+            interval = _DEFAULT_INTERVALS[self.mode]
+        self.interval = interval
+        self._local = threading.local()
+        # (поток-владелец, его счётчики); итоги завершившихся потоков — в _retired
+        self._counters: List[Tuple[threading.Thread, _Counter]] = []
+        self._retired = _Counter()
+        self._register_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config) -> "ProgressAggregator":
+        return cls(
+            mode=str(getattr(config, "PROGRESS_MODE", "bar")).lower(),
+            interval=getattr(config, "PROGRESS_INTERVAL", None),
+        )
+
+    def _counter(self) -> _Counter:
+        counter = getattr(self._local, "counter", None)
+        if counter is None:
+            # Блокировка берётся один раз за жизнь потока — при регистрации
+            counter = _Counter()
+            with self._register_lock:
+                self._retire_finished()
+                self._counters.append((threading.current_thread(), counter))
+            self._local.counter = counter
+        return counter
+
+    def _retire_finished(self) -> None:
+        """Переносит счётчики завершившихся потоков в общий итог (под _register_lock).
+        Завершившийся поток в свои счётчики больше не пишет, поэтому перенос безопасен"""
+        alive = []
+        for thread, counter in self._counters:
+            if thread.is_alive():
+                alive.append((thread, counter))
+            else:
+                self._retired.bytes += counter.bytes
+                self._retired.tracks += counter.tracks
+        self._counters = alive
+
+    def add_bytes(self, count: int) -> None:
+        self._counter().bytes += count
+
+    def track_done(self) -> None:
+        self._counter().tracks += 1
+
+    def track_message(self, text: str, log: bool = True) -> None:
+        """Сообщение об отдельном треке ("Скачиваю: ...", "Сохранено: ...").
+
+        Сообщение пишется в лог (log=False — если вызывающий код уже записал
+        его сам, с подробностями), а на экран выводится только в режиме bar —
+        над общим progress bar, не ломая его. В режимах summary и off вывод
+        остаётся сводным: такие сообщения есть только в логе.
+        """
+        if log:
+            logger.info(text.strip())
+        if self.mode != "bar":
+            return
+        from tqdm import tqdm
+
+        tqdm.write(text)
+
+    def totals(self) -> Tuple[int, int]:
+        """Возвращает (байт скачано, треков завершено) за всё время."""
+        with self._register_lock:
+            self._retire_finished()
+            total_bytes = self._retired.bytes
+            total_tracks = self._retired.tracks
+            for _, counter in self._counters:
+                total_bytes += counter.bytes
+                total_tracks += counter.tracks
+        return total_bytes, total_tracks
+
+    @contextmanager
+    def job(self, desc: str, total_tracks: Optional[int] = None, colour: str = "green"):
+        """Отображает прогресс одной задачи (альбома, плейлиста и т.п.)."""
+        if self.mode == "off":
+            yield self
+            return
+
+        reporter = _JobReporter(self, desc, total_tracks, colour)
+        reporter.start()
+        try:
+            yield self
+        finally:
+            reporter.stop()
+
+
+class _JobReporter(threading.Thread):
+    """Фоновый поток, перерисовывающий прогресс с фиксированной частотой."""
+
+    def __init__(self, aggregator: ProgressAggregator, desc: str, total_tracks: Optional[int], colour: str):
+        super().__init__(name="progress-reporter", daemon=True)
+        self.aggregator = aggregator
+        self.desc = desc
+        self.total_tracks = total_tracks
+        self.colour = colour
+        self._stop_event = threading.Event()
+        self._base_bytes, self._base_tracks = aggregator.totals()
+        self._started_at = time.monotonic()
+        self._pbar = None
+
+    def _snapshot(self) -> Tuple[int, int, float]:
+        total_bytes, total_tracks = self.aggregator.totals()
+        elapsed = time.monotonic() - self._started_at
+        return total_bytes - self._base_bytes, total_tracks - self._base_tracks, elapsed
+
+    def _render_bar(self) -> None:
+        done_bytes, done_tracks, elapsed = self._snapshot()
+        rate = done_bytes / elapsed if elapsed > 0 else 0
+        self._pbar.n = done_tracks
+        self._pbar.set_postfix_str(f"{format_bytes(done_bytes)}, {format_bytes(rate)}/с", refresh=False)
+        self._pbar.refresh()
+
+    def _render_summary(self) -> None:
+        done_bytes, done_tracks, elapsed = self._snapshot()
+        rate = done_bytes / elapsed if elapsed > 0 else 0
+        tracks = f"{done_tracks}/{self.total_tracks}" if self.total_tracks else str(done_tracks)
+        print(
+            f"[прогресс] {self.desc}: треков {tracks}, {format_bytes(done_bytes)}, "
+            f"{format_bytes(rate)}/с, прошло {format_duration(elapsed)}",
+            flush=True,
+        )
+
+    def run(self) -> None:
+        if self.aggregator.mode == "bar":
+            # tqdm нужен только в режиме bar — импортируем при первом использовании
+            from tqdm import tqdm
+
+            self._pbar = tqdm(
+                total=self.total_tracks,
+                desc=self.desc,
+                unit=" трек",
+                bar_format='{desc}: {percentage:3.0f}%|{bar}| {n}/{total} [{elapsed}<{remaining}{postfix}]',
+                ncols=100,
+                colour=self.colour,
+                ascii=' ░▒▓█',
+                dynamic_ncols=True,
+                mininterval=self.aggregator.interval,
+            )
+            render = self._render_bar
+        else:
+            render = self._render_summary
+
+        try:
+            while not self._stop_event.wait(self.aggregator.interval):
+                render()
+            render()
+        finally:
+            if self._pbar is not None:
+                self._pbar.close()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
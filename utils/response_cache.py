@@ -0,0 +1,197 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Optional
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    endpoint TEXT NOT NULL,
+    body BLOB NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    expires_at REAL NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_lru ON responses(last_used);
+"""
+
+_revalidation = threading.local()
+
+
+@contextmanager
+def revalidate():
+    """Внутри блока (в этом потоке) свежие ответы тоже перепроверяются у сервера условным запросом.
+    Неизменившийся ответ приходит как 304 без тела, изменившийся — заменяет сохранённый"""
+    previous = getattr(_revalidation, "active", False)
+    _revalidation.active = True
+    try:
+        yield
+    finally:
+        _revalidation.active = previous
+
+
+def revalidation_forced() -> bool:
+    return getattr(_revalidation, "active", False)
+
+
+class ResponseCache:
+    """Кэш ответов API каталога на SQLite с ограничением по размеру.
+
+    Хранит тело ответа вместе с валидаторами (ETag, Last-Modified) и сроком
+    свежести. Когда суммарный размер тел превышает max_bytes, вытесняются
+    записи, к которым дольше всего не обращались (LRU).
+
+    С shared (utils.shared_cache.SharedCache) промах проверяется в общем
+    кэше узлов, а свежие ответы отправляются туда со сроком жизни, равным
+    оставшейся свежести.
+    """
+
+    # Пространство ключей в общем кэше
+    SHARED_NAMESPACE = "api"
+
+    def __init__(self, db_file: str = "cache/api.sqlite3", max_bytes: int = 64 * 1024 * 1024, shared=None):
+        self.db_file = db_file
+        self.max_bytes = max_bytes
+        self.shared = shared
+        db_dir = os.path.dirname(db_file)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        with self._lock:
+            self._conn.executescript(_SCHEMA)
+            self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _execute(self, sql: str, params: Iterable[Any] = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._conn.execute(sql, tuple(params))
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Запись по ключу (в том числе устаревшая — её можно перепроверить у сервера)"""
+        row = self._execute("SELECT * FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return self._get_shared(key)
+        self._execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        return dict(row)
+
+    @staticmethod
+    def _encode_shared(endpoint: str, body: bytes, expires_at: float, etag: Optional[str],
+                       last_modified: Optional[str]) -> bytes:
+        # Заголовок записи одной строкой JSON, за ним — тело ответа как есть
+        header = {"endpoint": endpoint, "expires_at": expires_at, "etag": etag, "last_modified": last_modified}
+        return json.dumps(header).encode("utf-8") + b"\n" + bytes(body)
+
+    def _get_shared(self, key: str) -> Optional[Dict[str, Any]]:
+        if self.shared is None:
+            return None
+        value = self.shared.get(self.SHARED_NAMESPACE, key)
+        if value is None:
+            return None
+        header, _, body = value.partition(b"\n")
+        try:
+            entry = json.loads(header.decode("utf-8"))
+        except ValueError:
+            return None
+        # Запись другого узла сохраняется локально (обратно в общий кэш не отправляется)
+        self._put_local(key, entry["endpoint"], body, entry["expires_at"], entry["etag"], entry["last_modified"])
+        entry.update({"key": key, "body": body})
+        return entry
+
+    def put(
+        self,
+        key: str,
+        endpoint: str,
+        body: bytes,
+        expires_at: float,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> None:
+        self._put_local(key, endpoint, body, expires_at, etag, last_modified)
+        self._put_shared(key, endpoint, body, expires_at, etag, last_modified)
+
+    def _put_shared(self, key: str, endpoint: str, body: bytes, expires_at: float, etag: Optional[str],
+                    last_modified: Optional[str]) -> None:
+        ttl = expires_at - time.time()
+        if self.shared is not None and ttl > 0:
+            self.shared.set(
+                self.SHARED_NAMESPACE, key, self._encode_shared(endpoint, body, expires_at, etag, last_modified), ttl,
+            )
+
+    def _put_local(self, key: str, endpoint: str, body: bytes, expires_at: float, etag: Optional[str],
+                   last_modified: Optional[str]) -> None:
+        size = len(body)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if old is not None:
+                self._total -= old[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, endpoint, body, etag, last_modified, expires_at, size, "
+                "last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, endpoint, sqlite3.Binary(body), etag, last_modified, expires_at, size, time.time()),
+            )
+            self._total += size
+            self._evict_unlocked()
+
+    def touch(self, key: str, expires_at: float) -> None:
+        """Продлевает свежесть записи после ответа 304 Not Modified"""
+        self._execute(
+            "UPDATE responses SET expires_at = ?, last_used = ? WHERE key = ?", (expires_at, time.time(), key),
+        )
+        if self.shared is not None:
+            row = self._execute("SELECT * FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._put_shared(key, row["endpoint"], row["body"], expires_at, row["etag"], row["last_modified"])
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total -= row[0]
+
+    def _evict_unlocked(self) -> None:
+        while self._total > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_used LIMIT 32"
+            ).fetchall()
+            if not rows:
+                self._total = 0
+                return
+            for row in rows:
+                if self._total <= self.max_bytes:
+                    return
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (row["key"],))
+                self._total -= row["size"]
+
+    def note(self, outcome: str) -> None:
+        """Учитывает исход запроса: 'hits', 'revalidated' или 'misses'"""
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {
+                "entries": entries,
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "revalidated": self.revalidated,
+                "misses": self.misses,
+            }
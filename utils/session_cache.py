@@ -0,0 +1,182 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+# Поля состояния аккаунта, которые сохраняются в кэш сессии: uid нужен клиенту
+# для запросов от имени аккаунта, подписка и права — отпечатку кэша кодеков
+# (utils.codec_cache.account_fingerprint). Имя, логин, почта, телефоны и прочие
+# личные данные в файл не попадают
+_STATUS_FIELDS = {
+    "account": ("now", "service_available", "uid"),
+    "permissions": ("until", "values", "default"),
+    "plus": ("has_plus", "is_tutorial_completed"),
+}
+
+
+def minimal_status(status: Dict[str, Any]) -> Dict[str, Any]:
+    """Оставляет в словаре Status.to_dict() только поля из _STATUS_FIELDS"""
+    result = {}
+    for name, fields in _STATUS_FIELDS.items():
+        value = status.get(name)
+        if isinstance(value, dict):
+            result[name] = {field: value.get(field) for field in fields if field in value}
+    return result
+
+
+class ClientSessionCache:
+    """Файловый кэш состояния аккаунта (результата Client.init()).
+
+    Позволяет коротким повторным запускам не делать сетевой запрос
+    account/status перед началом работы. Сам токен в файл не пишется —
+    записи адресуются его хэшем; из состояния аккаунта хранятся только
+    поля, нужные для работы (см. minimal_status).
+    """
+
+    def __init__(self, cache_file: str = "cache/session.json", ttl_hours: float = 12):
+        self.cache_file = cache_file
+        self.ttl_seconds = ttl_hours * 3600 if ttl_hours else 0
+
+    @staticmethod
+    def _token_key(token: Optional[str]) -> str:
+        return hashlib.sha256(str(token or "").encode("utf-8")).hexdigest()
+
+    def _read(self) -> Dict[str, Any]:
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+                return data if isinstance(data, dict) else {}
+        except Exception:
+            return {}
+
+    def load(self, token: Optional[str]) -> Optional[Dict[str, Any]]:
+        entry = self._read().get(self._token_key(token))
+        if not isinstance(entry, dict):
+            return None
+        if self.ttl_seconds and (time.time() - entry.get("ts", 0)) > self.ttl_seconds:
+            return None
+        status = entry.get("status")
+        return minimal_status(status) if isinstance(status, dict) else None
+
+    def save(self, token: Optional[str], status: Dict[str, Any]) -> None:
+        data = self._read()
+        # Записи, сохранённые прежними версиями целиком, при перезаписи тоже урезаются
+        for entry in data.values():
+            if isinstance(entry, dict) and isinstance(entry.get("status"), dict):
+                entry["status"] = minimal_status(entry["status"])
+        data[self._token_key(token)] = {"status": minimal_status(status), "ts": time.time()}
+        try:
+            cache_dir = os.path.dirname(self.cache_file)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            tmp_file = f"{self.cache_file}.tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_file, self.cache_file)
+        except Exception:
+            # Кэш — вспомогательный, при ошибке записи просто пропускаем
+            pass
+
+
+def configured_tokens(config) -> List[str]:
+    """Токены из YANDEX_MUSIC_TOKEN и YANDEX_MUSIC_TOKENS (через запятую) без повторов"""
+    extra = getattr(config, "YANDEX_MUSIC_TOKENS", None) or []
+    if isinstance(extra, str):
+        extra = extra.split(",")
+    tokens = []
+    for token in [getattr(config, "YANDEX_MUSIC_TOKEN", None)] + list(extra):
+        token = (token or "").strip()
+        if token and token not in tokens:
+            tokens.append(token)
+    return tokens
+
+
+def _create_pooled_client(config, tokens: List[str]):
+    """Клиент, запросы которого распределяются по пулу аккаунтов (utils.account_pool)"""
+    from utils.account_pool import Account, AccountPool, NoHealthyAccountsError, PooledRequest
+
+    max_rps = getattr(config, "ACCOUNT_MAX_RPS", 0.0)
+    accounts = []
+    for token in tokens:
+        label = AccountPool.token_label(token)
+        try:
+            client = create_client(config, token)
+        except Exception as e:
+            logger.error("Не удалось инициализировать аккаунт %s: %s", label, e)
+            print(f"Аккаунт {label} пропущен: {e}")
+            continue
+        accounts.append(Account(label, client, client._request, max_rps))
+    if not accounts:
+        raise NoHealthyAccountsError("ни один токен из пула не удалось инициализировать")
+
+    pool = AccountPool(
+        accounts,
+        cooldown_seconds=getattr(config, "ACCOUNT_COOLDOWN_SECONDS", 30.0),
+        max_cooldown_seconds=getattr(config, "ACCOUNT_MAX_COOLDOWN_SECONDS", 600.0),
+        auth_failures=getattr(config, "ACCOUNT_AUTH_FAILURES", 3),
+    )
+    # Основным клиентом служит клиент первого аккаунта, но все его запросы идут через пул;
+    # данные его владельца запрашиваются только его токеном
+    primary = accounts[0].client
+    account = getattr(getattr(primary, "me", None), "account", None)
+    owner_ids = (getattr(account, "uid", None), getattr(account, "login", None))
+    primary._request = PooledRequest(pool, primary._request, owner_ids)
+    primary.account_pool = pool
+    logger.info("Пул аккаунтов: %s", ", ".join(account.label for account in accounts))
+    return primary
+
+
+def create_client(config, token: Optional[str] = None):
+    """Создаёт клиент Яндекс Музыки, по возможности без сетевого Client.init().
+
+    Если включён кэш сессии и в нём есть свежая запись для токена,
+    состояние аккаунта восстанавливается из файла. Если в конфигурации
+    несколько токенов (YANDEX_MUSIC_TOKENS), запросы клиента распределяются
+    по пулу аккаунтов.
+    """
+    if token is None:
+        tokens = configured_tokens(config)
+        if len(tokens) > 1:
+            return _create_pooled_client(config, tokens)
+        token = tokens[0] if tokens else None
+
+    # Тяжёлый пакет импортируем только при первом создании клиента
+    from yandex_music import Client, Status
+
+    request = None
+    if getattr(config, "API_CACHE_ENABLED", True):
+        try:
+            from utils.caching_request import CachingRequest
+        except ImportError as e:
+            # Кэш опирается на внутренности yandex_music.utils.request, которых нет в старых версиях
+            logger.warning("Кэш ответов API отключён: нужна yandex-music 3.2.2 или новее (%s)", e)
+        else:
+            request = CachingRequest.from_config(config)
+    client = Client(token, request=request)
+
+    session_cache = None
+    if getattr(config, "CLIENT_SESSION_CACHE_ENABLED", True):
+        session_cache = ClientSessionCache(
+            getattr(config, "CLIENT_SESSION_CACHE_FILE", "cache/session.json"),
+            getattr(config, "CLIENT_SESSION_TTL_HOURS", 12),
+        )
+        cached = session_cache.load(token)
+        if cached:
+            try:
+                client.me = Status.de_json(cached, client)
+                if client.me is not None and client.me.account is not None:
+                    client.account_uid = client.me.account.uid
+                logger.info("Состояние аккаунта восстановлено из кэша сессии")
+                return client
+            except Exception:
+                logger.warning("Кэш сессии повреждён, выполняется Client.init()")
+
+    client.init()
+    if session_cache is not None and client.me is not None:
+        session_cache.save(token, client.me.to_dict())
+    return client
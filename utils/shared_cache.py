@@ -0,0 +1,301 @@
+import atexit
+import json
+import logging
+import queue
+import socket
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+
+logger = logging.getLogger(__name__)
+
+# Сколько записей отправляется на сервер одним пакетом команд
+WRITE_BATCH = 64
+
+
+class RespError(Exception):
+    """Сервер ответил ошибкой (-ERR ...)"""
+
+
+class RespConnection:
+    """Одно соединение с сервером по протоколу Redis (RESP2): только то, что нужно кэшу"""
+
+    def __init__(self, host: str, port: int, password: Optional[str] = None, username: Optional[str] = None,
+                 db: int = 0, timeout: float = 0.5):
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile("rb")
+        try:
+            if password:
+                # С именем пользователя — ACL Redis 6+, без него — обычный пароль
+                self.execute(*(("AUTH", username, password) if username else ("AUTH", password)))
+            if db:
+                self.execute("SELECT", db)
+        except BaseException:
+            self.close()
+            raise
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    def _read(self):
+        line = self._file.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("соединение с кэшем закрыто")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body
+        if kind == b"-":
+            return RespError(body.decode("utf-8", "replace"))
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError("соединение с кэшем закрыто")
+            return data[:-2]
+        if kind == b"*":
+            count = int(body)
+            return None if count < 0 else [self._read() for _ in range(count)]
+        raise ConnectionError(f"неожиданный ответ сервера: {line[:32]!r}")
+
+    def pipeline(self, commands: List[Tuple]) -> list:
+        """Отправляет команды одним пакетом и читает ответы по порядку (ошибки — как RespError в списке)"""
+        self._sock.sendall(b"".join(self._encode(command) for command in commands))
+        return [self._read() for _ in commands]
+
+    def execute(self, *args):
+        reply = self.pipeline([args])[0]
+        if isinstance(reply, RespError):
+            raise reply
+        return reply
+
+    def close(self) -> None:
+        try:
+            self._file.close()
+            self._sock.close()
+        except OSError:
+            pass
+
+
+class SharedCache:
+    """Общий для нескольких узлов уровень кэша на сервере с протоколом Redis.
+
+    Стоит за локальными кэшами (метаданные, доступность кодеков, ответы API
+    каталога): чтение идёт сначала из локального кэша, при промахе — отсюда,
+    и найденное сохраняется локально. Запись — отложенная: значение
+    кладётся в очередь, и фоновый поток отправляет накопившееся пакетом
+    команд SET ... PX, так что потоки скачивания не ждут сети. У каждого
+    ключа свой срок жизни.
+
+    Кэш вспомогательный: при ошибке соединения уровень отключается на
+    retry_seconds, чтение возвращает промах, а запись отбрасывается —
+    загрузчик продолжает работать только с локальными кэшами.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379, password: Optional[str] = None,
+                 username: Optional[str] = None, db: int = 0, prefix: str = "ymd:", timeout: float = 0.5,
+                 retry_seconds: float = 30.0, queue_size: int = 1024):
+        self.address = (host, port)
+        self.password = password
+        self.username = username
+        self.db = db
+        self.prefix = prefix
+        self.timeout = timeout
+        self.retry_seconds = retry_seconds
+        self._connections: "queue.LifoQueue[RespConnection]" = queue.LifoQueue()
+        self._writes: "queue.Queue[Tuple[str, bytes, int]]" = queue.Queue(maxsize=max(1, queue_size))
+        self._lock = threading.Lock()
+        self._down_until = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.dropped = 0
+        self.errors = 0
+        self._writer = threading.Thread(target=self._write_loop, name="shared-cache-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.flush)
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs: Any) -> "SharedCache":
+        """redis://[[user]:password@]host[:port][/db]"""
+        parts = urlsplit(url)
+        if parts.scheme not in ("redis", ""):
+            raise ValueError(f"Неподдерживаемая схема SHARED_CACHE_URL: {parts.scheme}")
+        db = parts.path.strip("/")
+        return cls(
+            host=parts.hostname or "127.0.0.1",
+            port=parts.port or 6379,
+            password=unquote(parts.password) if parts.password else None,
+            username=unquote(parts.username) if parts.username else None,
+            db=int(db) if db else 0,
+            **kwargs,
+        )
+
+    # Подключение и отключение уровня
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self._down_until
+
+    def _connection(self) -> RespConnection:
+        try:
+            return self._connections.get_nowait()
+        except queue.Empty:
+            return RespConnection(
+                *self.address, password=self.password, username=self.username, db=self.db, timeout=self.timeout,
+            )
+
+    def _release(self, connection: RespConnection) -> None:
+        self._connections.put(connection)
+
+    def _fail(self, error: Exception) -> None:
+        with self._lock:
+            self.errors += 1
+            was_up = self._down_until <= time.monotonic()
+            self._down_until = time.monotonic() + self.retry_seconds
+        # Остальные соединения, скорее всего, тоже оборваны: после паузы подключаемся заново
+        while True:
+            try:
+                self._connections.get_nowait().close()
+            except queue.Empty:
+                break
+        if was_up:
+            logger.warning(
+                "Общий кэш %s:%s недоступен (%s), следующие %s с используется только локальный кэш",
+                *self.address, error, self.retry_seconds,
+            )
+
+    def _run(self, commands: List[Tuple]) -> Optional[list]:
+        """Выполняет команды; None — уровень недоступен"""
+        if not self.available:
+            return None
+        try:
+            connection = self._connection()
+        except (OSError, RespError) as e:
+            self._fail(e)
+            return None
+        try:
+            replies = connection.pipeline(commands)
+        except (OSError, ValueError) as e:
+            connection.close()
+            self._fail(e)
+            return None
+        self._release(connection)
+        return replies
+
+    # Чтение и запись
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}{namespace}:{key}"
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        replies = self._run([("GET", self._key(namespace, key))])
+        value = replies[0] if replies else None
+        with self._lock:
+            if isinstance(value, bytes):
+                self.hits += 1
+                return value
+            self.misses += 1
+        return None
+
+    def set(self, namespace: str, key: str, value: bytes, ttl: float) -> None:
+        """Отложенная запись с временем жизни ttl секунд (0 — без срока)"""
+        if not self.available:
+            with self._lock:
+                self.dropped += 1
+            return
+        try:
+            self._writes.put_nowait((self._key(namespace, key), value, int(ttl * 1000)))
+        except queue.Full:
+            # Очередь не успевает уходить на сервер: кэш вспомогательный, запись отбрасывается
+            with self._lock:
+                self.dropped += 1
+
+    def get_json(self, namespace: str, key: str) -> Optional[Any]:
+        value = self.get(namespace, key)
+        if value is None:
+            return None
+        try:
+            return json.loads(value.decode("utf-8"))
+        except ValueError:
+            return None
+
+    def set_json(self, namespace: str, key: str, value: Any, ttl: float) -> None:
+        self.set(namespace, key, json.dumps(value, ensure_ascii=False).encode("utf-8"), ttl)
+
+    def _write_loop(self) -> None:
+        while True:
+            item = self._writes.get()
+            batch = [item]
+            while len(batch) < WRITE_BATCH:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(batch)
+            for _ in batch:
+                self._writes.task_done()
+
+    def _write(self, batch) -> None:
+        commands = [
+            ("SET", key, value, "PX", ttl) if ttl > 0 else ("SET", key, value)
+            for key, value, ttl in batch
+        ]
+        replies = self._run(commands)
+        with self._lock:
+            if replies is None:
+                self.dropped += len(batch)
+            else:
+                self.writes += sum(1 for reply in replies if not isinstance(reply, RespError))
+
+    def flush(self, timeout: float = 2.0) -> None:
+        """Дожидается отправки отложенных записей (не дольше timeout секунд)"""
+        deadline = time.monotonic() + timeout
+        while self._writes.unfinished_tasks and time.monotonic() < deadline and self.available:
+            time.sleep(0.01)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "address": "%s:%s" % self.address,
+                "available": self.available,
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "pending": self._writes.qsize(),
+            }
+
+
+_shared_cache: Optional[SharedCache] = None
+_shared_cache_lock = threading.Lock()
+
+
+def shared_cache(config) -> Optional[SharedCache]:
+    """Общий на процесс уровень кэша из SHARED_CACHE_URL (None — не настроен)"""
+    global _shared_cache
+    url = getattr(config, "SHARED_CACHE_URL", "")
+    if not url:
+        return None
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = SharedCache.from_url(
+                url,
+                prefix=getattr(config, "SHARED_CACHE_PREFIX", "ymd:"),
+                timeout=getattr(config, "SHARED_CACHE_TIMEOUT", 0.5),
+                retry_seconds=getattr(config, "SHARED_CACHE_RETRY_SECONDS", 30.0),
+            )
+        return _shared_cache
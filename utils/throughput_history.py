@@ -0,0 +1,63 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+
+class ThroughputHistory:
+    """История фактической скорости скачивания.
+
+    После каждой пачки треков запоминается, сколько байт скачано и за какое
+    время (всеми потоками вместе). По последним записям оценивается время
+    скачивания нового задания в режиме планирования.
+    """
+
+    # Сколько последних пачек учитывать
+    WINDOW = 20
+
+    # Слишком маленькие пачки не показательны
+    MIN_BYTES = 1024 * 1024
+    MIN_SECONDS = 1.0
+
+    def __init__(self, history_file: str = "cache/throughput.json"):
+        self.history_file = history_file
+        self._entries: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        history_dir = os.path.dirname(history_file)
+        if history_dir:
+            os.makedirs(history_dir, exist_ok=True)
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            if os.path.exists(self.history_file):
+                with open(self.history_file, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                    if isinstance(data, list):
+                        self._entries = data[-self.WINDOW:]
+        except Exception:
+            # Если файл повреждён — просто начинаем с пустой истории
+            self._entries = []
+
+    def record(self, size: int, seconds: float, workers: int) -> None:
+        if size < self.MIN_BYTES or seconds < self.MIN_SECONDS:
+            return
+        with self._lock:
+            self._entries.append({"bytes": size, "seconds": seconds, "workers": workers, "ts": time.time()})
+            self._entries = self._entries[-self.WINDOW:]
+            try:
+                with open(self.history_file, "w", encoding="utf-8") as f:
+                    json.dump(self._entries, f)
+            except Exception:
+                # История — вспомогательная, при ошибке записи просто пропускаем
+                pass
+
+    def estimate(self) -> Optional[float]:
+        """Средняя скорость последних пачек в байтах в секунду (None — истории нет)"""
+        with self._lock:
+            total_bytes = sum(entry["bytes"] for entry in self._entries)
+            total_seconds = sum(entry["seconds"] for entry in self._entries)
+        if not total_seconds:
+            return None
+        return total_bytes / total_seconds